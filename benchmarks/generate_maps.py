@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Generator of synthetic OziExplorer .map files for benchmarks:
+#   python benchmarks/generate_maps.py OUT_DIR [--count N] [--seed S]
+import argparse
+import math
+import os
+import random
+import struct
+import zlib
+
+from ozi_map.attr_dict import AttrDict
+from ozi_map.ozi_to_maprec import get_srs_as_proj4
+from ozi_map.transformers import get_transformer
+
+
+DATUMS = ['WGS 84', 'Pulkovo 1942', 'Pulkovo 1942 (1)', 'Pulkovo 1942 (2)']
+PROJECTIONS = ['Latitude/Longitude', 'Transverse Mercator', 'Lambert Conformal Conic', 'Mercator']
+GCP_TYPES = ['latlon', 'proj']
+
+EMPTY_GCP_LINE = 'Point%02d,xy,     ,     ,in, deg,    ,        ,N,    ,        ,E, grid,   ,           ,           ,N'
+
+
+class MapSpec(object):
+    def __init__(self, datum='WGS 84', projection='Transverse Mercator', gcps_count=4, gcp_type='latlon',
+                 cutline_points=4, image_size=(8000, 6000), center=(37.5, 55.7), extent=(0.5, 0.3), seed=0,
+                 name=None):
+        self._name = name
+        self.datum = datum
+        self.projection = projection
+        self.gcps_count = gcps_count
+        self.gcp_type = gcp_type if projection != 'Latitude/Longitude' else 'latlon'
+        self.cutline_points = cutline_points
+        self.image_size = image_size
+        self.center = center
+        self.extent = extent
+        self.seed = seed
+
+    @property
+    def name(self):
+        if self._name is not None:
+            return self._name
+        return '%s_%s_%dgcp_%s_%dpt' % (
+            self.datum.replace(' ', '').replace('(', '').replace(')', ''),
+            ''.join(w[0] for w in self.projection.split()).replace('/', ''),
+            self.gcps_count, self.gcp_type, self.cutline_points)
+
+
+def _projection_params(spec):
+    lon, lat = spec.center
+    zone_lon = math.floor(lon / 6) * 6 + 3
+    if spec.projection == 'Transverse Mercator':
+        return dict(lat_origin=0.0, lon_origin=zone_lon, k_factor=1.0,
+                    false_easting=(zone_lon + 3) / 6 * 1000000 + 500000, false_northing=0.0)
+    if spec.projection == 'Lambert Conformal Conic':
+        return dict(lat_origin=lat, lon_origin=lon, lat1=lat - 2, lat2=lat + 2)
+    if spec.projection == 'Mercator':
+        return dict(lon_origin=0.0, k_factor=1.0, false_easting=0.0, false_northing=0.0)
+    return {}
+
+
+def _pixel_to_latlon(spec, x, y):
+    width, height = spec.image_size
+    lon = spec.center[0] + (x / float(width) - 0.5) * spec.extent[0]
+    lat = spec.center[1] - (y / float(height) - 0.5) * spec.extent[1]
+    return lon, lat
+
+
+def _format_gcp(i, x, y, lon, lat, proj_xy=None):
+    if proj_xy is not None:
+        return 'Point%02d,xy,%5d,%5d,in, deg,    ,        ,N,    ,        ,E, grid,   ,%11.1f,%11.1f,%s' % (
+            i, x, y, proj_xy[0], abs(proj_xy[1]), 'N' if proj_xy[1] >= 0 else 'S')
+    lat_deg = int(abs(lat))
+    lon_deg = int(abs(lon))
+    return 'Point%02d,xy,%5d,%5d,in, deg,%4d,%8.4f,%s,%4d,%8.4f,%s, grid,   ,           ,           ,N' % (
+        i, x, y, lat_deg, (abs(lat) - lat_deg) * 60, 'N' if lat >= 0 else 'S',
+        lon_deg, (abs(lon) - lon_deg) * 60, 'E' if lon >= 0 else 'W')
+
+
+def generate_map_text(spec, image_name='image.png'):
+    rnd = random.Random(spec.seed)
+    width, height = spec.image_size
+    params = _projection_params(spec)
+    lines = [
+        'OziExplorer Map Data File Version 2.2',
+        spec.name,
+        'C:\\OziExplorer\\Maps\\%s' % image_name,
+        '1 ,Map Code,',
+        '%s,WGS 84,   0.0000,   0.0000,WGS 84' % spec.datum,
+        'Reserved 1',
+        'Reserved 2',
+        'Magnetic Variation,,,E',
+        'Map Projection,%s,PolyCal,No,AutoCalOnly,No,BSBUseWPX,No' % spec.projection,
+    ]
+    to_proj = None
+    if spec.gcp_type == 'proj':
+        projection = AttrDict(params, name=spec.projection)
+        to_proj = get_transformer(get_srs_as_proj4(spec.datum), get_srs_as_proj4(spec.datum, projection))
+    for i in range(1, 31):
+        if i <= spec.gcps_count:
+            x = rnd.randint(0, width - 1)
+            y = rnd.randint(0, height - 1)
+            lon, lat = _pixel_to_latlon(spec, x, y)
+            proj_xy = to_proj.transform(lon, lat) if to_proj is not None else None
+            lines.append(_format_gcp(i, x, y, lon, lat, proj_xy))
+        else:
+            lines.append(EMPTY_GCP_LINE % i)
+    lines.append('Projection Setup,%s,,' % ','.join(
+        '' if params.get(name) is None else '%16.9f' % params[name]
+        for name in ['lat_origin', 'lon_origin', 'k_factor', 'false_easting', 'false_northing', 'lat1', 'lat2',
+                     'height']))
+    lines += [
+        'Map Feature = MF ; Map Comment = MC     These follow if they exist',
+        'Track File = TF      These follow if they exist',
+        'Moving Map Parameters = MM?    These follow if they exist',
+        'MM0,Yes',
+        'MMPNUM,%d' % spec.cutline_points,
+    ]
+    pixels = []
+    for k in range(spec.cutline_points):
+        angle = 2 * math.pi * k / spec.cutline_points
+        radius = 0.45 + 0.04 * rnd.random()
+        pixels.append((int(width * (0.5 + radius * math.cos(angle))), int(height * (0.5 + radius * math.sin(angle)))))
+    for k, (x, y) in enumerate(pixels, 1):
+        lines.append('MMPXY,%d,%d,%d' % (k, x, y))
+    for k, (x, y) in enumerate(pixels, 1):
+        lon, lat = _pixel_to_latlon(spec, x, y)
+        lines.append('MMPLL,%d,%12.6f,%12.6f' % (k, lon, lat))
+    lines.append('MM1B,%f' % (spec.extent[0] * 111320 * math.cos(math.radians(spec.center[1])) / width))
+    lines.append('MOP,Map Open Position,0,0')
+    lines.append('IWH,Map Image Width/Height,%d,%d' % (width, height))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def png_header(width, height):
+    """PNG signature, IHDR and IEND chunks: enough for probing image size, no pixel data"""
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            _png_chunk(b'IEND', b''))
+
+
+def write_map(spec, directory, image_name=None):
+    """Write .map file and image placeholder with PNG header only, returns path of .map file"""
+    if image_name is None:
+        image_name = spec.name + '.png'
+    map_path = os.path.join(directory, spec.name + '.map')
+    with open(map_path, 'wb') as f:
+        f.write(generate_map_text(spec, image_name).encode('cp1251'))
+    image_path = os.path.join(directory, image_name)
+    if not os.path.exists(image_path):
+        with open(image_path, 'wb') as f:
+            f.write(png_header(*spec.image_size))
+    return map_path
+
+
+def iter_specs(gcps_counts=(2, 4, 30), cutline_sizes=(4, 100, 10000), seed=0):
+    """All combinations of datums, projections, gcp types and sizes"""
+    for datum in DATUMS:
+        for projection in PROJECTIONS:
+            for gcp_type in GCP_TYPES:
+                if projection == 'Latitude/Longitude' and gcp_type == 'proj':
+                    continue
+                for gcps_count in gcps_counts:
+                    for cutline_points in cutline_sizes:
+                        yield MapSpec(datum, projection, gcps_count, gcp_type, cutline_points, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic OziExplorer .map files')
+    parser.add_argument('out_dir')
+    parser.add_argument('--count', type=int, default=None, help='Number of random maps, default is full matrix')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    if args.count is None:
+        specs = list(iter_specs(seed=args.seed))
+    else:
+        rnd = random.Random(args.seed)
+        specs = [MapSpec(rnd.choice(DATUMS), rnd.choice(PROJECTIONS), rnd.randint(2, 30), rnd.choice(GCP_TYPES),
+                         rnd.choice([4, 10, 50, 500, 10000]), center=(rnd.uniform(20, 170), rnd.uniform(40, 70)),
+                         seed=i, name='map%06d' % i)
+                 for i in range(args.count)]
+    for spec in specs:
+        write_map(spec, args.out_dir)
+    print('%d maps written to %s' % (len(specs), args.out_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Measures startup cost of ozi_map in fresh interpreters and writes results as JSON (needs ozi_map installed):
+#   python benchmarks/import_time.py [--runs 10] [--output results.json] [--check]
+# With --check fails if parsing-only scenarios load pyproj, numpy, maprec or argparse.
+import argparse
+import ast
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from generate_maps import MapSpec, write_map
+
+
+HEAVY_MODULES = ('pyproj', 'numpy', 'maprec', 'argparse')
+
+# (name, code, must stay lightweight), code is run with map file path in variable `path`
+SCENARIOS = [
+    ('import ozi_map', 'import ozi_map', True),
+    ('read_ozi_map', 'import ozi_map\nozi_map.read_ozi_map(open(path, "rb"))', True),
+    ('read_ozi_map_file[compact]', 'import ozi_map\nozi_map.read_ozi_map_file(path, compact=True)', True),
+    ('get_maprecord_from_ozi_file',
+     'import ozi_map\nozi_map.get_maprecord_from_ozi_file(path)', False),
+]
+
+RUNNER = '''
+import sys, time
+path = sys.argv[1]
+start = time.perf_counter()
+%s
+seconds = time.perf_counter() - start
+# ru_maxrss may include memory of parent process before exec, peak RSS of this process is VmHWM
+rss = [int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmHWM:')][0]
+print(repr((seconds, rss, [m for m in %r if m in sys.modules])))
+'''
+
+
+def run_scenario(code, path, runs):
+    """Returns (median seconds, median max RSS in KiB, heavy modules loaded)"""
+    times = []
+    rss = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', RUNNER % (code, HEAVY_MODULES), path])
+        seconds, max_rss, loaded = ast.literal_eval(output.decode())
+        times.append(seconds)
+        rss.append(max_rss)
+    return statistics.median(times), statistics.median(rss), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import time of ozi_map')
+    parser.add_argument('--runs', type=int, default=10, help='Number of interpreter starts per scenario')
+    parser.add_argument('--output', '-o', help='Write JSON results to file instead of stdout')
+    parser.add_argument('--check', action='store_true', help='Fail if parsing loads heavy modules')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='ozi_map_bench_')
+    try:
+        path = write_map(MapSpec('Pulkovo 1942 (2)', 'Transverse Mercator', 4, 'latlon', 100), directory)
+        _, baseline_rss, _ = run_scenario('pass', path, args.runs)
+        results = []
+        for name, code, lightweight in SCENARIOS:
+            seconds, max_rss, loaded = run_scenario(code, path, args.runs)
+            results.append({
+                'scenario': name,
+                'seconds': seconds,
+                'max_rss_kib': max_rss,
+                'extra_rss_kib': max_rss - baseline_rss,
+                'heavy_modules': loaded,
+                'lightweight': lightweight,
+            })
+            sys.stderr.write('%-30s %8.1f ms %8d KiB  %s\n' % (name, seconds * 1e3, max_rss - baseline_rss,
+                                                              ', '.join(loaded)))
+    finally:
+        shutil.rmtree(directory)
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    if args.check:
+        failed = [r for r in results if r['lightweight'] and r['heavy_modules']]
+        for r in failed:
+            sys.stderr.write('HEAVY IMPORT %s: %s\n' % (r['scenario'], ', '.join(r['heavy_modules'])))
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# Times parsing and conversion of synthetic maps and writes results as JSON (needs ozi_map installed):
+#   python benchmarks/run_benchmarks.py [--quick] [--output results.json] [--compare baseline.json]
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import pyproj
+
+from generate_maps import MapSpec, iter_specs, write_map
+from ozi_map.ozi_parser import parse_ozi_map
+from ozi_map.ozi_reader import read_ozi_map, read_ozi_map_file
+from ozi_map.ozi_to_maprec import get_maprecord_from_ozi_file
+from ozi_map.transform import MapTransform
+
+
+def _read_fast(path):
+    with open(path, 'rb') as f:
+        read_ozi_map(f)
+
+
+def _read_reference(path):
+    with open(path, 'rb') as f:
+        read_ozi_map(f, engine='reference')
+
+
+def _read_compact(path):
+    with open(path, 'rb') as f:
+        read_ozi_map(f, compact=True)
+
+
+def _read_mmap(path):
+    read_ozi_map_file(path, compact=True)
+
+
+def _maprecord(cutline_type, image_info=False):
+    return lambda path: get_maprecord_from_ozi_file(path, cutline_type, image_info=image_info)
+
+
+def _pixel_to_proj(method, grid_tolerance=None):
+    """Fit transform (grids are cached across calls) and convert 256x256 pixels spread over image"""
+    width, height = MapSpec().image_size
+    xs, ys = np.meshgrid(np.linspace(0, width, 256), np.linspace(0, height, 256))
+
+    def run(path):
+        transform = MapTransform.from_ozi_file(path, method=method, image_size=(width, height),
+                                               grid_tolerance=grid_tolerance)
+        transform.pixel_to_proj(xs, ys)
+    return run
+
+
+def _legacy(cutline_type):
+    return lambda path: parse_ozi_map(path, cutline_type)
+
+
+BENCHMARKS = [
+    ('read_ozi_map', _read_fast),
+    ('read_ozi_map[reference]', _read_reference),
+    ('read_ozi_map[compact]', _read_compact),
+    ('read_ozi_map_file[compact]', _read_mmap),
+    ('get_maprecord_from_ozi_file[raw]', _maprecord('raw')),
+    ('get_maprecord_from_ozi_file[latlon]', _maprecord('latlon')),
+    ('get_maprecord_from_ozi_file[proj]', _maprecord('proj')),
+    ('get_maprecord_from_ozi_file[image_info]', _maprecord('latlon', True)),
+    ('pixel_to_proj[affine]', _pixel_to_proj('affine')),
+    ('pixel_to_proj[tps]', _pixel_to_proj('tps')),
+    ('pixel_to_proj[tps, grid 0.1px]', _pixel_to_proj('tps', 0.1)),
+    ('parse_ozi_map', _legacy(None)),
+    ('parse_ozi_map[latlon]', _legacy('latlon')),
+    ('parse_ozi_map[projected]', _legacy('projected')),
+]
+
+
+def time_call(func, arg, min_time=0.2, repeat=3):
+    """Returns best time of one call in seconds"""
+    timer = timeit.Timer(lambda: func(arg))
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number, number
+
+
+def iter_quick_specs():
+    yield MapSpec('WGS 84', 'Latitude/Longitude', 4, 'latlon', 4)
+    yield MapSpec('Pulkovo 1942 (2)', 'Transverse Mercator', 4, 'latlon', 4)
+    yield MapSpec('Pulkovo 1942 (2)', 'Transverse Mercator', 30, 'proj', 100)
+    yield MapSpec('Pulkovo 1942', 'Lambert Conformal Conic', 2, 'proj', 1000)
+    yield MapSpec('WGS 84', 'Mercator', 30, 'latlon', 10000)
+
+
+def run(specs, directory, min_time=0.2, repeat=3, log=None):
+    results = []
+    for spec in specs:
+        path = write_map(spec, directory)
+        for name, func in BENCHMARKS:
+            result = {
+                'benchmark': name,
+                'map': spec.name,
+                'datum': spec.datum,
+                'projection': spec.projection,
+                'gcps': spec.gcps_count,
+                'gcp_type': spec.gcp_type,
+                'cutline_points': spec.cutline_points,
+            }
+            try:
+                seconds, number = time_call(func, path, min_time, repeat)
+            except Exception as e:
+                result['error'] = str(e) or type(e).__name__
+            else:
+                result['seconds'] = seconds
+                result['number'] = number
+            results.append(result)
+            if log is not None:
+                log.write('%-40s %-45s %s\n' % (
+                    name, spec.name, '%.1f us' % (result['seconds'] * 1e6) if 'seconds' in result else 'ERROR'))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns list of results which are slower than in baseline by more than threshold times"""
+    baseline_times = dict(((r['benchmark'], r['map']), r['seconds']) for r in baseline['results'] if 'seconds' in r)
+    regressions = []
+    for r in results:
+        old = baseline_times.get((r['benchmark'], r['map']))
+        if old and 'seconds' in r and r['seconds'] > old * threshold:
+            regressions.append(dict(r, baseline_seconds=old, ratio=r['seconds'] / old))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OziExplorer map parsing and conversion')
+    parser.add_argument('--quick', action='store_true', help='Run small subset of maps')
+    parser.add_argument('--output', '-o', help='Write JSON results to file instead of stdout')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimal duration of one measurement, seconds')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help='Fail if slower than baseline')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Allowed slowdown ratio for --compare')
+    args = parser.parse_args()
+
+    specs = list(iter_quick_specs()) if args.quick else list(iter_specs())
+    directory = tempfile.mkdtemp(prefix='ozi_map_bench_')
+    try:
+        results = run(specs, directory, args.min_time, args.repeat, log=sys.stderr)
+    finally:
+        shutil.rmtree(directory)
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'pyproj': pyproj.__version__,
+            'proj': pyproj.proj_version_str,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            sys.stderr.write('REGRESSION %s %s: %.1f us -> %.1f us (x%.2f)\n' % (
+                r['benchmark'], r['map'], r['baseline_seconds'] * 1e6, r['seconds'] * 1e6, r['ratio']))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,27 @@
-from ozi_map.ozi_reader import read_ozi_map
-from ozi_map.ozi_to_maprec import get_maprecord_from_ozi_file
\ No newline at end of file
+# -*- coding: utf-8 -*-
+# Names are loaded on first access (PEP 562), so `import ozi_map` does not import pyproj, numpy
+# and maprec until conversion functions are actually used.
+import importlib
+
+_EXPORTS = {
+    'read_ozi_map': 'ozi_map.ozi_reader',
+    'read_ozi_map_file': 'ozi_map.ozi_reader',
+    'iter_ozi_maps': 'ozi_map.ozi_reader',
+    'get_maprecord_from_ozi_file': 'ozi_map.ozi_to_maprec',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    try:
+        module_name = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
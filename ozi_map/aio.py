@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# asyncio front end for get_maprecord_from_ozi_file. Blocking file reads and directory lookups run in
+# a thread pool limited by a semaphore, parsing and projection run in `executor`
+# (default thread pool of the loop, pass ProcessPoolExecutor to use all cores).
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ozi_map.image_probe import probe_image
+from ozi_map.ozi_reader import read_ozi_map
+from ozi_map.ozi_to_maprec import find_map_image, make_maprecord
+
+
+DEFAULT_CONCURRENCY = 32
+
+MaprecordResult = namedtuple('MaprecordResult', ['source', 'maprecord', 'error'])
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _parse(data):
+    return read_ozi_map(data, compact=True)
+
+
+async def _run_io(loop, semaphore, io_executor, func, *args):
+    if semaphore is None:
+        return await loop.run_in_executor(io_executor, func, *args)
+    async with semaphore:
+        return await loop.run_in_executor(io_executor, func, *args)
+
+
+async def get_maprecord_from_ozi_file_async(ozi_map_file, cutline_type='latlon', cutline_arrays=False,
+                                            executor=None, semaphore=None, io_executor=None, image_info=False):
+    loop = asyncio.get_running_loop()
+    data = await _run_io(loop, semaphore, io_executor, _read_file, ozi_map_file)
+    ozi_map = await loop.run_in_executor(executor, _parse, data)
+    image_path = await _run_io(loop, semaphore, io_executor, find_map_image, ozi_map, ozi_map_file)
+    image_size = None
+    if image_info:
+        image_size = (await _run_io(loop, semaphore, io_executor, probe_image, image_path))[1:]
+    return await loop.run_in_executor(executor, make_maprecord, ozi_map, image_path, cutline_type, cutline_arrays,
+                                      image_size)
+
+
+async def iter_maprecords_async(paths, cutline_type='latlon', cutline_arrays=False, concurrency=DEFAULT_CONCURRENCY,
+                                executor=None, image_info=False):
+    """Async generator of MaprecordResult(source, maprecord, error) in order of completion.
+
+    At most `concurrency` files are read or looked up at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+    results = asyncio.Queue()
+    paths = list(paths)
+    for path in paths:
+        queue.put_nowait(path)
+
+    async def worker():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                maprecord = await get_maprecord_from_ozi_file_async(
+                    path, cutline_type, cutline_arrays, executor, semaphore, io_executor, image_info)
+            except Exception as e:
+                await results.put(MaprecordResult(path, None, e))
+            else:
+                await results.put(MaprecordResult(path, maprecord, None))
+
+    # more workers than io slots, so parsing of some files overlaps reading of others
+    workers_n = min(len(paths), concurrency * 2)
+    with ThreadPoolExecutor(max_workers=concurrency) as io_executor:
+        workers = [asyncio.ensure_future(worker()) for _ in range(workers_n)]
+        try:
+            for _ in range(len(paths)):
+                yield await results.get()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
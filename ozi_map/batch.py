@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from ozi_map.bulk import BundleWriter, JsonLinesWriter
+from ozi_map.ozi_to_maprec import get_maprecord_from_ozi_file, write_profile
+from ozi_map.profiling import Profile, profiling, stage
+
+
+MAP_EXTENSION = '.map'
+MAPREC_EXTENSION = '.maprec'
+
+
+def _is_map_file(path):
+    return os.path.splitext(path)[1].lower() == MAP_EXTENSION
+
+
+def _walk_map_files(root):
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for fn in sorted(file_names):
+            if _is_map_file(fn):
+                path = os.path.join(dir_path, fn)
+                yield path, os.path.relpath(path, root)
+
+
+def read_file_list(list_file):
+    with open(list_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def split_missing_files(paths):
+    """Split file names read from a list into existing and missing ones.
+
+    Listed names are taken literally, not as glob patterns, so a stale entry does not abort the batch."""
+    existing = []
+    missing = []
+    for path in paths:
+        (existing if os.path.exists(path) else missing).append(path)
+    return existing, missing
+
+
+def _glob_root(pattern):
+    """Directory part of glob pattern before the first component with wildcards"""
+    root = os.path.dirname(pattern)
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or os.curdir
+
+
+def collect_map_files(inputs):
+    """Expand directories (recursively), glob patterns and plain file names
+    into a list of (map_path, relative_name) pairs without duplicates.
+
+    Relative names are relative to the directory for directories, to the part of the pattern
+    before wildcards for globs and to the common directory of all plain file names."""
+    result = []
+    seen = set()
+    files = [os.path.abspath(item) for item in inputs if os.path.isfile(item)]
+    files_root = os.path.commonpath([os.path.dirname(path) for path in files]) if files else None
+    for item in inputs:
+        if os.path.isdir(item):
+            found = _walk_map_files(item)
+        elif os.path.isfile(item):
+            found = [(item, os.path.relpath(os.path.abspath(item), files_root))]
+        else:
+            root = _glob_root(item)
+            found = [(path, os.path.relpath(path, root)) for path in sorted(glob.glob(item, recursive=True))
+                     if os.path.isfile(path) and _is_map_file(path)]
+            if not found:
+                raise Exception('No map files match "%s"' % item)
+        for path, rel_name in found:
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                result.append((path, rel_name))
+    return result
+
+
+def get_output_path(map_path, rel_name, out_dir=None):
+    if out_dir is None:
+        return os.path.splitext(map_path)[0] + MAPREC_EXTENSION
+    return os.path.join(out_dir, os.path.splitext(rel_name)[0] + MAPREC_EXTENSION)
+
+
+def get_output_jobs(map_files, out_dir=None):
+    """Returns (map_path, out_path) pairs for collect_map_files result,
+    raises Exception if two maps would be written to the same file."""
+    jobs = []
+    out_paths = {}
+    for map_path, rel_name in map_files:
+        out_path = get_output_path(map_path, rel_name, out_dir)
+        key = os.path.normcase(os.path.abspath(out_path))
+        if key in out_paths:
+            raise Exception('Maps "%s" and "%s" have the same output file "%s"' % (out_paths[key], map_path, out_path))
+        out_paths[key] = map_path
+        jobs.append((map_path, out_path))
+    return jobs
+
+
+def convert_file(map_path, out_path, cutline_type='latlon', abs_path=False, format_json=False, image_info=False):
+    from maprec import Maprecord
+
+    with stage('convert'):
+        maprecord = get_maprecord_from_ozi_file(map_path, cutline_type, image_info=image_info)
+        with stage('write'):
+            maprecord = Maprecord(map_path, maprecord)
+            out_dir = os.path.dirname(out_path)
+            if out_dir and not os.path.isdir(out_dir):
+                os.makedirs(out_dir, exist_ok=True)
+            maprecord.write(out_path, image_path_relative=not abs_path, format_json=format_json)
+
+
+def _convert_job(map_path, out_path, options, profile=False):
+    if profile:
+        with profiling() as job_profile:
+            map_path, error, _ = _convert_job(map_path, out_path, options)
+        return map_path, error, job_profile.as_dict()
+    try:
+        convert_file(map_path, out_path, **options)
+    except Exception as e:
+        return map_path, str(e) or traceback.format_exc(), None
+    return map_path, None, None
+
+
+def convert_files(jobs, workers=None, cutline_type='latlon', abs_path=False, format_json=False, profile=None,
+                  image_info=False):
+    """Convert (map_path, out_path) pairs in a process pool.
+
+    Yields (map_path, error) for every job as soon as it is finished, error is None on success.
+    If profile (a Profile instance) is given, stage timings from worker processes are merged into it."""
+    options = {'cutline_type': cutline_type, 'abs_path': abs_path, 'format_json': format_json,
+               'image_info': image_info}
+    if workers == 1:
+        results = (_convert_job(map_path, out_path, options, profile is not None) for map_path, out_path in jobs)
+        for map_path, error, job_profile in results:
+            if job_profile is not None:
+                profile.merge(job_profile)
+            yield map_path, error
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_convert_job, map_path, out_path, options, profile is not None)
+                   for map_path, out_path in jobs]
+        for future in as_completed(futures):
+            map_path, error, job_profile = future.result()
+            if job_profile is not None:
+                profile.merge(job_profile)
+            yield map_path, error
+
+
+def _maprecord_job(map_path, cutline_type, profile=False, image_info=False):
+    if profile:
+        with profiling() as job_profile:
+            map_path, maprecord, error, _ = _maprecord_job(map_path, cutline_type, image_info=image_info)
+        return map_path, maprecord, error, job_profile.as_dict()
+    try:
+        with stage('convert'):
+            # arrays are cheaper to send from worker process than lists of points
+            maprecord = get_maprecord_from_ozi_file(map_path, cutline_type, cutline_arrays=True,
+                                                    image_info=image_info)
+    except Exception as e:
+        return map_path, None, str(e) or traceback.format_exc(), None
+    return map_path, maprecord, None, None
+
+
+def iter_maprecords(map_paths, workers=None, cutline_type='latlon', profile=None, image_info=False):
+    """Convert maps in a process pool, yields (map_path, maprecord, error) in order of map_paths.
+
+    Maprecords have cutline as arrays (see get_maprecord_from_ozi_file), maprecord is None on error."""
+    if workers == 1:
+        results = (_maprecord_job(map_path, cutline_type, profile is not None, image_info) for map_path in map_paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_maprecord_job, map_paths, [cutline_type] * len(map_paths),
+                               [profile is not None] * len(map_paths), [image_info] * len(map_paths), chunksize=16)
+    try:
+        for map_path, maprecord, error, job_profile in results:
+            if job_profile is not None:
+                profile.merge(job_profile)
+            yield map_path, maprecord, error
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+@contextmanager
+def _parent_stage(profile, name):
+    # profiling is active only inside jobs, so stages run in this process are timed explicitly
+    if profile is None:
+        yield
+        return
+    with profiling(profile):
+        with stage(name):
+            yield
+
+
+def write_bulk(writer, map_paths, workers=None, cutline_type='latlon', profile=None, image_info=False):
+    """Convert maps and write them with JsonLinesWriter or BundleWriter using map path as id.
+
+    Yields (map_path, error) like convert_files, time of writing (including closing writer,
+    when bundle is actually written) is added to profile as stage 'write'."""
+    try:
+        for map_path, maprecord, error in iter_maprecords(map_paths, workers, cutline_type, profile, image_info):
+            if error is None:
+                with _parent_stage(profile, 'write'):
+                    writer.write(map_path, maprecord)
+            yield map_path, error
+    except BaseException:
+        writer.__exit__(*sys.exc_info())
+        raise
+    with _parent_stage(profile, 'write'):
+        writer.close()
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Convert many OziExplorer .map files to .maprec')
+    parser.add_argument('inputs', metavar='PATH', nargs='*',
+                        help='Map file, directory (searched recursively) or glob pattern')
+    parser.add_argument('--files-from', metavar='LIST_FILE', help='Read map file names from file, one per line')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--out-dir', help='Write .maprec files to this directory instead of next to the .map files')
+    output.add_argument('--jsonl', metavar='FILE', help='Write all maprecords to one JSON Lines file')
+    output.add_argument('--bundle', metavar='FILE', help='Write all maprecords to one binary bundle')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--abs-path', action='store_true', help='Write absolute path to image file')
+    parser.add_argument('--cutline', required=False, choices=['raw', 'latlon', 'proj'], default='latlon')
+    parser.add_argument('--json', action='store_true', default=False)
+    parser.add_argument('--image-info', action='store_true',
+                        help='Add image size and footprint, reading only header of image file')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Report only errors')
+    parser.add_argument('--profile', action='store_true', help='Print time spent in conversion stages')
+    parser.add_argument('--profile-json', metavar='FILE', help='Write time spent in conversion stages to JSON file')
+    args = parser.parse_args()
+    if not args.inputs and not args.files_from:
+        parser.error('no input files given')
+    return args
+
+
+def main():
+    args = parse_command_line()
+    inputs = list(args.inputs)
+    missing = []
+    if args.files_from:
+        listed, missing = split_missing_files(read_file_list(args.files_from))
+        inputs.extend(listed)
+    try:
+        map_files = collect_map_files(inputs)
+        if not (args.jsonl or args.bundle):
+            jobs = get_output_jobs(map_files, args.out_dir)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 2
+    converted = 0
+    failed = 0
+    for map_path in missing:
+        failed += 1
+        print('FAILED %s: file not found' % map_path, file=sys.stderr)
+    profile = Profile() if args.profile or args.profile_json else None
+    if args.jsonl or args.bundle:
+        if args.jsonl:
+            writer = JsonLinesWriter(args.jsonl, args.abs_path)
+        else:
+            writer = BundleWriter(args.bundle, args.abs_path)
+        results = write_bulk(writer, [map_path for map_path, _ in map_files], args.jobs, args.cutline, profile,
+                             args.image_info)
+    else:
+        results = convert_files(jobs, args.jobs, args.cutline, args.abs_path, args.json, profile, args.image_info)
+    for map_path, error in results:
+        if error is None:
+            converted += 1
+            if not args.quiet:
+                print('OK %s' % map_path)
+        else:
+            failed += 1
+            print('FAILED %s: %s' % (map_path, error), file=sys.stderr)
+    print('%d converted, %d failed' % (converted, failed), file=sys.stderr)
+    if profile is not None:
+        write_profile(profile, args.profile, args.profile_json)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
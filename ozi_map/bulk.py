@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# Writers storing many maprecords in one file instead of one .maprec per map:
+#   JsonLinesWriter - one {"id": ..., "maprecord": ...} JSON object per line,
+#   BundleWriter - binary columnar bundle, read back with Bundle through mmap.
+#
+# Bundle layout (little endian): header (magic, version, number of maps, offset of table of contents),
+# column arrays aligned to 8 bytes, table of contents as JSON {name: {dtype, shape, offset}}.
+# Per-map rows of gcps, cutlines and footprints are located through offset columns, strings are stored
+# as utf-8 blobs with offsets. Maps without image size have (-1, -1) in image_sizes and empty footprint.
+import json
+import mmap
+import os
+import struct
+from array import array
+
+import numpy as np
+
+from ozi_map.ozi_to_maprec import cutline_arrays_to_points
+
+
+BUNDLE_MAGIC = b'OZIMAPB\x00'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<8sIIQ')
+ALIGNMENT = 8
+STRING_COLUMNS = ('ids', 'image_paths', 'srs', 'cutline_srs', 'footprint_srs')
+RAW_SRS = 'RAW'
+
+
+def _image_path(maprecord, out_path, abs_path):
+    image_path = maprecord['image_path']
+    if abs_path:
+        return os.path.abspath(image_path)
+    return os.path.relpath(os.path.abspath(image_path), os.path.dirname(os.path.abspath(out_path)))
+
+
+def _cutline_xy(cutline):
+    """Returns (xs, ys) of cutline given either as points or as arrays"""
+    if 'xs' in cutline:
+        return cutline['xs'], cutline['ys']
+    points = cutline['points']
+    return [p['x'] for p in points], [p['y'] for p in points]
+
+
+class JsonLinesWriter(object):
+    """Image paths are written relative to directory of output file unless abs_path is True"""
+
+    def __init__(self, path, abs_path=False):
+        self.path = path
+        self.abs_path = abs_path
+        self.tmp_path = path + '.tmp'
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def write(self, map_id, maprecord):
+        maprecord = dict(maprecord, image_path=_image_path(maprecord, self.path, self.abs_path))
+        for key in ('cutline', 'footprint'):
+            cutline = maprecord.get(key)
+            if cutline is not None and 'xs' in cutline:
+                maprecord[key] = {'srs': cutline['srs'], 'points': cutline_arrays_to_points(cutline['xs'],
+                                                                                           cutline['ys'])}
+        self.file.write(json.dumps({'id': map_id, 'maprecord': maprecord}, ensure_ascii=False))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.tmp_path)
+
+
+def iter_json_lines(path):
+    """Yields (id, maprecord) from file written by JsonLinesWriter"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record['id'], record['maprecord']
+
+
+class BundleWriter(object):
+    """Collects maprecords in packed arrays, the bundle is written on close().
+    Image paths are stored relative to directory of bundle file unless abs_path is True"""
+
+    def __init__(self, path, abs_path=False):
+        self.path = path
+        self.abs_path = abs_path
+        self.strings = dict((name, []) for name in STRING_COLUMNS)
+        self.gcp_offsets = array('q', [0])
+        self.gcp_pixels = array('q')
+        self.gcp_ground = array('d')
+        self.gcp_projected = array('B')
+        self.cutline_offsets = array('q', [0])
+        self.cutline_points = array('d')
+        self.image_sizes = array('q')
+        self.footprint_offsets = array('q', [0])
+        self.footprint_points = array('d')
+
+    def write(self, map_id, maprecord):
+        self.strings['ids'].append(map_id)
+        self.strings['image_paths'].append(_image_path(maprecord, self.path, self.abs_path))
+        self.strings['srs'].append(maprecord['srs'])
+        self.strings['cutline_srs'].append(maprecord['cutline']['srs'])
+        for gcp in maprecord['gcps']:
+            self.gcp_pixels.extend((gcp['pixel']['x'], gcp['pixel']['y']))
+            self.gcp_ground.extend((gcp['ground']['x'], gcp['ground']['y']))
+            self.gcp_projected.append(gcp['is_projected'])
+        self.gcp_offsets.append(len(self.gcp_projected))
+        self._add_points(self.cutline_points, self.cutline_offsets, maprecord['cutline'])
+        image_size = maprecord.get('image_size')
+        if image_size is None:
+            self.image_sizes.extend((-1, -1))
+            self.strings['footprint_srs'].append('')
+            self.footprint_offsets.append(self.footprint_offsets[-1])
+        else:
+            self.image_sizes.extend((image_size['width'], image_size['height']))
+            self.strings['footprint_srs'].append(maprecord['footprint']['srs'])
+            self._add_points(self.footprint_points, self.footprint_offsets, maprecord['footprint'])
+
+    @staticmethod
+    def _add_points(column, offsets, cutline):
+        xs, ys = _cutline_xy(cutline)
+        points = np.empty((len(xs), 2), dtype=np.float64)
+        points[:, 0] = xs
+        points[:, 1] = ys
+        column.frombytes(points.tobytes())
+        offsets.append(len(column) // 2)
+
+    def _columns(self):
+        columns = {
+            'gcp_offsets': np.frombuffer(self.gcp_offsets, dtype=np.int64),
+            'gcp_pixels': np.frombuffer(self.gcp_pixels, dtype=np.int64).reshape(-1, 2),
+            'gcp_ground': np.frombuffer(self.gcp_ground, dtype=np.float64).reshape(-1, 2),
+            'gcp_projected': np.frombuffer(self.gcp_projected, dtype=np.uint8),
+            'cutline_offsets': np.frombuffer(self.cutline_offsets, dtype=np.int64),
+            'cutline_points': np.frombuffer(self.cutline_points, dtype=np.float64).reshape(-1, 2),
+            'image_sizes': np.frombuffer(self.image_sizes, dtype=np.int64).reshape(-1, 2),
+            'footprint_offsets': np.frombuffer(self.footprint_offsets, dtype=np.int64),
+            'footprint_points': np.frombuffer(self.footprint_points, dtype=np.float64).reshape(-1, 2),
+        }
+        for name, values in self.strings.items():
+            encoded = [s.encode('utf-8') for s in values]
+            columns[name + '.offsets'] = np.concatenate([[0], np.cumsum([len(s) for s in encoded],
+                                                                        dtype=np.int64)]).astype(np.int64)
+            columns[name + '.data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return columns
+
+    def close(self):
+        tmp_path = self.path + '.tmp'
+        toc = {}
+        with open(tmp_path, 'wb') as f:
+            f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(self.strings['ids']), 0))
+            for name, column in sorted(self._columns().items()):
+                column = column.astype(column.dtype.newbyteorder('<'), copy=False)
+                f.write(b'\0' * (-f.tell() % ALIGNMENT))
+                toc[name] = {'dtype': column.dtype.str, 'shape': list(column.shape), 'offset': f.tell()}
+                f.write(column.tobytes())
+            toc_offset = f.tell()
+            f.write(json.dumps(toc, sort_keys=True).encode('utf-8'))
+            f.seek(0)
+            f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(self.strings['ids']), toc_offset))
+        os.replace(tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class Bundle(object):
+    """Read-only access to bundle written by BundleWriter, maps are addressed by index or id.
+
+    Arrays are views of the memory mapped file, nothing is read until accessed.
+    They must not be referenced when the bundle is closed, otherwise close() raises BufferError."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, toc_offset = BUNDLE_HEADER.unpack_from(self.mmap, 0)
+        if magic != BUNDLE_MAGIC:
+            raise Exception('"%s" is not a maprecord bundle' % path)
+        if version != BUNDLE_VERSION:
+            raise Exception('Unsupported bundle version %d in "%s"' % (version, path))
+        self.count = count
+        toc = json.loads(self.mmap[toc_offset:].decode('utf-8'))
+        self.columns = {}
+        for name, column in toc.items():
+            dtype = np.dtype(column['dtype'])
+            size = int(np.prod(column['shape']))
+            self.columns[name] = np.frombuffer(self.mmap, dtype=dtype, count=size,
+                                               offset=column['offset']).reshape(column['shape'])
+        self._index = None
+
+    def close(self):
+        self.columns = {}
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, name, i):
+        offsets = self.columns[name + '.offsets']
+        return self.columns[name + '.data'][offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def get_id(self, i):
+        return self._string('ids', i)
+
+    def index_of(self, map_id):
+        if self._index is None:
+            self._index = dict((self.get_id(i), i) for i in range(self.count))
+        return self._index[map_id]
+
+    def _resolve(self, key):
+        if isinstance(key, str):
+            return self.index_of(key)
+        if not -self.count <= key < self.count:
+            raise IndexError(key)
+        return key % self.count
+
+    def image_path(self, key):
+        """Image path, relative paths are resolved against directory of bundle"""
+        path = self._string('image_paths', self._resolve(key))
+        return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(self.path)), path))
+
+    def gcp_arrays(self, key):
+        """Returns (pixels, ground, is_projected) arrays for gcps of map"""
+        i = self._resolve(key)
+        start, end = self.columns['gcp_offsets'][i:i + 2]
+        return (self.columns['gcp_pixels'][start:end], self.columns['gcp_ground'][start:end],
+                self.columns['gcp_projected'][start:end].astype(bool))
+
+    def cutline_arrays(self, key):
+        """Returns (srs, xs, ys) of map cutline"""
+        i = self._resolve(key)
+        start, end = self.columns['cutline_offsets'][i:i + 2]
+        points = self.columns['cutline_points'][start:end]
+        xs, ys = points[:, 0], points[:, 1]
+        srs = self._string('cutline_srs', i)
+        if srs == RAW_SRS:
+            xs, ys = xs.astype(np.int64), ys.astype(np.int64)
+        return srs, xs, ys
+
+    def image_size(self, key):
+        """Returns (width, height) of image or None if map was written without image info"""
+        width, height = self.columns['image_sizes'][self._resolve(key)].tolist()
+        if width < 0:
+            return None
+        return width, height
+
+    def footprint_arrays(self, key):
+        """Returns (srs, lons, lats) of image footprint or None if map was written without image info"""
+        i = self._resolve(key)
+        if self.image_size(i) is None:
+            return None
+        start, end = self.columns['footprint_offsets'][i:i + 2]
+        points = self.columns['footprint_points'][start:end]
+        return self._string('footprint_srs', i), points[:, 0], points[:, 1]
+
+    def get(self, key, cutline_arrays=False):
+        """Maprecord as returned by get_maprecord_from_ozi_file"""
+        i = self._resolve(key)
+        pixels, ground, is_projected = self.gcp_arrays(i)
+        gcps = [{'pixel': {'x': px, 'y': py}, 'ground': {'x': gx, 'y': gy}, 'is_projected': projected}
+                for (px, py), (gx, gy), projected in zip(pixels.tolist(), ground.tolist(), is_projected.tolist())]
+        cutline_srs, xs, ys = self.cutline_arrays(i)
+        if cutline_arrays:
+            cutline = {'srs': cutline_srs, 'xs': xs, 'ys': ys}
+        else:
+            cutline = {'srs': cutline_srs, 'points': cutline_arrays_to_points(xs, ys)}
+        maprecord = {'image_path': self.image_path(i), 'srs': self._string('srs', i), 'gcps': gcps, 'cutline': cutline}
+        image_size = self.image_size(i)
+        if image_size is not None:
+            maprecord['image_size'] = {'width': image_size[0], 'height': image_size[1]}
+            footprint_srs, xs, ys = self.footprint_arrays(i)
+            if cutline_arrays:
+                maprecord['footprint'] = {'srs': footprint_srs, 'xs': xs, 'ys': ys}
+            else:
+                maprecord['footprint'] = {'srs': footprint_srs, 'points': cutline_arrays_to_points(xs, ys)}
+        return maprecord
+
+    __getitem__ = get
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.get_id(i), self.get(i)
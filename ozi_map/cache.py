@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from ozi_map.batch import collect_map_files, read_file_list, split_missing_files
+from ozi_map.ozi_to_maprec import get_maprecord_from_ozi_file
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS maprecords (
+    path TEXT NOT NULL,
+    cutline_type TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    dir_mtime_ns INTEGER NOT NULL,
+    maprecord TEXT NOT NULL,
+    PRIMARY KEY (path, cutline_type)
+)
+'''
+
+
+def get_file_stamp(path):
+    """Returns (mtime_ns, size, dir_mtime_ns) for map file.
+
+    Directory mtime changes when image files are added, removed or renamed next to the map,
+    which affects image lookup."""
+    st = os.stat(path)
+    dir_st = os.stat(os.path.dirname(path) or '.')
+    return st.st_mtime_ns, st.st_size, dir_st.st_mtime_ns
+
+
+def _compute_maprecord(path, cutline_type):
+    try:
+        stamp = get_file_stamp(path)
+        maprecord = get_maprecord_from_ozi_file(path, cutline_type)
+    except Exception as e:
+        return path, None, None, str(e)
+    return path, stamp, maprecord, None
+
+
+class MaprecordCache(object):
+    """Persistent cache of get_maprecord_from_ozi_file results.
+
+    Entries are keyed by absolute path and cutline type and are invalid when file mtime or size
+    or mtime of the containing directory changed."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, ozi_map_file, cutline_type='latlon'):
+        path = os.path.abspath(ozi_map_file)
+        row = self.connection.execute(
+            'SELECT mtime_ns, size, dir_mtime_ns, maprecord FROM maprecords WHERE path = ? AND cutline_type = ?',
+            (path, cutline_type)).fetchone()
+        if row is None:
+            return None
+        try:
+            stamp = get_file_stamp(path)
+        except OSError:
+            return None
+        if tuple(row[:3]) != stamp:
+            return None
+        return json.loads(row[3])
+
+    def _store(self, ozi_map_file, cutline_type, maprecord, stamp):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO maprecords (path, cutline_type, mtime_ns, size, dir_mtime_ns, maprecord) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (os.path.abspath(ozi_map_file), cutline_type) + tuple(stamp) + (json.dumps(maprecord),))
+
+    def put(self, ozi_map_file, cutline_type, maprecord, stamp=None):
+        if stamp is None:
+            stamp = get_file_stamp(ozi_map_file)
+        self._store(ozi_map_file, cutline_type, maprecord, stamp)
+        self.connection.commit()
+
+    def get_maprecord(self, ozi_map_file, cutline_type='latlon'):
+        maprecord = self.get(ozi_map_file, cutline_type)
+        if maprecord is None:
+            stamp = get_file_stamp(ozi_map_file)
+            maprecord = get_maprecord_from_ozi_file(ozi_map_file, cutline_type)
+            self.put(ozi_map_file, cutline_type, maprecord, stamp)
+        return maprecord
+
+    def load_all(self, cutline_type='latlon'):
+        """Read all valid entries in one query, returns dict {absolute path: maprecord}"""
+        result = {}
+        dir_stamps = {}
+        rows = self.connection.execute(
+            'SELECT path, mtime_ns, size, dir_mtime_ns, maprecord FROM maprecords WHERE cutline_type = ?',
+            (cutline_type,))
+        for path, mtime_ns, size, dir_mtime_ns, maprecord in rows:
+            dir_name = os.path.dirname(path)
+            try:
+                if dir_name not in dir_stamps:
+                    dir_stamps[dir_name] = os.stat(dir_name).st_mtime_ns
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (st.st_mtime_ns, st.st_size, dir_stamps[dir_name]) == (mtime_ns, size, dir_mtime_ns):
+                result[path] = json.loads(maprecord)
+        return result
+
+    def warm(self, paths, cutline_type='latlon', workers=None):
+        """Compute and store entries for paths missing in cache or outdated.
+
+        Returns list of (path, error) for files which could not be converted."""
+        stale = [path for path in paths if self.get(path, cutline_type) is None]
+        errors = []
+        if not stale:
+            return errors
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_compute_maprecord, stale, [cutline_type] * len(stale), chunksize=16)
+            for path, stamp, maprecord, error in results:
+                if error is not None:
+                    errors.append((path, error))
+                else:
+                    self._store(path, cutline_type, maprecord, stamp)
+        self.connection.commit()
+        return errors
+
+    def prune(self):
+        """Delete entries for missing or changed files, returns number of deleted entries"""
+        outdated = []
+        for path, cutline_type, mtime_ns, size, dir_mtime_ns in self.connection.execute(
+                'SELECT path, cutline_type, mtime_ns, size, dir_mtime_ns FROM maprecords'):
+            try:
+                stamp = get_file_stamp(path)
+            except OSError:
+                stamp = None
+            if stamp != (mtime_ns, size, dir_mtime_ns):
+                outdated.append((path, cutline_type))
+        self.connection.executemany('DELETE FROM maprecords WHERE path = ? AND cutline_type = ?', outdated)
+        self.connection.commit()
+        return len(outdated)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM maprecords')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM maprecords').fetchone()[0]
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Manage persistent cache of converted OziExplorer maps')
+    parser.add_argument('cache_file', metavar='cache.sqlite')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    warm_parser = subparsers.add_parser('warm', help='Convert maps missing in cache or changed')
+    warm_parser.add_argument('inputs', metavar='PATH', nargs='*',
+                             help='Map file, directory (searched recursively) or glob pattern')
+    warm_parser.add_argument('--files-from', metavar='LIST_FILE', help='Read map file names from file, one per line')
+    warm_parser.add_argument('--cutline', choices=['raw', 'latlon', 'proj'], default='latlon')
+    warm_parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes')
+    subparsers.add_parser('prune', help='Delete entries for missing or changed files')
+    subparsers.add_parser('clear', help='Delete all entries')
+    subparsers.add_parser('stats', help='Print number of entries')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_command_line()
+    with MaprecordCache(args.cache_file) as cache:
+        if args.command == 'warm':
+            inputs = list(args.inputs)
+            missing = []
+            if args.files_from:
+                listed, missing = split_missing_files(read_file_list(args.files_from))
+                inputs.extend(listed)
+            try:
+                paths = [path for path, _ in collect_map_files(inputs)]
+            except Exception as e:
+                print(e, file=sys.stderr)
+                return 2
+            errors = [(path, 'file not found') for path in missing]
+            errors.extend(cache.warm(paths, args.cutline, args.jobs))
+            for path, error in errors:
+                print('FAILED %s: %s' % (path, error), file=sys.stderr)
+            print('%d maps, %d failed' % (len(paths) + len(missing), len(errors)), file=sys.stderr)
+            return 1 if errors else 0
+        elif args.command == 'prune':
+            print('%d entries removed' % cache.prune())
+        elif args.command == 'clear':
+            cache.clear()
+        elif args.command == 'stats':
+            print('%d entries' % len(cache))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+# Spatial index over footprints of many maps:
+#   python -m ozi_map.catalogue build INDEX_DIR maps/
+#   python -m ozi_map.catalogue query INDEX_DIR --point 37.6 55.7
+#
+# Footprint of a map is its MMPLL cutline or, for maps without cutline, outline of the image
+# (with --image-footprint, size is read from image header) or rectangle spanned by gcp pixels
+# converted to lat/lon. Footprint bounding boxes are packed into R-tree with
+# Sort-Tile-Recursive algorithm. Index is saved as a directory of .npy files which are opened
+# with mmap, so opening even a huge index is instant and only touched pages are read.
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ozi_map.batch import collect_map_files, read_file_list, split_missing_files
+from ozi_map.image_probe import probe_image
+from ozi_map.ozi_reader import read_ozi_map_file
+from ozi_map.ozi_to_maprec import find_map_image
+from ozi_map.srs import get_proj4
+from ozi_map.transform import MapTransform
+
+
+INDEX_VERSION = 1
+META_FILE = 'meta.json'
+ARRAY_NAMES = ('leaf_boxes', 'node_boxes', 'node_children', 'ring_offsets', 'ring_coords')
+NODE_SIZE = 16
+GCP_EXTENT_DENSIFY = 5
+
+
+def gcp_extent_ring(ozi_map, densify=GCP_EXTENT_DENSIFY):
+    """Lat/lon ring of rectangle spanned by pixels of map gcps"""
+    transform = MapTransform.from_ozi_map(ozi_map, latlon_srs=get_proj4('WGS 84'))
+    pixel_xs = [gcp.pixel.x for gcp in ozi_map.gcps]
+    pixel_ys = [gcp.pixel.y for gcp in ozi_map.gcps]
+    return transform.pixel_rect_ring(min(pixel_xs), min(pixel_ys), max(pixel_xs), max(pixel_ys), densify)
+
+
+def image_extent_ring(ozi_map, width, height, densify=GCP_EXTENT_DENSIFY):
+    """Lat/lon ring of image outline"""
+    transform = MapTransform.from_ozi_map(ozi_map, latlon_srs=get_proj4('WGS 84'))
+    return transform.pixel_rect_ring(0, 0, width, height, densify)
+
+
+def map_footprint(ozi_map, image_size=None):
+    """Returns (lons, lats) arrays of footprint ring of map parsed with compact=True.
+
+    image_size is (width, height) of map image, used for maps without cutline if given"""
+    cutline = ozi_map.cutline
+    if len(cutline) >= 3:
+        return np.array(cutline.xs, dtype=np.float64), np.array(cutline.ys, dtype=np.float64)
+    if image_size is not None:
+        return image_extent_ring(ozi_map, *image_size)
+    return gcp_extent_ring(ozi_map)
+
+
+def _probe_map_image(ozi_map, path):
+    try:
+        return probe_image(find_map_image(ozi_map, path))[1:]
+    except Exception:
+        # image is missing or unreadable, footprint falls back to gcps extent
+        return None
+
+
+def _footprint_job(path, image_footprint=False):
+    try:
+        ozi_map = read_ozi_map_file(path, compact=True)
+        image_size = None
+        if image_footprint and len(ozi_map.cutline) < 3:
+            image_size = _probe_map_image(ozi_map, path)
+        xs, ys = map_footprint(ozi_map, image_size)
+    except Exception as e:
+        return path, None, None, str(e)
+    return path, xs, ys, None
+
+
+def _str_order(boxes, node_size):
+    """Sort-Tile-Recursive order of boxes: vertical slices by x of centers, sorted by y inside slice"""
+    n = len(boxes)
+    cx = boxes[:, 0] + boxes[:, 2]
+    cy = boxes[:, 1] + boxes[:, 3]
+    slices_count = int(math.ceil(math.sqrt(math.ceil(n / float(node_size)))))
+    slice_size = slices_count * node_size
+    order = np.argsort(cx, kind='stable')
+    for start in range(0, n, slice_size):
+        part = order[start:start + slice_size]
+        order[start:start + slice_size] = part[np.argsort(cy[part], kind='stable')]
+    return order
+
+
+def _pack(boxes, node_size):
+    starts = np.arange(0, len(boxes), node_size)
+    counts = np.minimum(node_size, len(boxes) - starts)
+    parents = np.column_stack([
+        np.minimum.reduceat(boxes[:, 0], starts), np.minimum.reduceat(boxes[:, 1], starts),
+        np.maximum.reduceat(boxes[:, 2], starts), np.maximum.reduceat(boxes[:, 3], starts)])
+    return parents, np.column_stack([starts, counts])
+
+
+def _ring_boxes(ring_offsets, ring_coords):
+    starts = ring_offsets[:-1]
+    return np.column_stack([
+        np.minimum.reduceat(ring_coords[:, 0], starts), np.minimum.reduceat(ring_coords[:, 1], starts),
+        np.maximum.reduceat(ring_coords[:, 0], starts), np.maximum.reduceat(ring_coords[:, 1], starts)])
+
+
+def write_index(directory, names, rings, node_size=NODE_SIZE):
+    """Build index over rings, list of (lons, lats) arrays, and save it to directory"""
+    if len(names) != len(rings):
+        raise ValueError('Number of names and footprints differ')
+    if any(len(xs) < 3 for xs, _ in rings):
+        raise ValueError('Footprint must have at least 3 points')
+    count = len(rings)
+    sizes = np.array([len(xs) for xs, _ in rings], dtype=np.int64)
+    ring_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    if count:
+        ring_coords = np.column_stack([np.concatenate([np.asarray(xs, dtype=np.float64) for xs, _ in rings]),
+                                       np.concatenate([np.asarray(ys, dtype=np.float64) for _, ys in rings])])
+        leaf_boxes = _ring_boxes(ring_offsets, ring_coords)
+        # items are stored in STR order, so leaf position is item id
+        order = _str_order(leaf_boxes, node_size)
+        names = [names[i] for i in order]
+        leaf_boxes = leaf_boxes[order]
+        ring_coords = np.concatenate([ring_coords[ring_offsets[i]:ring_offsets[i + 1]] for i in order])
+        ring_offsets = np.concatenate([[0], np.cumsum(sizes[order])]).astype(np.int64)
+    else:
+        ring_coords = np.zeros((0, 2), dtype=np.float64)
+        leaf_boxes = np.zeros((0, 4), dtype=np.float64)
+
+    node_levels = []
+    level_boxes = leaf_boxes
+    while len(level_boxes) > 1 or not node_levels and len(level_boxes):
+        parents, children = _pack(level_boxes, node_size)
+        if len(parents) > 1:
+            # children are addressed explicitly, so parents can be reordered freely
+            order = _str_order(parents, node_size)
+            parents = parents[order]
+            children = children[order]
+        node_levels.append((parents, children))
+        level_boxes = parents
+    levels = []
+    offset = 0
+    for parents, _ in node_levels:
+        levels.append([offset, len(parents)])
+        offset += len(parents)
+    if node_levels:
+        node_boxes = np.concatenate([parents for parents, _ in node_levels])
+        node_children = np.concatenate([children for _, children in node_levels]).astype(np.int64)
+    else:
+        node_boxes = np.zeros((0, 4), dtype=np.float64)
+        node_children = np.zeros((0, 2), dtype=np.int64)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    arrays = {
+        'leaf_boxes': leaf_boxes,
+        'node_boxes': node_boxes,
+        'node_children': node_children,
+        'ring_offsets': ring_offsets,
+        'ring_coords': ring_coords,
+    }
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(directory, name + '.npy'), np.ascontiguousarray(arrays[name]))
+    meta = {'version': INDEX_VERSION, 'node_size': node_size, 'count': count, 'levels': levels, 'names': names}
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+
+def build_catalogue(map_paths, directory, workers=None, node_size=NODE_SIZE, image_footprint=False):
+    """Compute footprints of map files in a process pool and write index.
+
+    With image_footprint=True maps without cutline get outline of image as footprint, image size
+    is read from image header. Returns list of (path, error) for maps which could not be read,
+    they are not indexed."""
+    names = []
+    rings = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, xs, ys, error in executor.map(_footprint_job, map_paths, [image_footprint] * len(map_paths),
+                                                    chunksize=64):
+            if error is not None:
+                errors.append((path, error))
+            elif len(xs) < 3:
+                errors.append((path, 'Footprint has less than 3 points'))
+            else:
+                names.append(path)
+                rings.append((xs, ys))
+    write_index(directory, names, rings, node_size)
+    return errors
+
+
+def _expand_children(children):
+    counts = children[:, 1]
+    total = int(counts.sum())
+    firsts = np.repeat(children[:, 0], counts)
+    shifts = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return firsts + shifts
+
+
+def _boxes_intersect(boxes, xmin, ymin, xmax, ymax):
+    return (boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) & (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin)
+
+
+def point_in_ring(xs, ys, x, y):
+    """Even-odd test, points on the boundary may go either way"""
+    x2 = np.roll(xs, -1)
+    y2 = np.roll(ys, -1)
+    crossing = (ys > y) != (y2 > y)
+    if not crossing.any():
+        return False
+    x1, y1, x2, y2 = xs[crossing], ys[crossing], x2[crossing], y2[crossing]
+    x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return bool(np.count_nonzero(x < x_cross) % 2)
+
+
+def _segments_cross(ax, ay, bx, by, cx, cy, dx, dy):
+    """Whether segments AB (arrays) intersect segment CD (scalars), touching counts as intersection"""
+    def orient(px, py, qx, qy, rx, ry):
+        return np.sign((qx - px) * (ry - py) - (qy - py) * (rx - px))
+
+    def on_segment(px, py, qx, qy, rx, ry):
+        return ((np.minimum(px, qx) <= rx) & (rx <= np.maximum(px, qx)) &
+                (np.minimum(py, qy) <= ry) & (ry <= np.maximum(py, qy)))
+
+    o1 = orient(ax, ay, bx, by, cx, cy)
+    o2 = orient(ax, ay, bx, by, dx, dy)
+    o3 = orient(cx, cy, dx, dy, ax, ay)
+    o4 = orient(cx, cy, dx, dy, bx, by)
+    result = (o1 != o2) & (o3 != o4)
+    result |= (o1 == 0) & on_segment(ax, ay, bx, by, cx, cy)
+    result |= (o2 == 0) & on_segment(ax, ay, bx, by, dx, dy)
+    result |= (o3 == 0) & on_segment(cx, cy, dx, dy, ax, ay)
+    result |= (o4 == 0) & on_segment(cx, cy, dx, dy, bx, by)
+    return result
+
+
+def ring_intersects_bbox(xs, ys, xmin, ymin, xmax, ymax):
+    if np.any((xs >= xmin) & (xs <= xmax) & (ys >= ymin) & (ys <= ymax)):
+        return True
+    if point_in_ring(xs, ys, xmin, ymin):
+        return True
+    x2 = np.roll(xs, -1)
+    y2 = np.roll(ys, -1)
+    corners = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
+    for (cx, cy), (dx, dy) in zip(corners, corners[1:] + corners[:1]):
+        if _segments_cross(xs, ys, x2, y2, cx, cy, dx, dy).any():
+            return True
+    return False
+
+
+def ring_distance(xs, ys, x, y, x_scale=1.0):
+    """Distance from point to ring in degrees of latitude, 0 if point is inside.
+
+    Longitudes are multiplied by x_scale, cos(lat) makes distances roughly isotropic."""
+    if point_in_ring(xs, ys, x, y):
+        return 0.0
+    ax = (xs - x) * x_scale
+    ay = ys - y
+    bx = np.roll(ax, -1)
+    by = np.roll(ay, -1)
+    ex = bx - ax
+    ey = by - ay
+    length2 = ex * ex + ey * ey
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(length2 > 0, -(ax * ex + ay * ey) / length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    px = ax + t * ex
+    py = ay + t * ey
+    return float(np.sqrt((px * px + py * py).min()))
+
+
+def _box_distance(boxes, x, y, x_scale):
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0) * x_scale
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+    return np.sqrt(dx * dx + dy * dy)
+
+
+class Catalogue(object):
+    """Read-only index written by write_index or build_catalogue.
+
+    Query methods return lists of map names (paths), coordinates are lon/lat."""
+
+    def __init__(self, directory, mmap=True):
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise Exception('Unsupported catalogue version in "%s"' % directory)
+        self.directory = directory
+        self.names = meta['names']
+        self.levels = meta['levels']
+        mmap_mode = 'r' if mmap else None
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.names)
+
+    def footprint(self, item_id):
+        start, end = self.ring_offsets[item_id], self.ring_offsets[item_id + 1]
+        coords = np.asarray(self.ring_coords[start:end])
+        return coords[:, 0], coords[:, 1]
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        """Ids of items whose bounding boxes intersect bbox"""
+        if not self.names:
+            return np.zeros(0, dtype=np.int64)
+        offset, count = self.levels[-1]
+        ids = np.arange(count)
+        for level in range(len(self.levels) - 1, -1, -1):
+            offset = self.levels[level][0]
+            boxes = self.node_boxes[offset + ids]
+            ids = ids[_boxes_intersect(boxes, xmin, ymin, xmax, ymax)]
+            ids = _expand_children(self.node_children[offset + ids])
+        return ids[_boxes_intersect(self.leaf_boxes[ids], xmin, ymin, xmax, ymax)]
+
+    def query_point(self, lon, lat, exact=True):
+        """Maps covering point"""
+        ids = self._candidates(lon, lat, lon, lat)
+        if exact:
+            ids = [i for i in ids if point_in_ring(*self.footprint(i), x=lon, y=lat)]
+        return [self.names[i] for i in ids]
+
+    def query_bbox(self, xmin, ymin, xmax, ymax, exact=True):
+        """Maps intersecting bbox, e.g. tile bounds"""
+        ids = self._candidates(xmin, ymin, xmax, ymax)
+        if exact:
+            ids = [i for i in ids if ring_intersects_bbox(*self.footprint(i), xmin=xmin, ymin=ymin,
+                                                          xmax=xmax, ymax=ymax)]
+        return [self.names[i] for i in ids]
+
+    def nearest(self, lon, lat, k=1):
+        """Returns up to k (name, distance) pairs for maps closest to point.
+
+        Distance is to footprint polygon, measured in degrees of latitude with longitudes scaled
+        by cos(lat), 0 for maps covering the point."""
+        if not self.names:
+            return []
+        x_scale = math.cos(math.radians(lat))
+        top = len(self.levels) - 1
+        offset, count = self.levels[top]
+        ids = np.arange(count)
+        # entries are (distance, is_exact, level, id), level -1 means item
+        heap = [(d, False, top, i) for d, i in zip(_box_distance(self.node_boxes[offset + ids], lon, lat, x_scale),
+                                                   ids.tolist())]
+        heapq.heapify(heap)
+        result = []
+        while heap and len(result) < k:
+            distance, is_exact, level, node = heapq.heappop(heap)
+            if level == -1:
+                if is_exact:
+                    result.append((self.names[node], distance))
+                else:
+                    xs, ys = self.footprint(node)
+                    heapq.heappush(heap, (ring_distance(xs, ys, lon, lat, x_scale), True, -1, node))
+                continue
+            first, count = self.node_children[self.levels[level][0] + node]
+            ids = np.arange(first, first + count)
+            if level == 0:
+                boxes = self.leaf_boxes[ids]
+            else:
+                boxes = self.node_boxes[self.levels[level - 1][0] + ids]
+            for d, i in zip(_box_distance(boxes, lon, lat, x_scale).tolist(), ids.tolist()):
+                heapq.heappush(heap, (d, False, level - 1, i))
+        return result
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Spatial index of OziExplorer maps footprints')
+    parser.add_argument('index_dir')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    build_parser = subparsers.add_parser('build', help='Build index from map files')
+    build_parser.add_argument('inputs', metavar='PATH', nargs='*',
+                              help='Map file, directory (searched recursively) or glob pattern')
+    build_parser.add_argument('--files-from', metavar='LIST_FILE', help='Read map file names from file, one per line')
+    build_parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes')
+    build_parser.add_argument('--image-footprint', action='store_true',
+                              help='Use image outline as footprint of maps without cutline')
+    query_parser = subparsers.add_parser('query', help='Find maps')
+    group = query_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--point', nargs=2, type=float, metavar=('LON', 'LAT'))
+    group.add_argument('--bbox', nargs=4, type=float, metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'))
+    group.add_argument('--nearest', nargs=2, type=float, metavar=('LON', 'LAT'))
+    query_parser.add_argument('-k', type=int, default=1, help='Number of maps for --nearest')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_command_line()
+    if args.command == 'build':
+        inputs = list(args.inputs)
+        missing = []
+        if args.files_from:
+            listed, missing = split_missing_files(read_file_list(args.files_from))
+            inputs.extend(listed)
+        try:
+            paths = [os.path.abspath(path) for path, _ in collect_map_files(inputs)]
+        except Exception as e:
+            print(e, file=sys.stderr)
+            return 2
+        errors = build_catalogue(paths, args.index_dir, args.jobs, image_footprint=args.image_footprint)
+        for path in missing:
+            print('FAILED %s: file not found' % path, file=sys.stderr)
+        for path, error in errors:
+            print('FAILED %s: %s' % (path, error), file=sys.stderr)
+        print('%d maps indexed, %d failed' % (len(paths) - len(errors), len(errors) + len(missing)), file=sys.stderr)
+        return 1 if errors or missing else 0
+    catalogue = Catalogue(args.index_dir)
+    if args.point:
+        names = catalogue.query_point(*args.point)
+    elif args.bbox:
+        names = catalogue.query_bbox(*args.bbox)
+    else:
+        names = ['%s\t%.6f' % item for item in catalogue.nearest(args.nearest[0], args.nearest[1], args.k)]
+    for name in names:
+        print(name)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# Cutline processing for rendering:
+#   simplify_ring - Douglas-Peucker simplification which does not introduce self-intersections,
+#   CutlineMasks - cutline rasterized in pixel space at several resolutions (level k is image
+#     scaled down 2**k times), stored as packed bits, so clipping a tile is a slice of a bit array.
+# get_cutline_masks builds masks for a map file and caches them in memory and optionally on disk,
+# keyed by path, mtime and size of the file.
+import hashlib
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from ozi_map.image_probe import probe_image
+from ozi_map.ozi_reader import read_ozi_map_file
+from ozi_map.ozi_to_maprec import find_map_image
+from ozi_map.srs import get_proj4
+from ozi_map.transform import MapTransform
+
+
+# default simplification tolerance in pixels of level 0, coarser levels use tolerance * 2**level
+SIMPLIFY_TOLERANCE = 0.5
+# coarsest level is the first one with both sides not larger than this
+MIN_LEVEL_SIZE = 256
+# rows rasterized at once are limited so that fill buffer has at most this number of cells
+RASTER_BLOCK_CELLS = 1 << 24
+MASKS_CACHE_SIZE = 16
+MASKS_FILE_VERSION = 1
+
+INSIDE = 'inside'
+OUTSIDE = 'outside'
+PARTIAL = 'partial'
+
+
+def _segment_distances(points, start, end):
+    """Distances of points[start + 1:end] to segment points[start], points[end]"""
+    a = points[start]
+    b = points[end]
+    p = points[start + 1:end]
+    d = b - a
+    length2 = d.dot(d)
+    if length2 == 0:
+        return np.hypot(p[:, 0] - a[0], p[:, 1] - a[1])
+    t = np.clip(((p - a).dot(d)) / length2, 0.0, 1.0)
+    return np.hypot(p[:, 0] - a[0] - t * d[0], p[:, 1] - a[1] - t * d[1])
+
+
+def _farthest(points, start, end):
+    """(index, distance) of point between start and end farthest from segment start-end"""
+    distances = _segment_distances(points, start, end)
+    i = int(np.argmax(distances))
+    return start + 1 + i, distances[i]
+
+
+def _douglas_peucker(points, keep, start, end, tolerance):
+    stack = [(start, end)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        i, distance = _farthest(points, start, end)
+        if distance > tolerance:
+            keep[i] = True
+            stack.append((start, i))
+            stack.append((i, end))
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+def _crossing_segments(points, indices):
+    """Positions (in indices) of segments of ring points[indices] touching or crossing non-adjacent segments"""
+    m = len(indices)
+    a = points[indices]
+    b = points[np.roll(indices, -1)]
+    xmin = np.minimum(a[:, 0], b[:, 0])
+    xmax = np.maximum(a[:, 0], b[:, 0])
+    ymin = np.minimum(a[:, 1], b[:, 1])
+    ymax = np.maximum(a[:, 1], b[:, 1])
+    # candidate pairs: segments sorted by xmin, j follows i and starts before i ends
+    order = np.argsort(xmin, kind='stable')
+    sorted_xmin = xmin[order]
+    ends = np.searchsorted(sorted_xmin, xmax[order], side='right')
+    counts = ends - np.arange(m) - 1
+    counts = np.maximum(counts, 0)
+    first = np.repeat(np.arange(m), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    i = order[first]
+    j = order[first + 1 + offsets]
+    gap = np.abs(i - j)
+    candidates = (gap != 1) & (gap != m - 1) & (ymin[i] <= ymax[j]) & (ymin[j] <= ymax[i])
+    i = i[candidates]
+    j = j[candidates]
+    o1 = _orientation(a[i, 0], a[i, 1], b[i, 0], b[i, 1], a[j, 0], a[j, 1])
+    o2 = _orientation(a[i, 0], a[i, 1], b[i, 0], b[i, 1], b[j, 0], b[j, 1])
+    o3 = _orientation(a[j, 0], a[j, 1], b[j, 0], b[j, 1], a[i, 0], a[i, 1])
+    o4 = _orientation(a[j, 0], a[j, 1], b[j, 0], b[j, 1], b[i, 0], b[i, 1])
+    # touching counts as crossing, bounding boxes already overlap so collinear segments overlap too
+    crossing = (o1 * o2 <= 0) & (o3 * o4 <= 0)
+    return np.unique(np.concatenate([i[crossing], j[crossing]]))
+
+
+def simplify_ring(xs, ys, tolerance, preserve_topology=True):
+    """Douglas-Peucker simplification of closed ring, returns (xs, ys) float64 arrays.
+
+    Ring may be given with or without closing point, result is in the same form. With preserve_topology
+    segments of simplified ring crossing other segments are split at farthest removed point until
+    no crossings are left (or segments can't be split, if original ring crosses itself)."""
+    points = np.column_stack([np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)])
+    closed = len(points) > 1 and (points[0] == points[-1]).all()
+    if closed:
+        points = points[:-1]
+    n = len(points)
+    if n <= 3 or tolerance <= 0:
+        result = points
+    else:
+        # ring is processed as polyline 0..far..n, point n is the same as point 0
+        ring = np.vstack([points, points[:1]])
+        keep = np.zeros(n + 1, dtype=bool)
+        keep[0] = keep[n] = True
+        far = int(np.argmax(np.hypot(points[:, 0] - points[0, 0], points[:, 1] - points[0, 1])))
+        keep[far] = True
+        _douglas_peucker(ring, keep, 0, far, tolerance)
+        _douglas_peucker(ring, keep, far, n, tolerance)
+        if keep[:n].sum() < 3:
+            i, _ = max([_farthest(ring, 0, far), _farthest(ring, far, n)], key=lambda item: item[1])
+            keep[i] = True
+        if preserve_topology:
+            while True:
+                indices = np.flatnonzero(keep[:n])
+                crossing = _crossing_segments(points, indices)
+                added = False
+                next_indices = np.append(indices[1:], n)
+                for k in crossing:
+                    start, end = indices[k], next_indices[k]
+                    if end - start >= 2:
+                        keep[_farthest(ring, start, end)[0]] = True
+                        added = True
+                if not added:
+                    break
+        result = points[keep[:n]]
+    if closed:
+        result = np.vstack([result, result[:1]])
+    return result[:, 0].copy(), result[:, 1].copy()
+
+
+def cutline_pixel_arrays(ozi_map):
+    """Returns (xs, ys) float64 pixel coordinates of cutline of map parsed with compact=True.
+
+    MMPXY points are used if present, otherwise MMPLL points (treated as WGS 84) are converted to pixels."""
+    if len(ozi_map.cutline_pixels):
+        return (np.frombuffer(ozi_map.cutline_pixels.xs, dtype=np.int64).astype(np.float64),
+                np.frombuffer(ozi_map.cutline_pixels.ys, dtype=np.int64).astype(np.float64))
+    lons = np.frombuffer(ozi_map.cutline.xs, dtype=np.float64)
+    lats = np.frombuffer(ozi_map.cutline.ys, dtype=np.float64)
+    if not len(lons):
+        return np.empty(0), np.empty(0)
+    return MapTransform.from_ozi_map(ozi_map, latlon_srs=get_proj4('WGS 84')).latlon_to_pixel(lons, lats)
+
+
+def _ring_crossings(xs, ys, height):
+    """Returns (rows, xs) of crossings of ring edges with centers of pixel rows, sorted by row and x"""
+    x0, y0 = xs, ys
+    x1, y1 = np.roll(xs, -1), np.roll(ys, -1)
+    low = np.minimum(y0, y1)
+    high = np.maximum(y0, y1)
+    # row r is crossed if low <= r + 0.5 < high, half open interval counts shared vertices once
+    first = np.clip(np.ceil(low - 0.5), 0, height).astype(np.int64)
+    last = np.clip(np.ceil(high - 0.5), 0, height).astype(np.int64)
+    counts = last - first
+    edges = np.repeat(np.arange(len(xs)), counts)
+    rows = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    t = (rows + 0.5 - y0[edges]) / (y1[edges] - y0[edges])
+    crossings = x0[edges] + t * (x1[edges] - x0[edges])
+    order = np.lexsort((crossings, rows))
+    return rows[order], crossings[order]
+
+
+def rasterize_ring(xs, ys, width, height):
+    """Even-odd rasterization of ring at pixel centers, returns (height, ceil(width / 8)) array of packed bits"""
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    packed = np.zeros((height, (width + 7) // 8), dtype=np.uint8)
+    if len(xs) < 3:
+        return packed
+    rows, crossings = _ring_crossings(xs, ys, height)
+    # every row has even number of crossings, consecutive pairs are inside spans
+    span_rows = rows[0::2]
+    starts = np.clip(np.ceil(crossings[0::2] - 0.5), 0, width).astype(np.int64)
+    ends = np.clip(np.ceil(crossings[1::2] - 0.5), 0, width).astype(np.int64)
+    block_rows = max(1, RASTER_BLOCK_CELLS // (width + 1))
+    bounds = np.searchsorted(span_rows, np.arange(0, height + block_rows, block_rows))
+    for block_start, lo, hi in zip(range(0, height, block_rows), bounds, bounds[1:]):
+        block_height = min(block_rows, height - block_start)
+        fill = np.zeros((block_height, width + 1), dtype=np.int16)
+        r = span_rows[lo:hi] - block_start
+        np.add.at(fill, (r, starts[lo:hi]), 1)
+        np.add.at(fill, (r, ends[lo:hi]), -1)
+        packed[block_start:block_start + block_height] = np.packbits(np.cumsum(fill[:, :width], axis=1) > 0, axis=1)
+    return packed
+
+
+def _full_mask(width, height):
+    return np.packbits(np.ones((height, width), dtype=bool), axis=1)
+
+
+class CutlineMasks(object):
+    """Cutline masks of image at levels 0 (full resolution), 1 (half resolution) and so on.
+
+    Pixels outside of image are outside of mask."""
+
+    def __init__(self, width, height, levels):
+        self.width = width
+        self.height = height
+        # list of packed bits arrays, level k has shape (ceil(height / 2**k), ceil(ceil(width / 2**k) / 8))
+        self.levels = levels
+
+    def level_size(self, level):
+        """(width, height) of mask at level"""
+        return -(-self.width >> level), -(-self.height >> level)
+
+    def mask(self, level, x0, y0, x1, y1):
+        """Boolean array of shape (y1 - y0, x1 - x0) for window of mask at level"""
+        width, height = self.level_size(level)
+        result = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x1, width), min(y1, height)
+        if cx0 >= cx1 or cy0 >= cy1:
+            return result
+        byte0 = cx0 // 8
+        bits = np.unpackbits(self.levels[level][cy0:cy1, byte0:(cx1 + 7) // 8], axis=1)
+        result[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = bits[:, cx0 - byte0 * 8:cx1 - byte0 * 8]
+        return result
+
+    def window_state(self, level, x0, y0, x1, y1):
+        """INSIDE if window is fully inside cutline, OUTSIDE if fully outside, PARTIAL otherwise"""
+        inside = np.count_nonzero(self.mask(level, x0, y0, x1, y1))
+        if inside == 0:
+            return OUTSIDE
+        if inside == (x1 - x0) * (y1 - y0):
+            return INSIDE
+        return PARTIAL
+
+    def save(self, path):
+        """Write masks to .npz file, written to temporary file first so readers never see partial file"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=MASKS_FILE_VERSION, size=np.array([self.width, self.height]),
+                     **dict(('level%d' % i, level) for i, level in enumerate(self.levels)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) != MASKS_FILE_VERSION:
+                raise Exception('Unsupported cutline masks version in "%s"' % path)
+            width, height = data['size'].tolist()
+            levels = []
+            while 'level%d' % len(levels) in data:
+                levels.append(data['level%d' % len(levels)])
+        return cls(width, height, levels)
+
+
+def build_cutline_masks(xs, ys, width, height, tolerance=SIMPLIFY_TOLERANCE, min_size=MIN_LEVEL_SIZE):
+    """Rasterize pixel cutline at all levels, ring is simplified with tolerance * 2**level for every level.
+
+    Cutline with less than 3 points does not clip anything, masks are fully inside."""
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    levels_count = 1 + max(0, int(math.ceil(math.log2(max(width, height, 1) / float(min_size)))))
+    masks = CutlineMasks(width, height, [])
+    for level in range(levels_count):
+        level_width, level_height = masks.level_size(level)
+        if len(xs) < 3:
+            masks.levels.append(_full_mask(level_width, level_height))
+            continue
+        scale = 0.5 ** level
+        level_xs, level_ys = xs * scale, ys * scale
+        if tolerance > 0:
+            level_xs, level_ys = simplify_ring(level_xs, level_ys, tolerance)
+        masks.levels.append(rasterize_ring(level_xs, level_ys, level_width, level_height))
+    return masks
+
+
+def _file_identity(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+def _cache_file_name(identity, tolerance, min_size):
+    key = repr((identity, tolerance, min_size)).encode('utf-8')
+    return hashlib.sha1(key).hexdigest() + '.npz'
+
+
+@lru_cache(maxsize=MASKS_CACHE_SIZE)
+def _cached_masks(identity, tolerance, min_size, cache_dir):
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, _cache_file_name(identity, tolerance, min_size))
+        if os.path.exists(cache_path):
+            return CutlineMasks.load(cache_path)
+    path = identity[0]
+    ozi_map = read_ozi_map_file(path, compact=True)
+    _, width, height = probe_image(find_map_image(ozi_map, path))
+    xs, ys = cutline_pixel_arrays(ozi_map)
+    masks = build_cutline_masks(xs, ys, width, height, tolerance, min_size)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        masks.save(cache_path)
+    return masks
+
+
+def get_cutline_masks(map_path, tolerance=SIMPLIFY_TOLERANCE, min_size=MIN_LEVEL_SIZE, cache_dir=None):
+    """CutlineMasks of map, image size is read from image header.
+
+    Masks are cached in memory and, if cache_dir is given, in .npz files there. Cache key includes
+    mtime and size of map file, so changed maps are rebuilt."""
+    return _cached_masks(_file_identity(map_path), tolerance, min_size, cache_dir)
+
+
+def masks_cache_info():
+    return _cached_masks.cache_info()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+from collections import OrderedDict
+from threading import Lock
+
+
+MAX_CACHED_DIRECTORIES = 1024
+
+
+class DirectoryIndex(object):
+    """Case-insensitive index of regular files in a directory"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.mtime_ns = os.stat(self.path).st_mtime_ns
+        self.files = {}
+        for entry in os.scandir(self.path):
+            try:
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            self.files.setdefault(entry.name.lower(), []).append(os.path.join(self.path, entry.name))
+        for paths in self.files.values():
+            paths.sort()
+
+    def lookup(self, file_name):
+        """Returns list of absolute paths of files with name matching file_name ignoring case"""
+        return self.files.get(file_name.lower(), [])
+
+    def is_current(self):
+        try:
+            return os.stat(self.path).st_mtime_ns == self.mtime_ns
+        except OSError:
+            return False
+
+
+_indexes = OrderedDict()
+_lock = Lock()
+
+
+def get_directory_index(path):
+    """Returns shared DirectoryIndex for path, rebuilding it when directory mtime changed"""
+    key = os.path.abspath(path)
+    with _lock:
+        index = _indexes.get(key)
+    if index is not None and index.is_current():
+        with _lock:
+            if key in _indexes:
+                _indexes.move_to_end(key)
+        return index
+    index = DirectoryIndex(key)
+    with _lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_CACHED_DIRECTORIES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def clear_directory_indexes():
+    with _lock:
+        _indexes.clear()
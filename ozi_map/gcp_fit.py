@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Vectorized least squares fit of affine geotransforms (GDAL layout) for one or many maps:
+#   X = gt[0] + px * gt[1] + py * gt[2]
+#   Y = gt[3] + px * gt[4] + py * gt[5]
+from collections import namedtuple
+
+import numpy as np
+
+
+GeotransformFit = namedtuple('GeotransformFit', ['geotransform', 'inv_geotransform', 'residuals', 'inv_residuals'])
+
+
+def gcps_to_arrays(gcps):
+    """Return (pixels, refs) arrays of shape (N, 2) for gcps with pixel and ref attributes"""
+    pixels = np.array([(gcp.pixel.x, gcp.pixel.y) for gcp in gcps], dtype=np.float64).reshape(-1, 2)
+    refs = np.array([(gcp.ref.x, gcp.ref.y) for gcp in gcps], dtype=np.float64).reshape(-1, 2)
+    return pixels, refs
+
+
+def stack_gcp_arrays(arrays):
+    """Stack (N_i, 2) arrays of different length into (M, max(N_i), 2) array padded with NaN"""
+    size = max([len(a) for a in arrays] or [0])
+    stacked = np.full((len(arrays), size, 2), np.nan)
+    for i, a in enumerate(arrays):
+        stacked[i, :len(a)] = a
+    return stacked
+
+
+def apply_geotransforms(geotransforms, points):
+    gt = geotransforms[:, None, :]
+    x = gt[..., 0] + points[..., 0] * gt[..., 1] + points[..., 1] * gt[..., 2]
+    y = gt[..., 3] + points[..., 0] * gt[..., 4] + points[..., 1] * gt[..., 5]
+    return np.stack([x, y], axis=-1)
+
+
+def _solve_affine(src, dst, valid):
+    maps_n = src.shape[0]
+    result = np.full((maps_n, 6), np.nan)
+    counts = valid.sum(axis=1)
+    weights = valid.astype(np.float64)
+    src = np.where(valid[..., None], src, 0.0)
+    dst = np.where(valid[..., None], dst, 0.0)
+
+    # centering keeps normal equations well conditioned for projected coordinates
+    with np.errstate(invalid='ignore', divide='ignore'):
+        src_mean = src.sum(axis=1) / counts[:, None]
+        dst_mean = dst.sum(axis=1) / counts[:, None]
+    src_c = (src - src_mean[:, None]) * weights[..., None]
+    dst_c = (dst - dst_mean[:, None]) * weights[..., None]
+
+    two = counts == 2
+    if two.any():
+        dx = src_c[two, :, 0].max(axis=1) - src_c[two, :, 0].min(axis=1)
+        dy = src_c[two, :, 1].max(axis=1) - src_c[two, :, 1].min(axis=1)
+        ok = (dx != 0) & (dy != 0)
+        idx = np.flatnonzero(two)[ok]
+        if len(idx):
+            sx = (src_c[idx, :, 0] * dst_c[idx, :, 0]).sum(axis=1) / (src_c[idx, :, 0] ** 2).sum(axis=1)
+            sy = (src_c[idx, :, 1] * dst_c[idx, :, 1]).sum(axis=1) / (src_c[idx, :, 1] ** 2).sum(axis=1)
+            result[idx, 1] = sx
+            result[idx, 2] = 0.0
+            result[idx, 4] = 0.0
+            result[idx, 5] = sy
+            result[idx, 0] = dst_mean[idx, 0] - src_mean[idx, 0] * sx
+            result[idx, 3] = dst_mean[idx, 1] - src_mean[idx, 1] * sy
+
+    many = counts > 2
+    if many.any():
+        idx = np.flatnonzero(many)
+        a = src_c[idx]
+        ata = np.einsum('mni,mnj->mij', a, a)
+        atb = np.einsum('mni,mnj->mij', a, dst_c[idx])
+        det = np.linalg.det(ata)
+        scale = np.einsum('mii->m', ata) ** 2
+        ok = np.abs(det) > scale * 1e-12
+        ata[~ok] = np.eye(2)
+        coef = np.linalg.solve(ata, atb)
+        coef[~ok] = np.nan
+        # coef[m, i, j]: contribution of pixel axis i to ground axis j
+        result[idx, 1] = coef[:, 0, 0]
+        result[idx, 2] = coef[:, 1, 0]
+        result[idx, 4] = coef[:, 0, 1]
+        result[idx, 5] = coef[:, 1, 1]
+        result[idx, 0] = dst_mean[idx, 0] - src_mean[idx, 0] * result[idx, 1] - src_mean[idx, 1] * result[idx, 2]
+        result[idx, 3] = dst_mean[idx, 1] - src_mean[idx, 0] * result[idx, 4] - src_mean[idx, 1] * result[idx, 5]
+    return result
+
+
+def _residuals(geotransforms, src, dst, valid):
+    predicted = apply_geotransforms(geotransforms, np.where(valid[..., None], src, 0.0))
+    residuals = np.hypot(predicted[..., 0] - dst[..., 0], predicted[..., 1] - dst[..., 1])
+    residuals[~valid] = np.nan
+    return residuals
+
+
+def fit_geotransforms(pixels, refs):
+    """Fit forward and inverse geotransforms for a stack of maps.
+
+    pixels and refs are arrays of shape (M, N, 2), missing gcps are marked with NaN.
+    Maps which can not be fitted get NaN geotransforms."""
+    pixels = np.asarray(pixels, dtype=np.float64)
+    refs = np.asarray(refs, dtype=np.float64)
+    if pixels.shape != refs.shape or pixels.ndim != 3 or pixels.shape[2] != 2:
+        raise ValueError('fit_geotransforms: pixels and refs must have equal shape (M, N, 2)')
+    valid = np.isfinite(pixels).all(axis=2) & np.isfinite(refs).all(axis=2)
+    geotransforms = _solve_affine(pixels, refs, valid)
+    inv_geotransforms = _solve_affine(refs, pixels, valid)
+    residuals = _residuals(geotransforms, pixels, refs, valid)
+    inv_residuals = _residuals(inv_geotransforms, refs, pixels, valid)
+    return GeotransformFit(geotransforms, inv_geotransforms, residuals, inv_residuals)
+
+
+def fit_geotransform(pixels, refs):
+    """Fit geotransform for a single map, pixels and refs are (N, 2) arrays.
+
+    Residuals are distances between gcps and fitted positions, in ground units for
+    forward transform and in pixels for inverse one."""
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+    refs = np.asarray(refs, dtype=np.float64).reshape(-1, 2)
+    if len(pixels) < 2:
+        raise ValueError('fit_geotransform: at least 2 gcps are required')
+    fit = fit_geotransforms(pixels[None], refs[None])
+    if not np.isfinite(fit.geotransform).all() or not np.isfinite(fit.inv_geotransform).all():
+        raise ValueError('fit_geotransform: can\'t calculate geotransform for given gcps')
+    return GeotransformFit(fit.geotransform[0].tolist(), fit.inv_geotransform[0].tolist(),
+                           fit.residuals[0], fit.inv_residuals[0])
+
+
+def fit_gcps(gcps):
+    return fit_geotransform(*gcps_to_arrays(gcps))
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Non-affine mappings between pixel and ground coordinates fitted over map gcps:
+#   polynomial of order 1-3 (least squares, like GDAL -order N) and thin plate spline
+#   (exact interpolation of gcps, like GDAL -tps).
+# Models are slow to evaluate for every pixel, InterpolationGrid samples a model on a regular grid
+# fine enough for given error tolerance and evaluates it with bilinear interpolation.
+import math
+from functools import lru_cache
+
+import numpy as np
+
+
+# minimal number of gcps for polynomial of given order
+POLYNOMIAL_MIN_GCPS = {1: 3, 2: 6, 3: 10}
+TPS_MIN_GCPS = 3
+# number of points evaluated at once by thin plate spline, limits memory for distances matrix
+TPS_CHUNK_SIZE = 65536
+GRID_INITIAL_CELL = 256.0
+GRID_MAX_CELLS = 4096
+GRID_CACHE_SIZE = 64
+
+
+def _as_arrays(x, y):
+    return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+
+def _normalization(points):
+    """(center, scale) mapping points to about [-1, 1], keeps fitting well conditioned for projected coordinates"""
+    center = points.mean(axis=0)
+    scale = np.abs(points - center).max()
+    if not scale:
+        raise ValueError('gcps coincide')
+    return center, scale
+
+
+class GcpModel(object):
+    """Base class of fitted models. Models are compared and hashed by their coefficients,
+    so they can be used as cache keys."""
+
+    def transform(self, x, y):
+        raise NotImplementedError()
+
+    def _key(self):
+        raise NotImplementedError()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def residuals(self, src, dst):
+        """Distances between dst points and src points transformed by model"""
+        src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+        dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+        x, y = self.transform(src[:, 0], src[:, 1])
+        return np.hypot(x - dst[:, 0], y - dst[:, 1])
+
+
+def _monomials(x, y, order):
+    return [x ** (n - j) * y ** j for n in range(order + 1) for j in range(n + 1)]
+
+
+class PolynomialModel(GcpModel):
+    def __init__(self, order, src_center, src_scale, dst_center, coefficients):
+        self.order = order
+        self.src_center = np.asarray(src_center, dtype=np.float64)
+        self.src_scale = float(src_scale)
+        self.dst_center = np.asarray(dst_center, dtype=np.float64)
+        # shape (number of monomials, 2)
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, src, dst, order=2):
+        """Least squares fit of polynomial mapping src (N, 2) points to dst (N, 2) points"""
+        src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+        dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+        if order not in POLYNOMIAL_MIN_GCPS:
+            raise ValueError('PolynomialModel: unsupported order %s' % order)
+        if len(src) < POLYNOMIAL_MIN_GCPS[order]:
+            raise ValueError('PolynomialModel: at least %d gcps are required for order %d' % (
+                POLYNOMIAL_MIN_GCPS[order], order))
+        src_center, src_scale = _normalization(src)
+        dst_center = dst.mean(axis=0)
+        u = (src - src_center) / src_scale
+        a = np.column_stack(_monomials(u[:, 0], u[:, 1], order))
+        coefficients, _, rank, _ = np.linalg.lstsq(a, dst - dst_center, rcond=None)
+        if rank < a.shape[1]:
+            raise ValueError('PolynomialModel: gcps are degenerate for order %d' % order)
+        return cls(order, src_center, src_scale, dst_center, coefficients)
+
+    def transform(self, x, y):
+        x, y = _as_arrays(x, y)
+        u = (x - self.src_center[0]) / self.src_scale
+        v = (y - self.src_center[1]) / self.src_scale
+        result_x = np.full(np.broadcast(u, v).shape, self.dst_center[0])
+        result_y = np.full(result_x.shape, self.dst_center[1])
+        for term, (cx, cy) in zip(_monomials(u, v, self.order), self.coefficients):
+            result_x += cx * term
+            result_y += cy * term
+        return result_x, result_y
+
+    def _key(self):
+        return (self.order, self.src_center.tobytes(), self.src_scale, self.dst_center.tobytes(),
+                self.coefficients.tobytes())
+
+
+def _tps_kernel(r2):
+    # U(r) = r^2 * log(r), written through r^2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(r2 > 0, 0.5 * r2 * np.log(r2), 0.0)
+
+
+class ThinPlateSplineModel(GcpModel):
+    def __init__(self, src_center, src_scale, dst_center, control_points, weights, affine):
+        self.src_center = np.asarray(src_center, dtype=np.float64)
+        self.src_scale = float(src_scale)
+        self.dst_center = np.asarray(dst_center, dtype=np.float64)
+        # normalized src points (N, 2), their weights (N, 2) and affine part (3, 2)
+        self.control_points = np.asarray(control_points, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.affine = np.asarray(affine, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, src, dst, smoothing=0.0):
+        """Thin plate spline mapping src (N, 2) points to dst (N, 2) points.
+
+        With smoothing=0 gcps are interpolated exactly, larger values make mapping closer to affine."""
+        src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+        dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+        n = len(src)
+        if n < TPS_MIN_GCPS:
+            raise ValueError('ThinPlateSplineModel: at least %d gcps are required' % TPS_MIN_GCPS)
+        src_center, src_scale = _normalization(src)
+        dst_center = dst.mean(axis=0)
+        u = (src - src_center) / src_scale
+        diff = u[:, None, :] - u[None, :, :]
+        system = np.zeros((n + 3, n + 3))
+        system[:n, :n] = _tps_kernel((diff ** 2).sum(axis=2)) + smoothing * np.eye(n)
+        system[:n, n] = system[n, :n] = 1.0
+        system[:n, n + 1:] = u
+        system[n + 1:, :n] = u.T
+        rhs = np.zeros((n + 3, 2))
+        rhs[:n] = dst - dst_center
+        try:
+            solution = np.linalg.solve(system, rhs)
+        except np.linalg.LinAlgError:
+            raise ValueError('ThinPlateSplineModel: gcps are collinear or duplicated')
+        return cls(src_center, src_scale, dst_center, u, solution[:n], solution[n:])
+
+    def transform(self, x, y):
+        x, y = _as_arrays(x, y)
+        shape = np.broadcast(x, y).shape
+        u = ((np.broadcast_to(x, shape).ravel() - self.src_center[0]) / self.src_scale)
+        v = ((np.broadcast_to(y, shape).ravel() - self.src_center[1]) / self.src_scale)
+        result = np.empty((len(u), 2))
+        for start in range(0, len(u), TPS_CHUNK_SIZE):
+            cu = u[start:start + TPS_CHUNK_SIZE]
+            cv = v[start:start + TPS_CHUNK_SIZE]
+            r2 = (cu[:, None] - self.control_points[:, 0]) ** 2 + (cv[:, None] - self.control_points[:, 1]) ** 2
+            result[start:start + len(cu)] = (_tps_kernel(r2).dot(self.weights) + self.affine[0] +
+                                            cu[:, None] * self.affine[1] + cv[:, None] * self.affine[2])
+        result += self.dst_center
+        return result[:, 0].reshape(shape), result[:, 1].reshape(shape)
+
+    def _key(self):
+        return (self.src_center.tobytes(), self.src_scale, self.dst_center.tobytes(), self.control_points.tobytes(),
+                self.weights.tobytes(), self.affine.tobytes())
+
+
+def fit_gcp_model(src, dst, method):
+    """method is 'polynomial1', 'polynomial2', 'polynomial3' or 'tps'"""
+    if method == 'tps':
+        return ThinPlateSplineModel.fit(src, dst)
+    if method.startswith('polynomial') and method[len('polynomial'):].isdigit():
+        return PolynomialModel.fit(src, dst, int(method[len('polynomial'):]))
+    raise ValueError('Unknown gcp model "%s"' % method)
+
+
+def _bilinear(values, fx, fy):
+    """values (2, ny + 1, nx + 1) are x and y sampled at integer nodes, fx and fy are 1d arrays of
+    fractional node coordinates. Returns interpolated (x, y), points outside grid are extrapolated
+    from border cells."""
+    ny, nx = values.shape[1] - 1, values.shape[2] - 1
+    i = fx.astype(np.intp)
+    np.clip(i, 0, nx - 1, out=i)
+    j = fy.astype(np.intp)
+    np.clip(j, 0, ny - 1, out=j)
+    tx = fx - i
+    ty = fy - j
+    index = j * (nx + 1) + i
+    result = []
+    # separate 1d planes of x and y are much faster to gather and blend than (N, 2) arrays
+    for plane in values.reshape(2, -1):
+        top = plane.take(index)
+        top += (plane.take(index + 1) - top) * tx
+        bottom = plane.take(index + nx + 1)
+        bottom += (plane.take(index + nx + 2) - bottom) * tx
+        top += (bottom - top) * ty
+        result.append(top)
+    return result
+
+
+class InterpolationGrid(object):
+    """Model sampled on a regular grid over rectangle (xmin, ymin, xmax, ymax) of its input coordinates.
+
+    Grid is refined until bilinear interpolation deviates from model by no more than tolerance
+    (in output units) at centers of cells and middles of their edges, where error of bilinear
+    interpolation of smooth mapping is largest. Points outside rectangle are evaluated by model."""
+
+    def __init__(self, model, xmin, ymin, xmax, ymax, tolerance, initial_cell=GRID_INITIAL_CELL,
+                 max_cells=GRID_MAX_CELLS):
+        if not (xmax > xmin and ymax > ymin):
+            raise ValueError('InterpolationGrid: empty extent')
+        self.model = model
+        self.extent = (xmin, ymin, xmax, ymax)
+        self.tolerance = tolerance
+        nx = max(1, int(math.ceil((xmax - xmin) / initial_cell)))
+        ny = max(1, int(math.ceil((ymax - ymin) / initial_cell)))
+        while True:
+            xs = np.linspace(xmin, xmax, nx + 1)
+            ys = np.linspace(ymin, ymax, ny + 1)
+            self.values = np.stack(model.transform(*np.meshgrid(xs, ys)))
+            self.shape = (ny, nx)
+            self.max_error = self._measure_error()
+            if self.max_error <= tolerance:
+                break
+            if nx * 2 > max_cells or ny * 2 > max_cells:
+                raise ValueError('InterpolationGrid: can\'t reach tolerance %s, error is %s with %dx%d cells' % (
+                    tolerance, self.max_error, nx, ny))
+            nx *= 2
+            ny *= 2
+
+    def _measure_error(self):
+        ny, nx = self.shape
+        centers_x = np.arange(nx) + 0.5
+        centers_y = np.arange(ny) + 0.5
+        nodes_x = np.arange(nx + 1, dtype=np.float64)
+        nodes_y = np.arange(ny + 1, dtype=np.float64)
+        error = 0.0
+        # cell centers, middles of horizontal edges, middles of vertical edges
+        for check_x, check_y in ((centers_x, centers_y), (centers_x, nodes_y), (nodes_x, centers_y)):
+            fx, fy = [a.ravel() for a in np.meshgrid(check_x, check_y)]
+            exact_x, exact_y = self.model.transform(*self._to_input(fx, fy))
+            interpolated_x, interpolated_y = _bilinear(self.values, fx, fy)
+            error = max(error, np.hypot(interpolated_x - exact_x, interpolated_y - exact_y).max())
+        return error
+
+    def _to_input(self, fx, fy):
+        xmin, ymin, xmax, ymax = self.extent
+        ny, nx = self.shape
+        return xmin + fx * (xmax - xmin) / nx, ymin + fy * (ymax - ymin) / ny
+
+    def transform(self, x, y):
+        x, y = _as_arrays(x, y)
+        shape = np.broadcast(x, y).shape
+        x = np.broadcast_to(x, shape).ravel()
+        y = np.broadcast_to(y, shape).ravel()
+        xmin, ymin, xmax, ymax = self.extent
+        ny, nx = self.shape
+        fx = (x - xmin) * (nx / (xmax - xmin))
+        fy = (y - ymin) * (ny / (ymax - ymin))
+        result_x, result_y = _bilinear(self.values, fx, fy)
+        outside = ~((fx >= 0) & (fx <= nx) & (fy >= 0) & (fy <= ny))
+        if outside.any():
+            result_x[outside], result_y[outside] = self.model.transform(x[outside], y[outside])
+        return result_x.reshape(shape), result_y.reshape(shape)
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def get_interpolation_grid(model, xmin, ymin, xmax, ymax, tolerance):
+    """InterpolationGrid cached by model coefficients, extent and tolerance"""
+    return InterpolationGrid(model, xmin, ymin, xmax, ymax, tolerance)
+
+
+def grid_cache_info():
+    return get_interpolation_grid.cache_info()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Pixel dimensions of map images read from file headers only, image data is never decoded.
+# Supported formats are PNG, JPEG, TIFF (including BigTIFF), BMP and GIF; usually only
+# a few hundred bytes are read, JPEG and TIFF headers are followed with seeks.
+import struct
+from collections import namedtuple
+
+
+ImageInfo = namedtuple('ImageInfo', ['format', 'width', 'height'])
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start of frame markers, all 0xC0-0xCF except DHT, JPG and DAC
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers without length field
+JPEG_STANDALONE_MARKERS = frozenset([0x01, 0xD8] + list(range(0xD0, 0xD8)))
+TIFF_IMAGE_WIDTH = 256
+TIFF_IMAGE_LENGTH = 257
+# TIFF field type: (struct format, size)
+TIFF_TYPES = {3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+
+
+class ImageProbeError(Exception):
+    pass
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ImageProbeError('Truncated image header')
+    return data
+
+
+def _probe_png(f, head):
+    # IHDR is always the first chunk
+    if len(head) < 24 or head[12:16] != b'IHDR':
+        raise ImageProbeError('PNG file has no IHDR chunk')
+    width, height = struct.unpack('>II', head[16:24])
+    return ImageInfo('PNG', width, height)
+
+
+def _probe_gif(f, head):
+    if len(head) < 10:
+        raise ImageProbeError('Truncated image header')
+    width, height = struct.unpack('<HH', head[6:10])
+    return ImageInfo('GIF', width, height)
+
+
+def _probe_bmp(f, head):
+    if len(head) < 26:
+        raise ImageProbeError('Truncated image header')
+    dib_header_size = struct.unpack('<I', head[14:18])[0]
+    if dib_header_size == 12:
+        width, height = struct.unpack('<HH', head[18:22])
+    else:
+        width, height = struct.unpack('<ii', head[18:26])
+    # negative height means top-down row order
+    return ImageInfo('BMP', width, abs(height))
+
+
+def _probe_jpeg(f, head):
+    f.seek(2)
+    while True:
+        if _read(f, 1) != b'\xff':
+            raise ImageProbeError('Invalid JPEG marker')
+        marker = _read(f, 1)[0]
+        while marker == 0xFF:
+            marker = _read(f, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            raise ImageProbeError('JPEG file has no frame header')
+        length = struct.unpack('>H', _read(f, 2))[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', _read(f, 5))
+            return ImageInfo('JPEG', width, height)
+        if length < 2:
+            raise ImageProbeError('Invalid JPEG segment length')
+        f.seek(length - 2, 1)
+
+
+def _probe_tiff(f, head):
+    byte_order = '<' if head[:2] == b'II' else '>'
+    version = struct.unpack(byte_order + 'H', head[2:4])[0]
+    if version == 42:
+        if len(head) < 8:
+            raise ImageProbeError('Truncated image header')
+        ifd_offset = struct.unpack(byte_order + 'I', head[4:8])[0]
+        count_format, entry_format, entry_size = 'H', 'HHI', 12
+    else:
+        if len(head) < 16:
+            raise ImageProbeError('Truncated image header')
+        ifd_offset = struct.unpack(byte_order + 'Q', head[8:16])[0]
+        count_format, entry_format, entry_size = 'Q', 'HHQ', 20
+    count_struct = struct.Struct(byte_order + count_format)
+    entry_struct = struct.Struct(byte_order + entry_format)
+    f.seek(ifd_offset)
+    entries_count = count_struct.unpack(_read(f, count_struct.size))[0]
+    entries = _read(f, entries_count * entry_size)
+    size = {}
+    for i in range(entries_count):
+        entry = entries[i * entry_size:(i + 1) * entry_size]
+        tag, field_type, _ = entry_struct.unpack_from(entry)
+        if tag in (TIFF_IMAGE_WIDTH, TIFF_IMAGE_LENGTH):
+            try:
+                value_format, value_size = TIFF_TYPES[field_type]
+            except KeyError:
+                raise ImageProbeError('Unsupported TIFF field type %d of tag %d' % (field_type, tag))
+            size[tag] = struct.unpack(byte_order + value_format,
+                                      entry[entry_struct.size:entry_struct.size + value_size])[0]
+    if len(size) != 2:
+        raise ImageProbeError('TIFF file has no image size tags')
+    return ImageInfo('TIFF', size[TIFF_IMAGE_WIDTH], size[TIFF_IMAGE_LENGTH])
+
+
+def probe_image_file(f):
+    """Returns ImageInfo(format, width, height) for seekable binary file object"""
+    head = f.read(32)
+    if head.startswith(PNG_SIGNATURE):
+        return _probe_png(f, head)
+    if head.startswith(b'\xff\xd8'):
+        return _probe_jpeg(f, head)
+    if head[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+        return _probe_tiff(f, head)
+    if head.startswith(b'BM'):
+        return _probe_bmp(f, head)
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return _probe_gif(f, head)
+    raise ImageProbeError('Unknown image format')
+
+
+def probe_image(path):
+    """Returns ImageInfo(format, width, height) of image file reading only its header"""
+    try:
+        with open(path, 'rb') as f:
+            return probe_image_file(f)
+    except ImageProbeError as e:
+        raise ImageProbeError('Error in "%s": %s' % (path, e))
+
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# Checks many map files in parallel and reports all problems found instead of stopping at the first one:
+#   python -m ozi_map.lint maps/ [--format csv] [-o report.csv]
+# Checks are: parsing, image presence, datum and projection support, gcp fit residuals, cutline sanity.
+import argparse
+import csv
+import json
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ozi_map import srs
+from ozi_map.batch import collect_map_files, read_file_list, split_missing_files
+from ozi_map.ozi_reader import OziFormatError, find_cutline_error_line, read_ozi_map
+from ozi_map.ozi_to_maprec import find_map_image
+from ozi_map.gcp_fit import fit_geotransforms, stack_gcp_arrays
+from ozi_map.transform import MapTransform, projected_gcp_arrays
+from ozi_map.validate import ValidationError
+
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# gcp with inverse fit residual larger than this, in pixels, is reported
+MAX_GCP_RESIDUAL = 20.0
+# MMPLL point further than this from position of corresponding MMPXY point, in pixels, is reported
+MAX_CUTLINE_MISMATCH = 50.0
+# number of files checked by worker process at once, their geotransforms are fitted together
+CHUNK_SIZE = 64
+
+Issue = namedtuple('Issue', ['file', 'line', 'check', 'severity', 'reason'])
+REPORT_FIELDS = Issue._fields
+
+IMAGE_LINE = 3
+DATUM_LINE = 5
+PROJECTION_LINE = 9
+PROJECTION_SETUP_LINE = 40
+FIRST_GCP_LINE = 10
+
+
+def _line_of_offset(data, offset):
+    return data.count(b'\n', 0, offset) + 1
+
+
+def _gcp_lines(data):
+    """Line numbers of gcps in order they appear in parsed map"""
+    lines = data.decode('cp1251').splitlines()[FIRST_GCP_LINE - 1:FIRST_GCP_LINE + 29]
+    result = []
+    for n, line in enumerate(lines, FIRST_GCP_LINE):
+        parts = [s.strip() for s in line.split(',')]
+        if len(parts) > 4 and parts[4] == 'in' and parts[2] and parts[3]:
+            result.append(n)
+    return result
+
+
+def _parse(path, data, issues):
+    try:
+        return read_ozi_map(data, compact=True)
+    except OziFormatError as e:
+        issues.append(Issue(path, e.line, 'parse', ERROR, str(e)))
+    except ValidationError as e:
+        issues.append(Issue(path, find_cutline_error_line(data), 'parse', ERROR, 'Error in cutline: %s' % e))
+    except UnicodeDecodeError as e:
+        issues.append(Issue(path, _line_of_offset(data, e.start), 'parse', ERROR, str(e)))
+    return None
+
+
+def _check_image(path, ozi_map, issues):
+    try:
+        find_map_image(ozi_map, path)
+    except Exception as e:
+        issues.append(Issue(path, IMAGE_LINE, 'image', ERROR, str(e)))
+
+
+def _check_srs(path, ozi_map, issues):
+    try:
+        srs.resolve_srs(ozi_map.datum)
+        srs.resolve_srs(ozi_map.datum, ozi_map.projection)
+    except srs.UnsupportedDatumError as e:
+        issues.append(Issue(path, DATUM_LINE, 'srs', ERROR, str(e)))
+    except srs.UnsupportedProjectionError as e:
+        issues.append(Issue(path, PROJECTION_LINE, 'srs', ERROR, str(e)))
+    except srs.InvalidSrsError as e:
+        issues.append(Issue(path, PROJECTION_SETUP_LINE, 'srs', ERROR, str(e)))
+    else:
+        return True
+    return False
+
+
+def _check_gcps_count(path, ozi_map, issues):
+    if len(ozi_map.gcps) < 2:
+        issues.append(Issue(path, None, 'gcps', ERROR, '%d gcps, at least 2 are required' % len(ozi_map.gcps)))
+        return False
+    return True
+
+
+def _check_residuals(path, data, ozi_map, residuals, issues, max_residual):
+    # 2 or 3 gcps are always fitted exactly
+    if len(ozi_map.gcps) <= 3:
+        return
+    bad = np.flatnonzero(residuals > max_residual)
+    if len(bad):
+        lines = _gcp_lines(data)
+        for i in bad:
+            line = lines[i] if len(lines) == len(ozi_map.gcps) else None
+            issues.append(Issue(path, line, 'gcps', WARNING, 'gcp %d deviates from affine fit by %.1f pixels' % (
+                i + 1, residuals[i])))
+
+
+def _check_cutline(path, ozi_map, transform, issues, max_mismatch):
+    lons = np.frombuffer(ozi_map.cutline.xs, dtype=np.float64)
+    lats = np.frombuffer(ozi_map.cutline.ys, dtype=np.float64)
+    pixels_n = len(ozi_map.cutline_pixels)
+    if not len(lons) and not pixels_n:
+        return
+    if pixels_n and len(lons) and pixels_n != len(lons):
+        issues.append(Issue(path, None, 'cutline', WARNING, '%d MMPXY points and %d MMPLL points' % (
+            pixels_n, len(lons))))
+    if 0 < len(lons) < 3:
+        issues.append(Issue(path, None, 'cutline', ERROR, 'Cutline has %d points' % len(lons)))
+    out_of_range = np.flatnonzero((np.abs(lons) > 180) | (np.abs(lats) > 90) | ~np.isfinite(lons) | ~np.isfinite(lats))
+    if len(out_of_range):
+        i = out_of_range[0]
+        issues.append(Issue(path, None, 'cutline', ERROR, 'MMPLL point %d (%s, %s) is out of range' % (
+            i + 1, lons[i], lats[i])))
+        return
+    if len(lons) >= 3:
+        area = np.dot(lons, np.roll(lats, -1)) - np.dot(lats, np.roll(lons, -1))
+        if area == 0:
+            issues.append(Issue(path, None, 'cutline', WARNING, 'Cutline has zero area'))
+    if transform is not None and pixels_n == len(lons) and pixels_n:
+        xs, ys = transform.latlon_to_pixel(lons, lats)
+        distances = np.hypot(xs - np.frombuffer(ozi_map.cutline_pixels.xs, dtype=np.int64),
+                             ys - np.frombuffer(ozi_map.cutline_pixels.ys, dtype=np.int64))
+        worst = int(np.argmax(distances))
+        if distances[worst] > max_mismatch:
+            issues.append(Issue(path, None, 'cutline', WARNING, 'MMPLL point %d is %.1f pixels away from MMPXY point' % (
+                worst + 1, distances[worst])))
+
+
+def _lint_chunk(paths, max_residual, max_mismatch):
+    """Returns list of issues lists for paths, geotransforms of all maps are fitted at once"""
+    results = []
+    to_fit = []
+    for path in paths:
+        issues = []
+        results.append(issues)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            issues.append(Issue(path, None, 'parse', ERROR, str(e)))
+            continue
+        ozi_map = _parse(path, data, issues)
+        if ozi_map is None:
+            continue
+        _check_image(path, ozi_map, issues)
+        if _check_srs(path, ozi_map, issues) and _check_gcps_count(path, ozi_map, issues):
+            to_fit.append((path, data, ozi_map, issues) + projected_gcp_arrays(ozi_map))
+        else:
+            _check_cutline(path, ozi_map, None, issues, max_mismatch)
+    if not to_fit:
+        return results
+    fit = fit_geotransforms(stack_gcp_arrays([item[4] for item in to_fit]),
+                            stack_gcp_arrays([item[5] for item in to_fit]))
+    latlon_srs = srs.get_proj4('WGS 84')
+    for i, (path, data, ozi_map, issues, _, _) in enumerate(to_fit):
+        transform = None
+        if not np.isfinite(fit.geotransform[i]).all() or not np.isfinite(fit.inv_geotransform[i]).all():
+            issues.append(Issue(path, None, 'gcps', ERROR, 'Can\'t calculate geotransform for given gcps'))
+        else:
+            _check_residuals(path, data, ozi_map, fit.inv_residuals[i], issues, max_residual)
+            transform = MapTransform(fit.geotransform[i], fit.inv_geotransform[i],
+                                     srs.get_proj4(ozi_map.datum, ozi_map.projection), latlon_srs)
+        _check_cutline(path, ozi_map, transform, issues, max_mismatch)
+    return results
+
+
+def _lint_job(paths, max_residual, max_mismatch):
+    try:
+        return _lint_chunk(paths, max_residual, max_mismatch)
+    except Exception:
+        # check files one by one, so only the file causing trouble is reported
+        results = []
+        for path in paths:
+            try:
+                results.extend(_lint_chunk([path], max_residual, max_mismatch))
+            except Exception as e:
+                results.append([Issue(path, None, 'internal', ERROR, repr(e))])
+        return results
+
+
+def lint_file(path, max_residual=MAX_GCP_RESIDUAL, max_mismatch=MAX_CUTLINE_MISMATCH):
+    """Returns list of Issue for map file, empty if no problems found"""
+    return _lint_chunk([path], max_residual, max_mismatch)[0]
+
+
+def lint_files(paths, workers=None, max_residual=MAX_GCP_RESIDUAL, max_mismatch=MAX_CUTLINE_MISMATCH,
+               chunk_size=CHUNK_SIZE):
+    """Check files in a process pool, yields (path, issues) in order of paths"""
+    paths = list(paths)
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    if workers == 1:
+        results = (_lint_job(chunk, max_residual, max_mismatch) for chunk in chunks)
+        for chunk, chunk_issues in zip(chunks, results):
+            for path, issues in zip(chunk, chunk_issues):
+                yield path, issues
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_lint_job, chunks, [max_residual] * len(chunks), [max_mismatch] * len(chunks))
+        for chunk, chunk_issues in zip(chunks, results):
+            for path, issues in zip(chunk, chunk_issues):
+                yield path, issues
+
+
+def write_json_report(f, issues, files_count):
+    errors = sum(1 for issue in issues if issue.severity == ERROR)
+    report = {
+        'files': files_count,
+        'errors': errors,
+        'warnings': len(issues) - errors,
+        'issues': [issue._asdict() for issue in issues],
+    }
+    json.dump(report, f, indent=1, ensure_ascii=False)
+    f.write('\n')
+
+
+def write_csv_report(f, issues):
+    writer = csv.writer(f)
+    writer.writerow(REPORT_FIELDS)
+    for issue in issues:
+        writer.writerow(['' if value is None else value for value in issue])
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Check OziExplorer map files and report problems')
+    parser.add_argument('inputs', metavar='PATH', nargs='*',
+                        help='Map file, directory (searched recursively) or glob pattern')
+    parser.add_argument('--files-from', metavar='LIST_FILE', help='Read map file names from file, one per line')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('-o', '--output', help='Report file, default is stdout')
+    parser.add_argument('--max-residual', type=float, default=MAX_GCP_RESIDUAL,
+                        help='Report gcps deviating from affine fit by more pixels')
+    parser.add_argument('--max-cutline-mismatch', type=float, default=MAX_CUTLINE_MISMATCH,
+                        help='Report MMPLL points further from MMPXY points, in pixels')
+    args = parser.parse_args()
+    if not args.inputs and not args.files_from:
+        parser.error('no input files given')
+    return args
+
+
+def main():
+    args = parse_command_line()
+    inputs = list(args.inputs)
+    missing = []
+    if args.files_from:
+        listed, missing = split_missing_files(read_file_list(args.files_from))
+        inputs.extend(listed)
+    try:
+        paths = [path for path, _ in collect_map_files(inputs)]
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 2
+    files_count = len(paths) + len(missing)
+    issues = [Issue(path, None, 'parse', ERROR, 'file not found') for path in missing]
+    for _, file_issues in lint_files(paths, args.jobs, args.max_residual, args.max_cutline_mismatch):
+        issues.extend(file_issues)
+    f = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if args.format == 'json':
+            write_json_report(f, issues, files_count)
+        else:
+            write_csv_report(f, issues)
+    finally:
+        if args.output:
+            f.close()
+    errors = sum(1 for issue in issues if issue.severity == ERROR)
+    print('%d files checked, %d errors, %d warnings' % (files_count, errors, len(issues) - errors), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,11 +2,12 @@
 # в каком-то старом проекте
 
 from .attr_dict import AttrDict
-from copy import deepcopy
 import os
-import pyproj
+import numpy as np
 from . import ozi_reader
-from glob import glob
+from .transformers import get_transformer
+from .dir_index import get_directory_index
+from .srs import UnsupportedDatumError, UnsupportedProjectionError
 import math
 __all__= ['parse_ozi_map']
 
@@ -44,22 +45,20 @@ proj_map = {
 
 
 def make_converter(s_srs, d_srs):
-    proj_src = pyproj.Proj(s_srs)
-    proj_dest = pyproj.Proj(d_srs)
+    transformer = get_transformer(s_srs, d_srs)
     def converter(*args):
         if len(args) == 2 and isinstance(args[0], float) and isinstance(args[1], float):
-            return pyproj.transform(proj_src, proj_dest, *args)
+            return transformer.transform(*args)
         elif len(args) == 1 and hasattr(args[0], '__len__'):
-            points = list(zip(*args[0]))
-            points = pyproj.transform(proj_src, proj_dest, *points)
-            return list(zip(*points))
+            points = np.asarray(args[0], dtype=np.float64).reshape(-1, 2)
+            xs, ys = transformer.transform(points[:, 0], points[:, 1])
+            return list(zip(xs.tolist(), ys.tolist()))
         else:
             raise TypeError()
     return converter
 
 def find_file_ci(path, file_name):
-    pattern = ''.join(['[%s%s]' % (c.upper(), c.lower()) for c in file_name])
-    files = glob(os.path.join(path, pattern))
+    files = get_directory_index(path).lookup(file_name)
     if files:
         if len(files) > 1:
             raise Exception('Ambigios file name "%s"' % file_name)
@@ -70,7 +69,7 @@ def find_file_ci(path, file_name):
 
 def parse_ozi_map(map_file_name, cutline_type = None):
     """cutline_type can be 'projected', 'latlon' or None"""
-    ozi_map = ozi_reader.read_map(open(map_file_name).readlines())
+    ozi_map = ozi_reader.read_ozi_map_file(map_file_name)
     ozi_dir = os.path.split(os.path.abspath(map_file_name))[0]
 
     image_name = find_file_ci(ozi_dir, ozi_map.file_name)
@@ -123,9 +122,12 @@ def get_resolution(geotransform, s_srs = None, t_srs = None):
 def get_srs_as_proj4(ozi_datum_string, ozi_projection):
     try:
         srs = [datum_map[ozi_datum_string]]
+    except KeyError:
+        raise UnsupportedDatumError(ozi_datum_string)
+    try:
         proj_params = proj_map[ozi_projection.name]
-    except KeyError as e:
-        raise Exception("Unsupported datum or projection: '%s'" % (e.message))
+    except KeyError:
+        raise UnsupportedProjectionError(ozi_projection.name)
     srs.append(proj_params[0])
     for proj_param, ozi_param in proj_params[1:]:
         try:
@@ -135,10 +137,7 @@ def get_srs_as_proj4(ozi_datum_string, ozi_projection):
     return ' '.join(srs)
 
 def get_ozi_ll_srs(ozi_datum_string, ozi_projection):
-    tmp_projection = deepcopy(ozi_projection)
-    tmp_projection.name = 'Latitude/Longitude'
-    srs_string = get_srs_as_proj4(ozi_datum_string, tmp_projection)
-    return srs_string
+    return get_srs_as_proj4(ozi_datum_string, AttrDict(name='Latitude/Longitude'))
 
 def convert_ozi_gcps(ozi_gcps, proj_srs, ll_srs):
     ll_to_proj = make_converter(ll_srs, proj_srs)
@@ -1,12 +1,22 @@
 # -*- coding: utf-8 -*-
+import io
+import mmap
+import os
+import re
+from collections import namedtuple
+from itertools import islice
 from .attr_dict import AttrDict
+from .profiling import stage, count
+from .records import OziMap, Projection, Gcp, Point, Cutline
 from .validate import validate_number, validate_float, validate_notempty, validate_value, validate_values,\
     ValidationError, validate_string_start
 
 
 class OziFormatError(Exception):
-    def __init__(self, message):
+    def __init__(self, message, line=None):
         self.messages = [message]
+        # number of the offending line of map file, if known
+        self.line = line
 
     def __str__(self):
         return ': '.join(['Error in Ozi map file'] + self.messages)
@@ -20,6 +30,8 @@ class OziFormatError(Exception):
             raise self
         elif exc_type == OziFormatError:
             self.messages.extend(exc_value.messages)
+            if self.line is None:
+                self.line = exc_value.line
             raise self
 
 
@@ -30,99 +42,384 @@ def fields(line, count):
     return fields
 
 
-def read_ozi_map(data):
+def _make_dict_gcp(pixel_x, pixel_y, ref_x, ref_y, gcp_type, zone):
+    gcp = AttrDict(pixel=AttrDict(x=pixel_x, y=pixel_y), ref=AttrDict(x=ref_x, y=ref_y), type=gcp_type)
+    if zone is not None:
+        gcp.zone = zone
+    return gcp
+
+
+def _make_compact_gcp(pixel_x, pixel_y, ref_x, ref_y, gcp_type, zone):
+    return Gcp(Point(pixel_x, pixel_y), Point(ref_x, ref_y), gcp_type, zone)
+
+
+HEADER_LINES_COUNT = 40
+
+PROJECTION_PARAMS = ['lat_origin', 'lon_origin', 'k_factor', 'false_easting', 'false_northing', 'lat1', 'lat2',
+                     'height']
+
+
+ENGINES = ('fast', 'reference')
+
+BUFFER_TYPES = (bytes, bytearray, mmap.mmap)
+
+MMAP_THRESHOLD = 1 << 20
+
+
+def read_ozi_map(data, compact=False, engine='fast'):
+    """Parse map from binary file object, text, bytes, bytearray, mmap or os.PathLike path.
+
+    With compact=True result is built from slotted records (see ozi_map.records)
+    and cutlines are stored in arrays instead of lists of tuples.
+
+    engine='reference' validates every line field by field, 'fast' skips unused gcp slots and parses
+    cutline points directly, falling back to reference code on any irregular line,
+    so results and error messages are the same."""
+    if isinstance(data, os.PathLike):
+        return read_ozi_map_file(data, compact, engine)
+    if isinstance(data, BUFFER_TYPES):
+        return _read_ozi_buffer(data, compact, engine)
     if hasattr(data, 'read'):
-        data = data.read().decode('cp1251')
-    lines = data.splitlines()
-    lines = [l.strip(' \n\r\x09') for l in lines]
-    if not lines:
-        raise OziFormatError('Document empty.')
-    ozi_map = AttrDict()
+        with stage('read'):
+            data = data.read().decode('cp1251')
+    return _read_ozi_lines(iter(data.splitlines()), compact, engine)
+
+
+def read_ozi_map_file(path, compact=False, engine='fast'):
+    """Parse map file. Files larger than MMAP_THRESHOLD are mapped to memory and parsed as buffer,
+    never decoded or split to lines as a whole. Smaller files are read and decoded at once,
+    which is faster for them."""
+    with open(path, 'rb') as f:
+        with stage('read'):
+            if os.fstat(f.fileno()).st_size <= MMAP_THRESHOLD:
+                text = f.read().decode('cp1251')
+                data = None
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if data is None:
+        return _read_ozi_lines(iter(text.splitlines()), compact, engine)
     try:
-        with OziFormatError('line 1'):
-            validate_string_start(lines[0], 'OziExplorer Map Data File Version 2.')
-        ozi_map.title = lines[1]
-        ozi_map.file_name = lines[2].split('\\')[-1]
-        with OziFormatError('line 5, datum name'):
-            ozi_map.datum = validate_notempty(fields(lines[4], 1)[0])
-        proj_params = fields(lines[8], 2)
-        with OziFormatError('line 9'):
-            validate_value(proj_params[0], 'Map Projection')
-        ozi_map.projection = AttrDict()
-        with OziFormatError('line 9, projection name'):
-            ozi_map.projection.name = validate_notempty(proj_params[1])
-        proj_params = fields(lines[39], 10)
-        with OziFormatError('line 40'):
-            validate_value(proj_params[0], 'Projection Setup')
-            if proj_params[1]:
-                ozi_map.projection.lat_origin = validate_float(proj_params[1])
-            if proj_params[2]:
-                ozi_map.projection.lon_origin = validate_float(proj_params[2])
-            if proj_params[3]:
-                ozi_map.projection.k_factor = validate_float(proj_params[3])
-            if proj_params[4]:
-                ozi_map.projection.false_easting = validate_float(proj_params[4])
-            if proj_params[5]:
-                ozi_map.projection.false_northing = validate_float(proj_params[5])
-            if proj_params[6]:
-                ozi_map.projection.lat1 = validate_float(proj_params[6])
-            if proj_params[7]:
-                ozi_map.projection.lat2 = validate_float(proj_params[7])
-            if proj_params[8]:
-                ozi_map.projection.height = validate_float(proj_params[8])
-
-        ozi_map.gcps = []
-        for i in range(1, 31):
-            ozi_gcp = fields(lines[i + 8], 17)
-            with OziFormatError('line %d' % (i + 9)):
-                validate_value(ozi_gcp[0], 'Point%02d' % i)
-                validate_value(ozi_gcp[1], 'xy')
-                validate_value(ozi_gcp[5], 'deg')
-                validate_value(ozi_gcp[12], 'grid')
-                validate_values(ozi_gcp[4], ['in', 'ex'])
-                if ozi_gcp[4] == 'in' and ozi_gcp[2] and ozi_gcp[3]:
-                    gcp = AttrDict(pixel=AttrDict(), ref=AttrDict())
-                    gcp.pixel.x = validate_number(ozi_gcp[2])
-                    gcp.pixel.y = validate_number(ozi_gcp[3])
-                    if ozi_gcp[6] and ozi_gcp[7] and ozi_gcp[9] and ozi_gcp[10]:
-                        validate_values(ozi_gcp[8], ['S', 'N'])
-                        validate_values(ozi_gcp[11], ['W', 'E'])
-                        gcp.type = 'latlon'
-                        gcp.ref.x = validate_number(ozi_gcp[9]) + validate_float(ozi_gcp[10]) / 60
-                        gcp.ref.y = validate_number(ozi_gcp[6]) + validate_float(ozi_gcp[7]) / 60
-                        if ozi_gcp[11] == 'W':
-                            gcp.ref.x *= -1
-                        if ozi_gcp[8] == 'S':
-                            gcp.ref.y *= -1
-                    elif ozi_gcp[14] and ozi_gcp[15]:
-                        validate_values(ozi_gcp[16], ['N', 'S'])
-                        gcp.type = 'proj'
-                        gcp.ref.x = validate_float(ozi_gcp[14])
-                        gcp.ref.y = validate_float(ozi_gcp[15])
-                        if ozi_gcp[16] == 'S':
-                            gcp.ref.y *= -1
-                        if ozi_gcp[13]:
-                            gcp.zone = validate_number(ozi_gcp[13])
-                    else:
-                        raise OziFormatError('incomplete gcp definition')
-                    ozi_map.gcps.append(gcp)
+        return _read_ozi_buffer(data, compact, engine)
+    finally:
+        data.close()
+
+
+def _strip_line(line):
+    return line.strip(' \n\r\x09')
+
+
+def _read_gcp(line, i, make_gcp):
+    ozi_gcp = fields(line, 17)
+    with OziFormatError('line %d' % (i + 9), line=i + 9):
+        validate_value(ozi_gcp[0], 'Point%02d' % i)
+        validate_value(ozi_gcp[1], 'xy')
+        validate_value(ozi_gcp[5], 'deg')
+        validate_value(ozi_gcp[12], 'grid')
+        validate_values(ozi_gcp[4], ['in', 'ex'])
+        if ozi_gcp[4] == 'in' and ozi_gcp[2] and ozi_gcp[3]:
+            pixel_x = validate_number(ozi_gcp[2])
+            pixel_y = validate_number(ozi_gcp[3])
+            zone = None
+            if ozi_gcp[6] and ozi_gcp[7] and ozi_gcp[9] and ozi_gcp[10]:
+                validate_values(ozi_gcp[8], ['S', 'N'])
+                validate_values(ozi_gcp[11], ['W', 'E'])
+                gcp_type = 'latlon'
+                ref_x = validate_number(ozi_gcp[9]) + validate_float(ozi_gcp[10]) / 60
+                ref_y = validate_number(ozi_gcp[6]) + validate_float(ozi_gcp[7]) / 60
+                if ozi_gcp[11] == 'W':
+                    ref_x *= -1
+                if ozi_gcp[8] == 'S':
+                    ref_y *= -1
+            elif ozi_gcp[14] and ozi_gcp[15]:
+                validate_values(ozi_gcp[16], ['N', 'S'])
+                gcp_type = 'proj'
+                ref_x = validate_float(ozi_gcp[14])
+                ref_y = validate_float(ozi_gcp[15])
+                if ozi_gcp[16] == 'S':
+                    ref_y *= -1
+                if ozi_gcp[13]:
+                    zone = validate_number(ozi_gcp[13])
+            else:
+                raise OziFormatError('incomplete gcp definition')
+            return make_gcp(pixel_x, pixel_y, ref_x, ref_y, gcp_type, zone)
+    return None
+
+
+GCP_NAMES = ['Point%02d' % i for i in range(1, 31)]
+
+
+def _is_unused_gcp_line(line, i):
+    """True for valid PointNN lines which reference parser would skip"""
+    parts = line.split(',')
+    if len(parts) < 17 or parts[0].strip() != GCP_NAMES[i - 1] or parts[1].strip() != 'xy' or \
+            parts[5].strip() != 'deg' or parts[12].strip() != 'grid':
+        return False
+    state = parts[4].strip()
+    return state == 'ex' or (state == 'in' and not (parts[2].strip() and parts[3].strip()))
+
+
+def _read_cutline_point(line, cutline, cutline_pixels):
+    point = fields(line, 4)
+    if point[0] == 'MMPLL':
+        lat = validate_float(point[3])
+        lon = validate_float(point[2])
+        cutline.append((lon, lat))
+    elif point[0] == 'MMPXY':
+        x = validate_number(point[2])
+        y = validate_number(point[3])
+        cutline_pixels.append((x, y))
+
+
+def find_cutline_error_line(data):
+    """Number of the first cutline line rejected by the parser in map text, bytes, bytearray or mmap,
+    None if all cutline lines are valid. Errors in cutline lines are raised as ValidationError
+    without line number, this locates them."""
+    if isinstance(data, BUFFER_TYPES):
+        data = str(data, 'cp1251')
+    for n, line in enumerate(data.splitlines()[HEADER_LINES_COUNT:], HEADER_LINES_COUNT + 1):
+        try:
+            _read_cutline_point(_strip_line(line), [], [])
+        except ValidationError:
+            return n
+    return None
+
+
+def _read_cutline_fast(lines, cutline, cutline_pixels):
+    for line in lines:
+        # first field of a cutline line can only start with "MMP" after stripping whitespace
+        if not line.lstrip().startswith('MMP'):
+            continue
+        parts = line.split(',')
+        if len(parts) >= 4:
+            name = parts[0].strip()
+            try:
+                if name == 'MMPLL':
+                    cutline.append((float(parts[2]), float(parts[3])))
+                    continue
+                elif name == 'MMPXY':
+                    cutline_pixels.append((int(parts[2]), int(parts[3])))
+                    continue
+            except ValueError:
+                pass
+        _read_cutline_point(_strip_line(line), cutline, cutline_pixels)
+
 
+# bytes which str.splitlines() treats as line breaks while bytes.splitlines() does not, and the one byte
+# undefined in cp1251, buffers containing them are decoded as a whole
+NEEDS_DECODING = re.compile(b'[\x0b\x0c\x1c\x1d\x1e\x98]')
+# bytes decoded from cp1251 to characters stripped by str.strip()
+WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\xa0'
+CHUNK_SIZE = 1 << 20
+HEADER_PREFIX_SIZE = 4096
+
+
+def _split_header(data):
+    """Returns first HEADER_LINES_COUNT lines of buffer decoded and offset of the line following them"""
+    size = HEADER_PREFIX_SIZE
+    while True:
+        lines = data[:size].splitlines(True)
+        # line breaks of the last header line are complete only if the next line is in the prefix too
+        if len(lines) > HEADER_LINES_COUNT or size >= len(data):
+            break
+        size *= 4
+    pos = sum(len(line) for line in lines[:HEADER_LINES_COUNT])
+    return data[:pos].decode('cp1251').splitlines(), pos
+
+
+def _iter_line_chunks(data, pos):
+    """Yields lists of lines of buffer from pos, split by chunks of about CHUNK_SIZE bytes
+    ending with "\n", so only one chunk is copied at a time"""
+    size = len(data)
+    while pos < size:
+        end = pos + CHUNK_SIZE
+        if end < size:
+            newline = data.rfind(b'\n', pos, end)
+            # no "\n" in the chunk, probably "\r" line breaks, take the rest of buffer
+            end = size if newline == -1 else newline + 1
+        else:
+            end = size
+        yield data[pos:end].splitlines()
+        pos = end
+
+
+def _read_cutline_buffer(data, pos, cutline, cutline_pixels):
+    for lines in _iter_line_chunks(data, pos):
+        for line in lines:
+            if not line.lstrip(WHITESPACE).startswith(b'MMP'):
+                continue
+            parts = line.split(b',')
+            if len(parts) >= 4:
+                name = parts[0].strip(WHITESPACE)
+                try:
+                    if name == b'MMPLL':
+                        cutline.append((float(parts[2]), float(parts[3])))
+                        continue
+                    elif name == b'MMPXY':
+                        cutline_pixels.append((int(parts[2]), int(parts[3])))
+                        continue
+                except ValueError:
+                    pass
+            _read_cutline_point(_strip_line(line.decode('cp1251')), cutline, cutline_pixels)
+
+
+def _read_header(header, compact, fast):
+    if compact:
+        ozi_map = OziMap()
+        make_gcp = _make_compact_gcp
+    else:
+        ozi_map = AttrDict()
+        make_gcp = _make_dict_gcp
+    with OziFormatError('line 1', line=1):
+        validate_string_start(header[0], 'OziExplorer Map Data File Version 2.')
+    ozi_map.title = header[1]
+    ozi_map.file_name = header[2].split('\\')[-1]
+    with OziFormatError('line 5, datum name', line=5):
+        ozi_map.datum = validate_notempty(fields(header[4], 1)[0])
+    proj_params = fields(header[8], 2)
+    with OziFormatError('line 9', line=9):
+        validate_value(proj_params[0], 'Map Projection')
+    with OziFormatError('line 9, projection name', line=9):
+        projection_name = validate_notempty(proj_params[1])
+    proj_params = fields(header[39], 10)
+    projection = {}
+    with OziFormatError('line 40', line=40):
+        validate_value(proj_params[0], 'Projection Setup')
+        for param_name, value in zip(PROJECTION_PARAMS, proj_params[1:]):
+            if value:
+                projection[param_name] = validate_float(value)
+    if compact:
+        ozi_map.projection = Projection(projection_name, **projection)
+    else:
+        ozi_map.projection = AttrDict(name=projection_name, **projection)
+
+    ozi_map.gcps = []
+    for i in range(1, 31):
+        line = header[i + 8]
+        if fast and _is_unused_gcp_line(line, i):
+            continue
+        gcp = _read_gcp(line, i, make_gcp)
+        if gcp is not None:
+            ozi_map.gcps.append(gcp)
+    return ozi_map
+
+
+def _parse_header(header, compact, fast):
+    if not header:
+        raise OziFormatError('Document empty.')
+    with stage('parse_header'):
+        try:
+            ozi_map = _read_header(header, compact, fast)
+        except IndexError:
+            raise OziFormatError('Document too short.')
+    count('gcps', len(ozi_map.gcps))
+    if compact:
+        ozi_map.cutline = Cutline()
+        ozi_map.cutline_pixels = Cutline(typecode='q')
+    else:
         ozi_map.cutline = []
         ozi_map.cutline_pixels = []
-        for line in lines[40:]:
-            point = fields(line, 4)
-            if point[0] == 'MMPLL':
-                lat = validate_float(point[3])
-                lon = validate_float(point[2])
-                ozi_map.cutline.append((lon, lat))
-            elif point[0] == 'MMPXY':
-                x = validate_number(point[2])
-                y = validate_number(point[3])
-                ozi_map.cutline_pixels.append((x, y))
-    except IndexError:
-        raise OziFormatError('Document too short.')
     return ozi_map
 
+
+def _read_ozi_lines(lines, compact, engine='fast'):
+    """Parse map from iterator of lines, only fixed header is read eagerly, cutline lines are consumed one by one"""
+    if engine not in ENGINES:
+        raise ValueError('Unknown engine "%s"' % engine)
+    fast = engine == 'fast'
+    header = [_strip_line(l) for l in islice(lines, HEADER_LINES_COUNT)]
+    ozi_map = _parse_header(header, compact, fast)
+    with stage('parse_cutline'):
+        if fast:
+            _read_cutline_fast(lines, ozi_map.cutline, ozi_map.cutline_pixels)
+        else:
+            for line in lines:
+                _read_cutline_point(_strip_line(line), ozi_map.cutline, ozi_map.cutline_pixels)
+    count('cutline_points', len(ozi_map.cutline) + len(ozi_map.cutline_pixels))
+    return ozi_map
+
+
+def _read_ozi_buffer(data, compact, engine='fast'):
+    """Parse map from bytes, bytearray or mmap. Only header lines and irregular cutline lines are decoded,
+    the rest is split to lines chunk by chunk, so no copy of the whole buffer is made"""
+    if engine not in ENGINES:
+        raise ValueError('Unknown engine "%s"' % engine)
+    with stage('scan_buffer'):
+        needs_decoding = engine != 'fast' or NEEDS_DECODING.search(data) is not None
+        if needs_decoding:
+            text = str(data, 'cp1251')
+    if needs_decoding:
+        return _read_ozi_lines(iter(text.splitlines()), compact, engine)
+    header, pos = _split_header(data)
+    ozi_map = _parse_header([_strip_line(line) for line in header], compact, True)
+    with stage('parse_cutline'):
+        _read_cutline_buffer(data, pos, ozi_map.cutline, ozi_map.cutline_pixels)
+    count('cutline_points', len(ozi_map.cutline) + len(ozi_map.cutline_pixels))
+    return ozi_map
+
+
+OziMapResult = namedtuple('OziMapResult', ['source', 'ozi_map', 'error'])
+
+
+TEXT_CHUNK_SIZE = 1 << 16
+
+
+def _iter_text_lines(stream):
+    """Lines of text stream split at the same line breaks as str.splitlines() in read_ozi_map,
+    the stream is read by chunks of about TEXT_CHUNK_SIZE characters"""
+    size = TEXT_CHUNK_SIZE
+    tail = ''
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        text = tail + chunk
+        # the last line may continue in the next chunk, as may "\r" of "\r\n"
+        tail = text.splitlines(True)[-1]
+        if len(tail) < len(text):
+            for line in text[:len(text) - len(tail)].splitlines():
+                yield line
+            size = TEXT_CHUNK_SIZE
+        else:
+            # no line break in the chunk, read more at once to not split long line again and again
+            size *= 2
+    for line in tail.splitlines():
+        yield line
+
+
+def _open_lines(source):
+    """Returns (lines iterator, stream to close or detach), newlines are not translated by the stream,
+    so lines are split the same way as by read_ozi_map"""
+    if hasattr(source, 'read'):
+        if isinstance(source, io.TextIOBase):
+            return _iter_text_lines(source), None
+        stream = io.TextIOWrapper(source, encoding='cp1251', newline='')
+    else:
+        stream = io.open(source, 'r', encoding='cp1251', newline='')
+    return _iter_text_lines(stream), stream
+
+
+def iter_ozi_maps(sources, compact=False, engine='fast'):
+    """Lazily parse maps from file names or binary file objects.
+
+    Yields OziMapResult(source, ozi_map, error) for every source, ozi_map is None if parsing failed
+    and error holds the exception then. Cutline lines are read and parsed one at a time."""
+    for source in sources:
+        stream = None
+        try:
+            lines, stream = _open_lines(source)
+            ozi_map = _read_ozi_lines(lines, compact, engine)
+        except (OziFormatError, ValidationError, OSError, UnicodeDecodeError) as e:
+            yield OziMapResult(source, None, e)
+        else:
+            yield OziMapResult(source, ozi_map, None)
+        finally:
+            if stream is not None:
+                if hasattr(source, 'read'):
+                    stream.detach()
+                else:
+                    stream.close()
+
+
 if __name__ == '__main__':
     import sys
     import pprint
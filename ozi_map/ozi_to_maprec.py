@@ -1,80 +1,32 @@
 # -*- coding: utf-8 -*-
-import argparse
 import os
-from ozi_map import ozi_reader
-from maprec import Maprecord
-import pyproj
+import sys
+import numpy as np
+from ozi_map import ozi_reader, srs
+from ozi_map.transformers import get_transformer
+from ozi_map.dir_index import get_directory_index
+from ozi_map.image_probe import probe_image
+from ozi_map.profiling import stage, profiling
+from ozi_map.transform import MapTransform
+
+
+FOOTPRINT_DENSIFY = 5
 
 
 def find_image_file(ozi_image_filename, base_dir):
     ozi_image_filename = ozi_image_filename.split('\\')[-1].lower()
-    path = None
-    for fn in os.listdir(base_dir):
-        if os.path.isfile(os.path.join(base_dir, fn)) and fn.lower() == ozi_image_filename:
-            if path is not None:
-                raise Exception('Ambigios file name "%s"' % fn)
-            path = os.path.abspath(os.path.join(base_dir, fn))
-    if path is None:
+    with stage('image_lookup'):
+        paths = get_directory_index(base_dir).lookup(ozi_image_filename)
+    if len(paths) > 1:
+        raise Exception('Ambigios file name "%s"' % os.path.basename(paths[1]))
+    if not paths:
         raise Exception('Image "%s" not found' % ozi_image_filename)
-    return path
+    return paths[0]
 
 
 def get_srs_as_proj4(ozi_datum_string, ozi_projection=None):
-    datums = {
-        'wgs84': '+datum=WGS84',
-        'sk42': '+ellps=krass +towgs84=23.57,-140.95,-79.8,0.0,0.35,0.79,-0.22 +no_defs' # EPSG:5044
-        }
-    datum_map = {
-        # http://www.hemanavigator.com.au/Products/TopographicalGPS/OziExplorer/tabid/69/Default.aspx
-        'WGS 84': datums['wgs84'],
-        'Pulkovo 1942 (1)': datums['sk42'],
-        'Pulkovo 1942 (2)': datums['sk42'],
-        'Pulkovo 1942': datums['sk42']
-        }
-    proj_map = {
-        'Latitude/Longitude': ('+proj=latlong',),
-        'Transverse Mercator': (
-            '+proj=tmerc +units=m',
-            ('+lat_0=', 'lat_origin'),
-            ('+lon_0=', 'lon_origin'),
-            ('+k=', 'k_factor'),
-            ('+x_0=', 'false_easting'),
-            ('+y_0=', 'false_northing')),
-        'Lambert Conformal Conic': (
-            '+proj=lcc +units=m',
-            ('+lat_0=', 'lat_origin'),
-            ('+lon_0=', 'lon_origin'),
-            ('+lat_1=', 'lat1'),
-            ('+lat_2=', 'lat2'),
-        ),
-        'Mercator': (
-            '+proj=merc',
-            ('+lon_0=', 'lon_origin'),
-            ('+k=', 'k_factor'),
-            ('+x_0=', 'false_easting'),
-            ('+y_0=', 'false_northing'),
-        )
-    }
-    try:
-        srs = [datum_map[ozi_datum_string]]
-    except KeyError as e:
-        raise Exception("Unsupported datum: '%s'" % (e.message))
-    if ozi_projection is None:
-        proj_params = ('+proj=latlong',)
-    else:
-        try:
-            proj_params = proj_map[ozi_projection.name]
-        except KeyError as e:
-            raise Exception("Unsupported projection: '%s'" % (e.message))
-    srs.append(proj_params[0])
-    for proj_param, ozi_param in proj_params[1:]:
-        try:
-            value = ozi_projection.get(ozi_param)
-            if value is not None:
-                srs.append('%s%s' % (proj_param, value))
-        except KeyError:
-            raise Exception('Projection parameters not fully defined')
-    return ' '.join(srs)
+    with stage('srs'):
+        return srs.get_proj4(ozi_datum_string, ozi_projection)
 
 
 def convert_gcps(ozi_gcps):
@@ -93,53 +45,138 @@ def convert_cutline(ozi_cutline):
     return [{'x': x, 'y': y} for x, y in ozi_cutline]
 
 
-def get_maprecord_from_ozi_file(ozi_map_file, cutline_type='latlon'):
-    maprecord = {}
-    ozi_map = ozi_reader.read_ozi_map(open(ozi_map_file, 'rb'))
-    try:
-        maprecord['image_path'] = find_image_file(ozi_map.file_name, os.path.dirname(ozi_map_file) or '.')
-    except Exception as e:
-        raise Exception('Error in "%s": %s' % (ozi_map_file, e))
-    maprecord['srs'] = get_srs_as_proj4(ozi_map.datum, ozi_map.projection)
-    maprecord['gcps'] = convert_gcps(ozi_map.gcps)
+def cutline_arrays_to_points(xs, ys):
+    if isinstance(xs, np.ndarray):
+        xs = xs.tolist()
+        ys = ys.tolist()
+    return convert_cutline(zip(xs, ys))
+
 
+def get_cutline_arrays(ozi_map, cutline_type='latlon'):
+    """Returns (srs, xs, ys) for cutline of map parsed with compact=True.
+
+    Coordinates are numpy arrays sharing memory with parsed cutline where possible,
+    float64 for 'latlon' and 'proj' cutlines and int64 pixels for 'raw' one."""
     if cutline_type == 'raw':
-        cutline_srs = 'RAW'
-        cutline_points = ozi_map['cutline_pixels']
-    elif cutline_type == 'latlon':
-        cutline_srs = get_srs_as_proj4(ozi_map.datum)
-        cutline_points = ozi_map.cutline
+        cutline = ozi_map.cutline_pixels
+        return 'RAW', np.frombuffer(cutline.xs, dtype=np.int64), np.frombuffer(cutline.ys, dtype=np.int64)
+    xs = np.frombuffer(ozi_map.cutline.xs, dtype=np.float64)
+    ys = np.frombuffer(ozi_map.cutline.ys, dtype=np.float64)
+    if cutline_type == 'latlon':
+        return get_srs_as_proj4(ozi_map.datum), xs, ys
     elif cutline_type == 'proj':
         proj_str = get_srs_as_proj4(ozi_map.datum, ozi_map.projection)
-        proj = pyproj.Proj(proj_str)
-        cutline_srs = proj_str
-        cutline_points = proj(*list(zip(*ozi_map.cutline)))
-        cutline_points = list(zip(*cutline_points))
+        # pyproj.Proj applied +towgs84, i.e. treated cutline points as WGS 84, keep that behaviour
+        with stage('cutline_projection'):
+            transformer = get_transformer(get_srs_as_proj4('WGS 84'), proj_str)
+            xs, ys = transformer.transform(xs, ys)
+        return proj_str, xs, ys
     else:
         raise Exception()
 
-    maprecord['cutline'] = {
-        'srs': cutline_srs,
-        'points': convert_cutline(cutline_points)
-        }
+
+def get_image_footprint(ozi_map, width, height, densify=FOOTPRINT_DENSIFY):
+    """Returns (srs, lons, lats) of image outline on lat/lon of map datum, each edge is sampled at `densify` points.
+
+    Uses the gcp_fit affine fit through MapTransform rather than ozi_parser.gcps_to_geotransform:
+    the whole densified ring is transformed in one vectorized call with cached transformers."""
+    latlon_srs = get_srs_as_proj4(ozi_map.datum)
+    lons, lats = MapTransform.from_ozi_map(ozi_map, latlon_srs).pixel_rect_ring(0, 0, width, height, densify)
+    return latlon_srs, lons, lats
+
+
+def find_map_image(ozi_map, ozi_map_file):
+    try:
+        return find_image_file(ozi_map.file_name, os.path.dirname(ozi_map_file) or '.')
+    except Exception as e:
+        raise Exception('Error in "%s": %s' % (ozi_map_file, e))
+
+
+def get_maprecord_from_ozi_file(ozi_map_file, cutline_type='latlon', cutline_arrays=False, image_info=False):
+    """With cutline_arrays=True cutline is returned as {'srs': ..., 'xs': ..., 'ys': ...} with numpy arrays
+    instead of list of points, use cutline_arrays_to_points to convert it.
+
+    With image_info=True image size is read from image header and maprecord gets 'image_size'
+    ({'width': ..., 'height': ...}) and 'footprint' (outline of image, in the same form as cutline)"""
+    ozi_map = ozi_reader.read_ozi_map_file(ozi_map_file, compact=True)
+    image_path = find_map_image(ozi_map, ozi_map_file)
+    image_size = None
+    if image_info:
+        with stage('image_probe'):
+            image_size = probe_image(image_path)[1:]
+    return make_maprecord(ozi_map, image_path, cutline_type, cutline_arrays, image_size)
+
+
+def make_maprecord(ozi_map, image_path, cutline_type='latlon', cutline_arrays=False, image_size=None):
+    """If image_size (width, height) is given, maprecord gets 'image_size' and 'footprint' of the image"""
+    maprecord = {}
+    maprecord['image_path'] = image_path
+    maprecord['srs'] = get_srs_as_proj4(ozi_map.datum, ozi_map.projection)
+    maprecord['gcps'] = convert_gcps(ozi_map.gcps)
+
+    cutline_srs, xs, ys = get_cutline_arrays(ozi_map, cutline_type)
+    if cutline_arrays:
+        maprecord['cutline'] = {'srs': cutline_srs, 'xs': xs, 'ys': ys}
+    else:
+        with stage('cutline_to_dicts'):
+            maprecord['cutline'] = {
+                'srs': cutline_srs,
+                'points': cutline_arrays_to_points(xs, ys)
+                }
+    if image_size is not None:
+        width, height = image_size
+        maprecord['image_size'] = {'width': width, 'height': height}
+        with stage('footprint'):
+            footprint_srs, lons, lats = get_image_footprint(ozi_map, width, height)
+        if cutline_arrays:
+            maprecord['footprint'] = {'srs': footprint_srs, 'xs': lons, 'ys': lats}
+        else:
+            maprecord['footprint'] = {'srs': footprint_srs, 'points': cutline_arrays_to_points(lons, lats)}
     return maprecord
 
 
 def parse_command_line():
+    import argparse
+
     parser = argparse.ArgumentParser()
     parser.add_argument('in_file', metavar='ozi_file.map')
     parser.add_argument('out_file', metavar='output.maprec')
     parser.add_argument('--abs-path', action='store_true', help='Write absolute path to image file')
     parser.add_argument('--cutline', required=False, choices=['raw', 'latlon', 'proj'], default='latlon')
     parser.add_argument('--json', action='store_true', default=False)
+    parser.add_argument('--image-info', action='store_true',
+                        help='Add image size and footprint, reading only header of image file')
+    parser.add_argument('--profile', action='store_true', help='Print time spent in conversion stages')
+    parser.add_argument('--profile-json', metavar='FILE', help='Write time spent in conversion stages to JSON file')
     return parser.parse_args()
 
 
+def write_profile(profile, show_table=True, json_file=None):
+    if show_table:
+        print(profile.format_table(), file=sys.stderr)
+    if json_file:
+        profile.dump_json(json_file)
+
+
+def convert(in_file, out_file, cutline_type='latlon', abs_path=False, format_json=False, image_info=False):
+    # maprec is needed only for writing .maprec files, don't load it for other users of the module
+    from maprec import Maprecord
+
+    with stage('convert'):
+        maprecord = get_maprecord_from_ozi_file(in_file, cutline_type, image_info=image_info)
+        with stage('write'):
+            maprecord = Maprecord(in_file, maprecord)
+            maprecord.write(out_file, image_path_relative=not abs_path, format_json=format_json)
+
+
 def main():
     args = parse_command_line()
-    maprecord = get_maprecord_from_ozi_file(args.in_file, args.cutline)
-    maprecord = Maprecord(args.in_file, maprecord)
-    maprecord.write(args.out_file, image_path_relative=not args.abs_path, format_json=args.json)
+    if args.profile or args.profile_json:
+        with profiling() as profile:
+            convert(args.in_file, args.out_file, args.cutline, args.abs_path, args.json, args.image_info)
+        write_profile(profile, args.profile, args.profile_json)
+    else:
+        convert(args.in_file, args.out_file, args.cutline, args.abs_path, args.json, args.image_info)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Opt-in timing of parse/convert stages. When profiling is not enabled stage() returns a shared
+# no-op context manager, so instrumented code pays only for one function call per stage.
+#
+#   with profiling() as profile:
+#       get_maprecord_from_ozi_file('map.map')
+#   print(profile.format_table())
+import json
+import time
+from contextlib import contextmanager
+
+
+class Profile(object):
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    def add(self, name, wall, cpu, calls=1):
+        stage = self.stages.get(name)
+        if stage is None:
+            self.stages[name] = [calls, wall, cpu]
+        else:
+            stage[0] += calls
+            stage[1] += wall
+            stage[2] += cpu
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, data):
+        """Add results of other Profile, given as Profile or as dict from as_dict()"""
+        if isinstance(data, Profile):
+            data = data.as_dict()
+        for name, stage in data['stages'].items():
+            self.add(name, stage['wall'], stage['cpu'], stage['calls'])
+        for name, n in data['counters'].items():
+            self.count(name, n)
+
+    def as_dict(self):
+        return {
+            'stages': dict((name, {'calls': calls, 'wall': wall, 'cpu': cpu})
+                           for name, (calls, wall, cpu) in self.stages.items()),
+            'counters': dict(self.counters),
+        }
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+    def format_table(self):
+        lines = ['%-24s %8s %12s %12s %12s' % ('stage', 'calls', 'wall, ms', 'cpu, ms', 'wall/call, us')]
+        for name, (calls, wall, cpu) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append('%-24s %8d %12.2f %12.2f %12.1f' % (name, calls, wall * 1e3, cpu * 1e3, wall / calls * 1e6))
+        for name, n in sorted(self.counters.items()):
+            lines.append('%-24s %8d' % (name, n))
+        return '\n'.join(lines)
+
+
+class _Stage(object):
+    __slots__ = ('profile', 'name', 'wall', 'cpu')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.add(self.name, time.perf_counter() - self.wall, time.thread_time() - self.cpu)
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_stage = _NullStage()
+_active_profile = None
+
+
+def stage(name):
+    """Context manager timing block of code as stage `name` of active profile"""
+    if _active_profile is None:
+        return _null_stage
+    return _Stage(_active_profile, name)
+
+
+def count(name, n=1):
+    if _active_profile is not None:
+        _active_profile.count(name, n)
+
+
+def is_enabled():
+    return _active_profile is not None
+
+
+@contextmanager
+def profiling(profile=None, callback=None):
+    """Enable profiling in this process for duration of with block.
+
+    Yields Profile collecting results, callback(profile) is called on exit."""
+    global _active_profile
+    if profile is None:
+        profile = Profile()
+    previous = _active_profile
+    _active_profile = profile
+    try:
+        yield profile
+    finally:
+        _active_profile = previous
+        if callback is not None:
+            callback(profile)
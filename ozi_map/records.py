@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Compact counterparts of AttrDict structures returned by read_ozi_map(..., compact=True).
+# They support both attribute and item access, so code written for AttrDict keeps working.
+from array import array
+
+
+class Record(object):
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except (AttributeError, TypeError):
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def keys(self):
+        return [name for name in self.__slots__ if getattr(self, name) is not None]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.items() == other.items()
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % item for item in self.items()))
+
+
+class Point(Record):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class Gcp(Record):
+    __slots__ = ('pixel', 'ref', 'type', 'zone')
+
+    def __init__(self, pixel, ref, type, zone=None):
+        self.pixel = pixel
+        self.ref = ref
+        self.type = type
+        self.zone = zone
+
+
+class Projection(Record):
+    __slots__ = ('name', 'lat_origin', 'lon_origin', 'k_factor', 'false_easting', 'false_northing',
+                 'lat1', 'lat2', 'height')
+
+    def __init__(self, name, lat_origin=None, lon_origin=None, k_factor=None, false_easting=None,
+                 false_northing=None, lat1=None, lat2=None, height=None):
+        self.name = name
+        self.lat_origin = lat_origin
+        self.lon_origin = lon_origin
+        self.k_factor = k_factor
+        self.false_easting = false_easting
+        self.false_northing = false_northing
+        self.lat1 = lat1
+        self.lat2 = lat2
+        self.height = height
+
+
+class Cutline(object):
+    """Sequence of (x, y) points stored in two flat arrays"""
+    __slots__ = ('xs', 'ys')
+
+    def __init__(self, points=(), typecode='d'):
+        self.xs = array(typecode)
+        self.ys = array(typecode)
+        for x, y in points:
+            self.xs.append(x)
+            self.ys.append(y)
+
+    @classmethod
+    def from_arrays(cls, xs, ys):
+        if len(xs) != len(ys):
+            raise ValueError('Cutline: coordinate arrays must have equal length')
+        cutline = cls(typecode=xs.typecode)
+        cutline.xs = xs
+        cutline.ys = ys
+        return cutline
+
+    def append(self, point):
+        self.xs.append(point[0])
+        self.ys.append(point[1])
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Cutline.from_arrays(self.xs[index], self.ys[index])
+        return self.xs[index], self.ys[index]
+
+    def __iter__(self):
+        return zip(self.xs, self.ys)
+
+    def __eq__(self, other):
+        if isinstance(other, Cutline):
+            return self.xs == other.xs and self.ys == other.ys
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Cutline(%r)' % list(self)
+
+    def to_list(self):
+        return list(self)
+
+
+class OziMap(Record):
+    __slots__ = ('title', 'file_name', 'datum', 'projection', 'gcps', 'cutline', 'cutline_pixels')
+
+    def __init__(self, title=None, file_name=None, datum=None, projection=None, gcps=None, cutline=None,
+                 cutline_pixels=None):
+        self.title = title
+        self.file_name = file_name
+        self.datum = datum
+        self.projection = projection
+        self.gcps = gcps
+        self.cutline = cutline
+        self.cutline_pixels = cutline_pixels
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from functools import lru_cache
+
+
+DATUMS = {
+    'wgs84': '+datum=WGS84',
+    'sk42': '+ellps=krass +towgs84=23.57,-140.95,-79.8,0.0,0.35,0.79,-0.22 +no_defs'  # EPSG:5044
+    }
+
+DATUM_MAP = {
+    # http://www.hemanavigator.com.au/Products/TopographicalGPS/OziExplorer/tabid/69/Default.aspx
+    'WGS 84': DATUMS['wgs84'],
+    'Pulkovo 1942 (1)': DATUMS['sk42'],
+    'Pulkovo 1942 (2)': DATUMS['sk42'],
+    'Pulkovo 1942': DATUMS['sk42']
+    }
+
+LATLONG_PROJECTION = 'Latitude/Longitude'
+
+PROJ_MAP = {
+    LATLONG_PROJECTION: ('+proj=latlong',),
+    'Transverse Mercator': (
+        '+proj=tmerc +units=m',
+        ('+lat_0=', 'lat_origin'),
+        ('+lon_0=', 'lon_origin'),
+        ('+k=', 'k_factor'),
+        ('+x_0=', 'false_easting'),
+        ('+y_0=', 'false_northing')),
+    'Lambert Conformal Conic': (
+        '+proj=lcc +units=m',
+        ('+lat_0=', 'lat_origin'),
+        ('+lon_0=', 'lon_origin'),
+        ('+lat_1=', 'lat1'),
+        ('+lat_2=', 'lat2'),
+    ),
+    'Mercator': (
+        '+proj=merc',
+        ('+lon_0=', 'lon_origin'),
+        ('+k=', 'k_factor'),
+        ('+x_0=', 'false_easting'),
+        ('+y_0=', 'false_northing'),
+    )
+}
+
+CACHE_SIZE = 1024
+
+
+class SrsError(Exception):
+    pass
+
+
+class UnsupportedDatumError(SrsError):
+    def __init__(self, datum):
+        SrsError.__init__(self, "Unsupported datum: '%s'" % datum)
+        self.datum = datum
+
+
+class UnsupportedProjectionError(SrsError):
+    def __init__(self, projection):
+        SrsError.__init__(self, "Unsupported projection: '%s'" % projection)
+        self.projection = projection
+
+
+class InvalidSrsError(SrsError):
+    def __init__(self, proj4, reason):
+        SrsError.__init__(self, "Invalid srs '%s': %s" % (proj4, reason))
+        self.proj4 = proj4
+
+
+ResolvedSrs = namedtuple('ResolvedSrs', ['proj4', 'crs'])
+
+
+def projection_key(ozi_projection):
+    """Hashable key of projection parameters used by proj4 string, None for lat/lon"""
+    if ozi_projection is None:
+        return None
+    name = ozi_projection.name
+    try:
+        proj_params = PROJ_MAP[name]
+    except KeyError:
+        raise UnsupportedProjectionError(name)
+    values = []
+    for _, ozi_param in proj_params[1:]:
+        value = ozi_projection.get(ozi_param)
+        values.append(None if value is None else '%s' % value)
+    return (name,) + tuple(values)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _proj4_from_key(ozi_datum_string, key):
+    srs = [DATUM_MAP[ozi_datum_string]]
+    if key is None:
+        srs.append(PROJ_MAP[LATLONG_PROJECTION][0])
+        return ' '.join(srs)
+    proj_params = PROJ_MAP[key[0]]
+    srs.append(proj_params[0])
+    for (proj_param, _), value in zip(proj_params[1:], key[1:]):
+        if value is not None:
+            srs.append('%s%s' % (proj_param, value))
+    return ' '.join(srs)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _crs_from_proj4(proj4):
+    # pyproj takes long to import, load it only when srs has to be validated
+    import pyproj
+
+    try:
+        return pyproj.CRS(proj4)
+    except pyproj.exceptions.CRSError as e:
+        raise InvalidSrsError(proj4, e)
+
+
+def get_proj4(ozi_datum_string, ozi_projection=None):
+    """proj4 string for datum and projection, lat/lon if projection is None"""
+    # datum is checked before projection, so it is reported first if both are unsupported
+    if ozi_datum_string not in DATUM_MAP:
+        raise UnsupportedDatumError(ozi_datum_string)
+    return _proj4_from_key(ozi_datum_string, projection_key(ozi_projection))
+
+
+def resolve_srs(ozi_datum_string, ozi_projection=None):
+    """Returns ResolvedSrs(proj4, crs) with proj4 string validated by pyproj"""
+    proj4 = get_proj4(ozi_datum_string, ozi_projection)
+    return ResolvedSrs(proj4, _crs_from_proj4(proj4))
+
+
+def cache_info():
+    return {'proj4': _proj4_from_key.cache_info(), 'crs': _crs_from_proj4.cache_info()}
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Keeps directory of .maprec files in sync with a library of .map files:
+#   python -m ozi_map.sync SRC_DIR OUT_DIR [--watch]
+# Only maps which changed (or whose images changed) since previous run are converted again,
+# outputs of deleted maps are removed.
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+from ozi_map.batch import collect_map_files, convert_files, get_output_path
+from ozi_map.ozi_reader import read_ozi_map_file
+from ozi_map.ozi_to_maprec import find_map_image
+
+
+MANIFEST_NAME = '.ozi_map_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _stamp(path, old_stamp=None):
+    """Returns {'mtime_ns', 'size', 'sha1'} for file, hash is reused from old_stamp if mtime and size match"""
+    st = os.stat(path)
+    stamp = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+    if old_stamp and old_stamp.get('mtime_ns') == st.st_mtime_ns and old_stamp.get('size') == st.st_size:
+        stamp['sha1'] = old_stamp['sha1']
+    else:
+        stamp['sha1'] = file_hash(path)
+    return stamp
+
+
+def _same_content(stamp, old_stamp):
+    return old_stamp is not None and stamp['size'] == old_stamp['size'] and stamp['sha1'] == old_stamp['sha1']
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _find_image(map_path):
+    return find_map_image(read_ozi_map_file(map_path), map_path)
+
+
+def _check_map(map_path, entry, out_path):
+    """Returns (up_to_date, new_entry), new_entry is None if map can not be checked"""
+    old_map_stamp = entry['map'] if entry else None
+    map_stamp = _stamp(map_path, old_map_stamp)
+    map_same = _same_content(map_stamp, old_map_stamp)
+    if map_same and entry.get('image'):
+        image_path = entry['image']['path']
+    else:
+        try:
+            image_path = _find_image(map_path)
+        except Exception:
+            return False, None
+    old_image_stamp = entry['image'] if entry and entry.get('image', {}).get('path') == image_path else None
+    try:
+        image_stamp = _stamp(image_path, old_image_stamp)
+    except OSError:
+        return False, None
+    image_stamp['path'] = image_path
+    new_entry = {'map': map_stamp, 'image': image_stamp, 'output': out_path}
+    up_to_date = map_same and _same_content(image_stamp, old_image_stamp) and os.path.exists(out_path)
+    return up_to_date, new_entry
+
+
+def sync_once(src_dir, out_dir, manifest_path=None, workers=None, cutline_type='latlon', abs_path=False,
+              format_json=False, log=None):
+    """Convert new and changed maps, delete outputs of removed ones.
+
+    Returns dict with lists of 'converted', 'unchanged', 'failed' and 'deleted' map paths"""
+    if manifest_path is None:
+        manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    options = {'cutline_type': cutline_type, 'abs_path': abs_path, 'format_json': format_json}
+    manifest = load_manifest(manifest_path)
+    if manifest is None or manifest.get('options') != options:
+        manifest = {'version': MANIFEST_VERSION, 'options': options, 'maps': {}}
+    entries = manifest['maps']
+    summary = {'converted': [], 'unchanged': [], 'failed': [], 'deleted': []}
+
+    jobs = []
+    new_entries = {}
+    seen = set()
+    for map_path, rel_name in collect_map_files([src_dir]):
+        key = os.path.abspath(map_path)
+        seen.add(key)
+        out_path = os.path.abspath(get_output_path(map_path, rel_name, out_dir))
+        entry = entries.get(key)
+        try:
+            up_to_date, new_entry = _check_map(map_path, entry, out_path)
+        except OSError:
+            continue
+        if up_to_date:
+            entries[key] = new_entry
+            summary['unchanged'].append(map_path)
+        else:
+            jobs.append((map_path, out_path))
+            new_entries[map_path] = (key, new_entry, out_path)
+
+    for key in list(entries):
+        if key not in seen:
+            out_path = entries.pop(key).get('output')
+            if out_path and os.path.exists(out_path):
+                os.remove(out_path)
+            summary['deleted'].append(key)
+
+    for map_path, error in convert_files(jobs, workers, cutline_type, abs_path, format_json):
+        key, new_entry, out_path = new_entries[map_path]
+        if error is None and new_entry is not None:
+            entries[key] = new_entry
+            summary['converted'].append(map_path)
+        else:
+            # output of previous version would be stale and, without manifest entry, never cleaned up
+            entries.pop(key, None)
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            summary['failed'].append(map_path)
+            if log is not None:
+                log.write('FAILED %s: %s\n' % (map_path, error or 'image not found'))
+
+    if not os.path.isdir(os.path.dirname(os.path.abspath(manifest_path))):
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_path)))
+    save_manifest(manifest_path, manifest)
+    return summary
+
+
+def watch(src_dir, out_dir, interval=60, log=None, **kwargs):
+    while True:
+        summary = sync_once(src_dir, out_dir, log=log, **kwargs)
+        if log is not None and (summary['converted'] or summary['failed'] or summary['deleted']):
+            log.write(format_summary(summary) + '\n')
+            log.flush()
+        time.sleep(interval)
+
+
+def format_summary(summary):
+    return '%d converted, %d unchanged, %d failed, %d deleted' % (
+        len(summary['converted']), len(summary['unchanged']), len(summary['failed']), len(summary['deleted']))
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Incrementally convert directory of OziExplorer maps to .maprec')
+    parser.add_argument('src_dir')
+    parser.add_argument('out_dir')
+    parser.add_argument('--manifest', help='Manifest file, default is %s in output directory' % MANIFEST_NAME)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--watch', action='store_true', help='Keep running and resync periodically')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between resyncs in watch mode')
+    parser.add_argument('--abs-path', action='store_true', help='Write absolute path to image file')
+    parser.add_argument('--cutline', required=False, choices=['raw', 'latlon', 'proj'], default='latlon')
+    parser.add_argument('--json', action='store_true', default=False)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_command_line()
+    options = dict(manifest_path=args.manifest, workers=args.jobs, cutline_type=args.cutline,
+                   abs_path=args.abs_path, format_json=args.json)
+    if args.watch:
+        try:
+            watch(args.src_dir, args.out_dir, args.interval, log=sys.stderr, **options)
+        except KeyboardInterrupt:
+            return 0
+    summary = sync_once(args.src_dir, args.out_dir, log=sys.stderr, **options)
+    print(format_summary(summary), file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+from ozi_map.gcp_fit import fit_geotransform, gcps_to_arrays
+from ozi_map.gcp_models import fit_gcp_model, get_interpolation_grid
+from ozi_map.ozi_reader import read_ozi_map_file
+from ozi_map.srs import get_proj4
+from ozi_map.transformers import get_transformer
+
+
+def _apply(gt, x, y):
+    return gt[0] + x * gt[1] + y * gt[2], gt[3] + x * gt[4] + y * gt[5]
+
+
+def _as_arrays(x, y):
+    return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+
+def projected_gcp_arrays(ozi_map):
+    """Returns (pixels, refs) arrays of map gcps with latlon gcps converted to map projection"""
+    proj_srs = get_proj4(ozi_map.datum, ozi_map.projection)
+    pixels, refs = gcps_to_arrays(ozi_map.gcps)
+    is_latlon = np.array([gcp.type != 'proj' for gcp in ozi_map.gcps], dtype=bool)
+    if is_latlon.any():
+        xs, ys = get_transformer(get_proj4(ozi_map.datum), proj_srs).transform(refs[is_latlon, 0], refs[is_latlon, 1])
+        refs[is_latlon, 0] = xs
+        refs[is_latlon, 1] = ys
+    return pixels, refs
+
+
+def _model_grids(model, inv_model, geotransform, image_size, tolerance):
+    """Interpolation grids for pixel -> projected model over image and for inverse model over image extent"""
+    width, height = image_size
+    # tolerance of forward grid is in projected units, convert it with affine pixel size
+    pixel_size = math.sqrt(abs(geotransform[1] * geotransform[5] - geotransform[2] * geotransform[4]))
+    grid = get_interpolation_grid(model, 0.0, 0.0, float(width), float(height), tolerance * pixel_size)
+    t = np.linspace(0.0, 1.0, 65)
+    xs, ys = grid.transform(np.concatenate([t * width, np.full_like(t, width), t * width, np.zeros_like(t)]),
+                            np.concatenate([np.zeros_like(t), t * height, np.full_like(t, height), t * height]))
+    inv_grid = get_interpolation_grid(inv_model, float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max()),
+                                      tolerance)
+    return grid, inv_grid
+
+
+class MapTransform(object):
+    """Vectorized conversion between pixel, projected and lat/lon coordinates of a map.
+
+    Pixel <-> projected conversion uses affine fit over map gcps or, if model and inv_model are given,
+    models from gcp_models. Projected <-> lat/lon uses cached pyproj transformer. All methods accept
+    scalars or numpy arrays and return arrays."""
+
+    def __init__(self, geotransform, inv_geotransform, proj_srs, latlon_srs, residuals=None, model=None,
+                 inv_model=None):
+        self.geotransform = np.asarray(geotransform, dtype=np.float64)
+        self.inv_geotransform = np.asarray(inv_geotransform, dtype=np.float64)
+        self.proj_srs = proj_srs
+        self.latlon_srs = latlon_srs
+        self.residuals = residuals
+        self.model = model
+        self.inv_model = inv_model
+        self._to_latlon = get_transformer(proj_srs, latlon_srs)
+        self._from_latlon = get_transformer(latlon_srs, proj_srs)
+
+    @classmethod
+    def from_ozi_map(cls, ozi_map, latlon_srs=None, method='affine', image_size=None, grid_tolerance=None):
+        """latlon_srs defaults to lat/lon on datum of the map.
+
+        method is 'affine' or one of fit_gcp_model methods ('polynomial2', 'polynomial3', 'tps').
+        If grid_tolerance (in pixels) is given, models are replaced with cached interpolation grids
+        covering image of image_size (width, height), which are much faster to evaluate."""
+        if latlon_srs is None:
+            latlon_srs = get_proj4(ozi_map.datum)
+        pixels, refs = projected_gcp_arrays(ozi_map)
+        # gcp_fit rather than ozi_parser.gcps_to_geotransform: it works on the same arrays as gcp models
+        # and its centered solve gives more accurate inverse transforms over projected coordinates
+        fit = fit_geotransform(pixels, refs)
+        proj_srs = get_proj4(ozi_map.datum, ozi_map.projection)
+        if method == 'affine':
+            return cls(fit.geotransform, fit.inv_geotransform, proj_srs, latlon_srs, fit.inv_residuals)
+        model = fit_gcp_model(pixels, refs, method)
+        inv_model = fit_gcp_model(refs, pixels, method)
+        residuals = inv_model.residuals(refs, pixels)
+        if grid_tolerance is not None:
+            if image_size is None:
+                raise ValueError('image_size is required for interpolation grid')
+            model, inv_model = _model_grids(model, inv_model, fit.geotransform, image_size, grid_tolerance)
+        return cls(fit.geotransform, fit.inv_geotransform, proj_srs, latlon_srs, residuals, model, inv_model)
+
+    @classmethod
+    def from_ozi_file(cls, ozi_map_file, latlon_srs=None, method='affine', image_size=None, grid_tolerance=None):
+        return cls.from_ozi_map(read_ozi_map_file(ozi_map_file, compact=True), latlon_srs, method, image_size,
+                                grid_tolerance)
+
+    def pixel_to_proj(self, x, y):
+        if self.model is not None:
+            return self.model.transform(x, y)
+        return _apply(self.geotransform, *_as_arrays(x, y))
+
+    def proj_to_pixel(self, x, y):
+        if self.inv_model is not None:
+            return self.inv_model.transform(x, y)
+        return _apply(self.inv_geotransform, *_as_arrays(x, y))
+
+    def pixel_to_latlon(self, x, y):
+        """Returns (lon, lat)"""
+        return self._to_latlon.transform(*self.pixel_to_proj(x, y))
+
+    def latlon_to_pixel(self, lon, lat):
+        return self.proj_to_pixel(*self._from_latlon.transform(*_as_arrays(lon, lat)))
+
+    def pixel_bboxes_to_latlon(self, bboxes, densify=21):
+        """Lat/lon bounds of pixel rectangles.
+
+        bboxes is array of shape (N, 4) with (xmin, ymin, xmax, ymax) rows, result has
+        (lon_min, lat_min, lon_max, lat_max) rows. Edges are sampled at `densify` points,
+        because straight lines in pixel space are curves in lat/lon."""
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        t = np.linspace(0.0, 1.0, densify)
+        xmin, ymin, xmax, ymax = [bboxes[:, i:i + 1] for i in range(4)]
+        dx = xmax - xmin
+        dy = ymax - ymin
+        xs = np.hstack([xmin + dx * t, np.broadcast_to(xmax, (len(bboxes), densify)), xmax - dx * t,
+                        np.broadcast_to(xmin, (len(bboxes), densify))])
+        ys = np.hstack([np.broadcast_to(ymin, (len(bboxes), densify)), ymin + dy * t,
+                        np.broadcast_to(ymax, (len(bboxes), densify)), ymax - dy * t])
+        lon, lat = self.pixel_to_latlon(xs, ys)
+        return np.column_stack([lon.min(axis=1), lat.min(axis=1), lon.max(axis=1), lat.max(axis=1)])
+
+    def pixel_bbox_to_latlon(self, xmin, ymin, xmax, ymax, densify=21):
+        return tuple(self.pixel_bboxes_to_latlon([(xmin, ymin, xmax, ymax)], densify)[0].tolist())
+
+    def pixel_rect_ring(self, xmin, ymin, xmax, ymax, densify=5):
+        """Returns (lons, lats) of ring around pixel rectangle, each edge is sampled at `densify` points"""
+        t = np.linspace(0.0, 1.0, densify, endpoint=False)
+        xs = np.concatenate([xmin + (xmax - xmin) * t, np.full(densify, xmax, dtype=np.float64),
+                             xmax - (xmax - xmin) * t, np.full(densify, xmin, dtype=np.float64)])
+        ys = np.concatenate([np.full(densify, ymin, dtype=np.float64), ymin + (ymax - ymin) * t,
+                             np.full(densify, ymax, dtype=np.float64), ymax - (ymax - ymin) * t])
+        return self.pixel_to_latlon(xs, ys)
+
+    def image_bounds(self, width, height, densify=21):
+        """Lat/lon bounds of whole image"""
+        return self.pixel_bbox_to_latlon(0, 0, width, height, densify)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from threading import Lock
+
+
+DEFAULT_MAXSIZE = 64
+
+
+def normalize_proj4(srs):
+    params = srs.split()
+    if any(p.startswith('+proj=pipeline') for p in params):
+        return ' '.join(params)
+    return ' '.join(sorted(set(params)))
+
+
+class TransformerRegistry(object):
+    """LRU cache of pyproj.Transformer objects keyed by pair of normalized proj4 strings."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._transformers = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, s_srs, d_srs):
+        key = (normalize_proj4(s_srs), normalize_proj4(d_srs))
+        with self._lock:
+            transformer = self._transformers.get(key)
+            if transformer is not None:
+                self.hits += 1
+                self._transformers.move_to_end(key)
+                return transformer
+            self.misses += 1
+        import pyproj
+
+        transformer = pyproj.Transformer.from_crs(pyproj.CRS(key[0]), pyproj.CRS(key[1]), always_xy=True)
+        with self._lock:
+            self._transformers[key] = transformer
+            self._transformers.move_to_end(key)
+            while len(self._transformers) > self.maxsize:
+                self._transformers.popitem(last=False)
+        return transformer
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._transformers), 'maxsize': self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._transformers.clear()
+            self.hits = self.misses = 0
+
+
+registry = TransformerRegistry()
+
+
+def get_transformer(s_srs, d_srs):
+    return registry.get(s_srs, d_srs)
+
+
+def transformer_stats():
+    return registry.stats()
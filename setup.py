@@ -8,6 +8,7 @@ setup(
     author_email='wladimirych@gmail.com',
     packages=find_packages(),
     install_requires=[
+        'numpy',
         'pyproj',
         'maprec @ git+https://github.com/wladich/maprec.git',
     ],
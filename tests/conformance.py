@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Checks that 'fast' and 'reference' engines of read_ozi_map, parsing from bytes buffer
+# and streaming with iter_ozi_maps agree on real and damaged map files (needs ozi_map installed):
+#   python tests/conformance.py [--mutations N] file.map ...
+# test_conformance.py runs it on the corpus in tests/data/conformance.
+import argparse
+import io
+import random
+import sys
+
+from ozi_map.ozi_reader import iter_ozi_maps, read_ozi_map
+
+
+MUTATION_VALUES = ['', 'x', '1.5', ' 12 ', '-3', 'in', 'ex', 'N', 'S', 'E', 'W', 'deg', 'grid', 'xy']
+
+
+def _run(text, engine, compact):
+    try:
+        return 'ok', read_ozi_map(text, compact=compact, engine=engine)
+    except Exception as e:
+        return 'error', type(e).__name__, str(e)
+
+
+def _run_stream(data, compact):
+    try:
+        result = next(iter_ozi_maps([io.BytesIO(data)], compact=compact))
+    except Exception as e:
+        return 'error', type(e).__name__, str(e)
+    if result.error is not None:
+        return 'error', type(result.error).__name__, str(result.error)
+    return 'ok', result.ozi_map
+
+
+def compare_engines(text):
+    """Returns None if engines agree on text, otherwise description of the difference"""
+    data = text.encode('cp1251')
+    for compact in (False, True):
+        reference = _run(text, 'reference', compact)
+        fast = _run(text, 'fast', compact)
+        if reference != fast:
+            return 'compact=%s: reference %r, fast %r' % (compact, reference[1:], fast[1:])
+        buffer = _run(data, 'fast', compact)
+        if reference != buffer:
+            return 'compact=%s: reference %r, buffer %r' % (compact, reference[1:], buffer[1:])
+        stream = _run_stream(data, compact)
+        if reference != stream:
+            return 'compact=%s: reference %r, stream %r' % (compact, reference[1:], stream[1:])
+    return None
+
+
+def mutate(lines, rnd):
+    lines = list(lines)
+    for _ in range(rnd.randint(1, 3)):
+        if not lines:
+            break
+        i = rnd.randrange(len(lines))
+        operation = rnd.randrange(7)
+        if operation == 0 and ',' in lines[i]:
+            parts = lines[i].split(',')
+            parts[rnd.randrange(len(parts))] = rnd.choice(MUTATION_VALUES)
+            lines[i] = ','.join(parts)
+        elif operation == 1:
+            lines[i] = lines[i].replace(',', ',,', 1)
+        elif operation == 2:
+            del lines[i]
+        elif operation == 3:
+            lines[i] = rnd.choice([' \t', '\xa0', '\x1f']) + lines[i] + ' '
+        elif operation == 4:
+            lines = lines[:i]
+        elif operation == 5:
+            lines.insert(i, rnd.choice(['MMPLL,1, %s, 55.5', 'MMPXY,1, %s, 10']) % rnd.choice(MUTATION_VALUES))
+        else:
+            lines[i] = ''
+    return lines
+
+
+def iter_variants(text, mutations, seed=0):
+    rnd = random.Random(seed)
+    lines = text.splitlines()
+    yield text
+    yield text.replace('\r\n', '\n')
+    yield text.replace('\r\n', '\r')
+    for _ in range(mutations):
+        yield '\r\n'.join(mutate(lines, rnd))
+
+
+def check_file(path, mutations=200):
+    with open(path, 'rb') as f:
+        text = f.read().decode('cp1251')
+    mismatches = []
+    for variant in iter_variants(text, mutations):
+        difference = compare_engines(variant)
+        if difference is not None:
+            mismatches.append((variant, difference))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fast and reference OziExplorer map parsers')
+    parser.add_argument('files', metavar='file.map', nargs='+')
+    parser.add_argument('--mutations', type=int, default=200, help='Number of damaged variants per file')
+    args = parser.parse_args()
+    failed = 0
+    for path in args.files:
+        mismatches = check_file(path, args.mutations)
+        if mismatches:
+            failed += 1
+            print('MISMATCH %s: %s' % (path, mismatches[0][1]))
+    print('%d files checked, %d with mismatches' % (len(args.files), failed), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# synthetic maps are made with the benchmark generator
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate_maps import MapSpec, write_map  # noqa: E402
+
+
+MAP_SPECS = [
+    MapSpec('WGS 84', 'Latitude/Longitude', 4, 'latlon', 4, center=(37.5, 55.7)),
+    MapSpec('Pulkovo 1942 (2)', 'Transverse Mercator', 4, 'proj', 100, center=(38.2, 56.1)),
+    MapSpec('Pulkovo 1942', 'Lambert Conformal Conic', 30, 'latlon', 10, center=(36.9, 55.2)),
+]
+
+
+@pytest.fixture
+def map_paths(tmp_path):
+    """Paths of synthetic maps written together with their images to directory "maps" in tmp_path"""
+    directory = tmp_path / 'maps'
+    directory.mkdir()
+    return [write_map(spec, str(directory)) for spec in MAP_SPECS]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from ozi_map.bulk import Bundle, BundleWriter, JsonLinesWriter, iter_json_lines
+from ozi_map.ozi_to_maprec import get_maprecord_from_ozi_file
+
+
+@pytest.fixture(params=['latlon', 'proj', 'raw'])
+def maprecords(request, map_paths):
+    """(id, maprecord) pairs, only the first map has image size and footprint"""
+    return [(path, get_maprecord_from_ozi_file(path, request.param, image_info=i == 0))
+            for i, path in enumerate(map_paths)]
+
+
+def test_bundle_round_trip(tmp_path, maprecords):
+    path = str(tmp_path / 'maps.bundle')
+    with BundleWriter(path) as writer:
+        for map_id, maprecord in maprecords:
+            writer.write(map_id, maprecord)
+    with Bundle(path) as bundle:
+        assert len(bundle) == len(maprecords)
+        assert [map_id for map_id, _ in bundle] == [map_id for map_id, _ in maprecords]
+        for i, (map_id, maprecord) in enumerate(maprecords):
+            assert bundle.get(i) == maprecord
+            assert bundle[map_id] == maprecord
+        assert bundle.image_size(0) == (maprecords[0][1]['image_size']['width'],
+                                        maprecords[0][1]['image_size']['height'])
+        assert bundle.image_size(1) is None and bundle.footprint_arrays(1) is None
+        srs, xs, ys = bundle.cutline_arrays(-1)
+        points = maprecords[-1][1]['cutline']['points']
+        assert srs == maprecords[-1][1]['cutline']['srs']
+        np.testing.assert_array_equal(xs, [p['x'] for p in points])
+        np.testing.assert_array_equal(ys, [p['y'] for p in points])
+        del xs, ys
+
+
+def test_bundle_accepts_cutline_arrays(tmp_path, map_paths):
+    path = str(tmp_path / 'maps.bundle')
+    with BundleWriter(path) as writer:
+        for map_path in map_paths:
+            writer.write(map_path, get_maprecord_from_ozi_file(map_path, cutline_arrays=True))
+    with Bundle(path) as bundle:
+        for map_path in map_paths:
+            assert bundle[map_path] == get_maprecord_from_ozi_file(map_path)
+
+
+def test_bundle_close_releases_mapping(tmp_path, maprecords):
+    path = str(tmp_path / 'maps.bundle')
+    with BundleWriter(path) as writer:
+        writer.write(*maprecords[0])
+    bundle = Bundle(path)
+    bundle.get(0)
+    bundle.close()
+    assert bundle.mmap.closed
+
+
+def test_bundle_rejects_other_files(tmp_path):
+    path = tmp_path / 'not.bundle'
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(Exception, match='is not a maprecord bundle'):
+        Bundle(str(path))
+
+
+def test_json_lines_round_trip(tmp_path, map_paths):
+    path = str(tmp_path / 'maps.jsonl')
+    maprecords = [(map_path, get_maprecord_from_ozi_file(map_path, cutline_arrays=True, image_info=True))
+                  for map_path in map_paths]
+    with JsonLinesWriter(path, abs_path=True) as writer:
+        for map_id, maprecord in maprecords:
+            writer.write(map_id, maprecord)
+    expected = [(map_path, get_maprecord_from_ozi_file(map_path, image_info=True)) for map_path in map_paths]
+    assert list(iter_json_lines(path)) == expected
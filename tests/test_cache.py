@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+
+from ozi_map.cache import MaprecordCache
+from ozi_map.ozi_to_maprec import get_maprecord_from_ozi_file
+
+
+def _touch(path, seconds=10):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_get_returns_stored_maprecord(tmp_path, map_paths):
+    with MaprecordCache(str(tmp_path / 'cache.sqlite')) as cache:
+        path = map_paths[0]
+        assert cache.get(path) is None
+        maprecord = cache.get_maprecord(path)
+        assert maprecord == get_maprecord_from_ozi_file(path)
+        assert cache.get(path) == maprecord
+        assert cache.get(path, 'raw') is None
+
+
+def test_entry_invalidated_by_mtime_change(tmp_path, map_paths):
+    with MaprecordCache(str(tmp_path / 'cache.sqlite')) as cache:
+        path = map_paths[0]
+        cache.get_maprecord(path)
+        _touch(path)
+        assert cache.get(path) is None
+        assert os.path.abspath(path) not in cache.load_all()
+        assert cache.get(map_paths[1]) is None
+
+
+def test_entry_invalidated_by_directory_change(tmp_path, map_paths):
+    with MaprecordCache(str(tmp_path / 'cache.sqlite')) as cache:
+        path = map_paths[0]
+        cache.get_maprecord(path)
+        _touch(os.path.dirname(path))
+        assert cache.get(path) is None
+
+
+def test_entries_persist_across_connections(tmp_path, map_paths):
+    db_path = str(tmp_path / 'cache.sqlite')
+    with MaprecordCache(db_path) as cache:
+        assert cache.warm(map_paths, workers=1) == []
+    with MaprecordCache(db_path) as cache:
+        assert len(cache) == len(map_paths)
+        assert sorted(cache.load_all()) == sorted(os.path.abspath(path) for path in map_paths)
+
+
+def test_warm_reports_errors_and_prune_removes_outdated(tmp_path, map_paths):
+    bad_path = os.path.join(os.path.dirname(map_paths[0]), 'bad.map')
+    with open(bad_path, 'w') as f:
+        f.write('not a map\n')
+    with MaprecordCache(str(tmp_path / 'cache.sqlite')) as cache:
+        errors = cache.warm(map_paths + [bad_path], workers=1)
+        assert [path for path, _ in errors] == [bad_path]
+        _touch(map_paths[1])
+        assert cache.prune() == 1
+        assert len(cache) == len(map_paths) - 1
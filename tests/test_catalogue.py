@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+
+import numpy as np
+import pytest
+
+from ozi_map.catalogue import (Catalogue, build_catalogue, point_in_ring, ring_distance, ring_intersects_bbox,
+                               write_index)
+
+
+def _random_rings(count, seed=0):
+    """Star shaped polygons scattered over 10x10 degrees, some of them not convex"""
+    rnd = random.Random(seed)
+    rings = []
+    for _ in range(count):
+        cx, cy = rnd.uniform(30, 40), rnd.uniform(50, 60)
+        radius = rnd.uniform(0.05, 0.5)
+        n = rnd.randint(3, 12)
+        angles = sorted(rnd.uniform(0, 2 * math.pi) for _ in range(n))
+        radii = [radius * rnd.uniform(0.3, 1) for _ in range(n)]
+        rings.append((np.array([cx + r * math.cos(a) for a, r in zip(angles, radii)]),
+                      np.array([cy + r * math.sin(a) for a, r in zip(angles, radii)])))
+    return rings
+
+
+@pytest.fixture(scope='module')
+def catalogue(tmp_path_factory):
+    rings = _random_rings(300)
+    names = ['map%03d' % i for i in range(len(rings))]
+    directory = str(tmp_path_factory.mktemp('catalogue'))
+    # small nodes make several levels of tree
+    write_index(directory, names, rings, node_size=4)
+    return Catalogue(directory), dict(zip(names, rings))
+
+
+def _query_points(count, seed=1):
+    rnd = random.Random(seed)
+    return [(rnd.uniform(29, 41), rnd.uniform(49, 61)) for _ in range(count)]
+
+
+def test_query_point_matches_brute_force(catalogue):
+    index, rings = catalogue
+    for lon, lat in _query_points(200):
+        expected = [name for name, (xs, ys) in rings.items() if point_in_ring(xs, ys, lon, lat)]
+        assert sorted(index.query_point(lon, lat)) == sorted(expected)
+
+
+def test_query_bbox_matches_brute_force(catalogue):
+    index, rings = catalogue
+    rnd = random.Random(2)
+    for lon, lat in _query_points(100):
+        bbox = (lon, lat, lon + rnd.uniform(0, 1), lat + rnd.uniform(0, 1))
+        # exact test is slow, rings with bounding box outside of bbox can not intersect it
+        expected = [name for name, (xs, ys) in rings.items()
+                    if xs.min() <= bbox[2] and xs.max() >= bbox[0] and ys.min() <= bbox[3] and ys.max() >= bbox[1] and
+                    ring_intersects_bbox(xs, ys, *bbox)]
+        assert sorted(index.query_bbox(*bbox)) == sorted(expected)
+
+
+def test_nearest_matches_brute_force(catalogue):
+    index, rings = catalogue
+    for lon, lat in _query_points(50):
+        x_scale = math.cos(math.radians(lat))
+        expected = sorted(ring_distance(xs, ys, lon, lat, x_scale) for xs, ys in rings.values())[:5]
+        result = index.nearest(lon, lat, k=5)
+        assert [distance for _, distance in result] == pytest.approx(expected)
+        for name, distance in result:
+            assert ring_distance(*rings[name], x=lon, y=lat, x_scale=x_scale) == pytest.approx(distance)
+
+
+def test_empty_catalogue(tmp_path):
+    write_index(str(tmp_path), [], [])
+    index = Catalogue(str(tmp_path))
+    assert len(index) == 0
+    assert index.query_point(37, 55) == []
+    assert index.query_bbox(30, 50, 40, 60) == []
+    assert index.nearest(37, 55) == []
+
+
+def test_build_catalogue_from_map_files(tmp_path, map_paths):
+    directory = str(tmp_path / 'index')
+    assert build_catalogue(map_paths, directory, workers=1) == []
+    index = Catalogue(directory)
+    assert len(index) == len(map_paths)
+    # generated maps are centered at their MapSpec centers, see conftest
+    assert index.query_point(37.5, 55.7) == [map_paths[0]]
+    assert index.nearest(38.2, 56.1)[0] == (map_paths[1], 0.0)
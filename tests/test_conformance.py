@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+
+import pytest
+
+from conformance import check_file, compare_engines
+
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'conformance')
+CORPUS = sorted(glob.glob(os.path.join(CORPUS_DIR, '*.map')))
+MUTATIONS = 50
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('cp1251')
+
+
+def test_corpus_has_valid_and_damaged_maps():
+    names = [os.path.basename(path) for path in CORPUS]
+    assert any(name.startswith('damaged_') for name in names)
+    assert any(not name.startswith('damaged_') for name in names)
+
+
+@pytest.mark.parametrize('path', CORPUS, ids=os.path.basename)
+def test_engines_agree(path):
+    assert compare_engines(_read(path)) is None
+
+
+@pytest.mark.parametrize('path', CORPUS, ids=os.path.basename)
+def test_engines_agree_on_mutations(path):
+    assert [difference for _, difference in check_file(path, MUTATIONS)] == []
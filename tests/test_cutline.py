@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from ozi_map.cutline import (INSIDE, OUTSIDE, PARTIAL, CutlineMasks, _cached_masks, _crossing_segments,
+                             build_cutline_masks, get_cutline_masks, rasterize_ring, simplify_ring)
+
+
+def _crossings_count(xs, ys):
+    points = np.column_stack([xs, ys])
+    if len(points) > 1 and (points[0] == points[-1]).all():
+        points = points[:-1]
+    return len(_crossing_segments(points, np.arange(len(points))))
+
+
+def _noisy_ring(seed):
+    """Star-like ring traced with noise, like cutline following map border"""
+    rnd = np.random.RandomState(seed)
+    count = rnd.randint(20, 2000)
+    angles = np.sort(rnd.uniform(0, 2 * np.pi, count))
+    radius = 200 + 80 * np.sin(angles * rnd.randint(2, 9)) + rnd.normal(0, rnd.uniform(0.5, 8), count)
+    radius = np.maximum(radius, 20)
+    return 320 + radius * np.cos(angles), 260 + radius * np.sin(angles)
+
+
+def _inside_polygon(xs, ys, px, py):
+    """Even-odd point in polygon test"""
+    inside = np.zeros(px.shape, dtype=bool)
+    for x0, y0, x1, y1 in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+        if y0 == y1:
+            continue
+        crosses = (y0 <= py) != (y1 <= py)
+        inside ^= crosses & (px < x0 + (py - y0) * (x1 - x0) / (y1 - y0))
+    return inside
+
+
+def _distance_to_ring(px, py, xs, ys):
+    dx, dy = np.roll(xs, -1) - xs, np.roll(ys, -1) - ys
+    t = ((px[:, None] - xs) * dx + (py[:, None] - ys) * dy) / (dx * dx + dy * dy)
+    t = np.clip(t, 0, 1)
+    return np.hypot(px[:, None] - xs - t * dx, py[:, None] - ys - t * dy).min(axis=1)
+
+
+def _unpack(packed, width):
+    return np.unpackbits(packed, axis=1)[:, :width].astype(bool)
+
+
+def test_simplify_ring_resolves_crossings():
+    # narrow spike next to the top edge, plain Douglas-Peucker cuts the spike through the edge
+    xs = [0, 49, 50, 51, 100, 100, 75, 50, 25, 0.]
+    ys = [0, 0, 101, 0, 0, 100, 101.5, 102, 101.5, 100.]
+    assert _crossings_count(xs, ys) == 0
+    assert _crossings_count(*simplify_ring(xs, ys, 3, preserve_topology=False)) > 0
+    simplified_xs, simplified_ys = simplify_ring(xs, ys, 3)
+    assert len(simplified_xs) < len(xs)
+    assert _crossings_count(simplified_xs, simplified_ys) == 0
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_simplify_ring_noisy(seed):
+    xs, ys = _noisy_ring(seed)
+    assert _crossings_count(xs, ys) == 0
+    for tolerance in (0.5, 2, 10, 40):
+        simplified_xs, simplified_ys = simplify_ring(xs, ys, tolerance)
+        assert 3 <= len(simplified_xs) <= len(xs)
+        assert _crossings_count(simplified_xs, simplified_ys) == 0
+        assert _distance_to_ring(xs, ys, simplified_xs, simplified_ys).max() <= tolerance + 1e-9
+
+
+def test_simplify_ring_keeps_closing_point():
+    xs, ys = _noisy_ring(0)
+    simplified_xs, simplified_ys = simplify_ring(np.append(xs, xs[0]), np.append(ys, ys[0]), 2)
+    assert (simplified_xs[0], simplified_ys[0]) == (simplified_xs[-1], simplified_ys[-1])
+    open_xs, open_ys = simplify_ring(xs, ys, 2)
+    assert open_xs.tolist() == simplified_xs[:-1].tolist()
+    assert open_ys.tolist() == simplified_ys[:-1].tolist()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rasterize_ring_matches_point_in_polygon(seed):
+    xs, ys = _noisy_ring(seed)
+    xs = xs + 0.25
+    width, height = 500 + seed * 37, 450 - seed * 29
+    mask = _unpack(rasterize_ring(xs, ys, width, height), width)
+    pixel_y, pixel_x = np.mgrid[0:height, 0:width] + 0.5
+    assert (mask == _inside_polygon(xs, ys, pixel_x, pixel_y)).all()
+
+
+def test_mask_pyramid():
+    xs, ys = _noisy_ring(1)
+    xs, ys = xs * 12, ys * 12
+    width, height = 8000, 6000
+    masks = build_cutline_masks(xs, ys, width, height, min_size=256)
+    assert len(masks.levels) == 6
+    for level, packed in enumerate(masks.levels):
+        level_width, level_height = masks.level_size(level)
+        assert packed.shape == (level_height, (level_width + 7) // 8)
+    assert masks.level_size(5) == (250, 188)
+    assert masks.level_size(1) == (4000, 3000)
+
+    full = _unpack(masks.levels[0], width)
+    assert (full == _unpack(rasterize_ring(*simplify_ring(xs, ys, 0.5) + (width, height)), width)).all()
+    for x0, y0, x1, y1 in [(-5, -3, 20, 30), (7990, 5990, 8010, 6010), (1003, 2001, 1517, 2345), (0, 0, width, height)]:
+        expected = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        clip_x0, clip_y0 = max(x0, 0), max(y0, 0)
+        expected[clip_y0 - y0:min(y1, height) - y0, clip_x0 - x0:min(x1, width) - x0] = full[clip_y0:y1, clip_x0:x1]
+        assert (masks.mask(0, x0, y0, x1, y1) == expected).all()
+
+    assert masks.window_state(0, 0, 0, 256, 256) == OUTSIDE
+    assert masks.window_state(0, 3800, 3000, 3900, 3100) == INSIDE
+    assert masks.window_state(0, 0, 3100, width, 3110) == PARTIAL
+    assert masks.window_state(0, width, height, width + 10, height + 10) == OUTSIDE
+
+    # coarser levels cover the same area
+    for level in range(1, len(masks.levels)):
+        level_width, level_height = masks.level_size(level)
+        coverage = _unpack(masks.levels[level], level_width).mean()
+        assert abs(coverage - full.mean()) < 0.01
+
+
+def test_empty_cutline_is_full_mask():
+    masks = build_cutline_masks([], [], 1000, 700)
+    assert len(masks.levels) == 3
+    for level in range(3):
+        level_width, level_height = masks.level_size(level)
+        assert masks.window_state(level, 0, 0, level_width, level_height) == INSIDE
+    assert masks.window_state(0, 990, 690, 1010, 710) == PARTIAL
+
+
+def test_masks_save_load(tmp_path):
+    xs, ys = _noisy_ring(2)
+    masks = build_cutline_masks(xs, ys, 700, 600, min_size=100)
+    path = str(tmp_path / 'masks.npz')
+    masks.save(path)
+    assert not os.path.exists(path + '.tmp')
+    loaded = CutlineMasks.load(path)
+    assert (loaded.width, loaded.height) == (700, 600)
+    assert len(loaded.levels) == len(masks.levels)
+    for level, packed in enumerate(masks.levels):
+        assert (loaded.levels[level] == packed).all()
+
+
+def _fail_read(*args, **kwargs):
+    raise AssertionError('map should not be read')
+
+
+def test_get_cutline_masks_cache(map_paths, tmp_path, monkeypatch):
+    map_path = map_paths[1]
+    cache_dir = str(tmp_path / 'masks')
+    masks = get_cutline_masks(map_path, cache_dir=cache_dir)
+    assert (masks.width, masks.height) == (8000, 6000)
+    assert masks.window_state(0, 3950, 2950, 4050, 3050) == INSIDE
+    assert masks.window_state(0, 0, 0, 8000, 6000) == PARTIAL
+    assert get_cutline_masks(map_path, cache_dir=cache_dir) is masks
+    cache_files = os.listdir(cache_dir)
+    assert len(cache_files) == 1
+
+    # masks are read from cache file when memory cache is empty
+    _cached_masks.cache_clear()
+    with monkeypatch.context() as patch:
+        patch.setattr('ozi_map.cutline.read_ozi_map_file', _fail_read)
+        reloaded = get_cutline_masks(map_path, cache_dir=cache_dir)
+    assert reloaded is not masks
+    assert os.listdir(cache_dir) == cache_files
+    for level, packed in enumerate(masks.levels):
+        assert (reloaded.levels[level] == packed).all()
+
+    # changed map gets new cache key, masks are rebuilt
+    st = os.stat(map_path)
+    os.utime(map_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    rebuilt = get_cutline_masks(map_path, cache_dir=cache_dir)
+    assert rebuilt is not masks
+    assert len(os.listdir(cache_dir)) == 2
+    for level, packed in enumerate(masks.levels):
+        assert (rebuilt.levels[level] == packed).all()
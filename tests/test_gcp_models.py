@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from ozi_map.gcp_models import (InterpolationGrid, PolynomialModel, ThinPlateSplineModel, fit_gcp_model,
+                                get_interpolation_grid)
+from ozi_map.transform import MapTransform
+
+
+WIDTH, HEIGHT = 8000, 6000
+
+
+def _warp(x, y):
+    """Smooth non-affine pixel -> projected mapping with coordinates of typical magnitude"""
+    u = x / WIDTH
+    v = y / HEIGHT
+    return (500000 + 2.5 * x + 0.3 * y + 40 * u * v + 25 * u * u,
+            6200000 - 2.5 * y + 0.2 * x + 30 * v * v - 15 * u * v)
+
+
+def _gcps(count, seed=0):
+    rnd = np.random.RandomState(seed)
+    src = np.column_stack([rnd.uniform(0, WIDTH, count), rnd.uniform(0, HEIGHT, count)])
+    return src, np.column_stack(_warp(src[:, 0], src[:, 1]))
+
+
+def _random_pixels(count, seed=1):
+    rnd = np.random.RandomState(seed)
+    return rnd.uniform(0, WIDTH, count), rnd.uniform(0, HEIGHT, count)
+
+
+def test_polynomial_reproduces_polynomial_mapping():
+    src, dst = _gcps(12)
+    model = PolynomialModel.fit(src, dst, 2)
+    assert model.residuals(src, dst).max() < 1e-6
+    x, y = _random_pixels(1000)
+    result_x, result_y = model.transform(x, y)
+    expected_x, expected_y = _warp(x, y)
+    assert np.hypot(result_x - expected_x, result_y - expected_y).max() < 1e-6
+
+
+def test_polynomial_order_reduces_residuals():
+    src, dst = _gcps(30)
+    residuals = [PolynomialModel.fit(src, dst, order).residuals(src, dst).max() for order in (1, 2)]
+    assert residuals[0] > 1
+    assert residuals[1] < 1e-6
+
+
+def test_polynomial_requires_enough_gcps():
+    src, dst = _gcps(5)
+    with pytest.raises(ValueError, match='at least 6 gcps'):
+        PolynomialModel.fit(src, dst, 2)
+    with pytest.raises(ValueError, match='unsupported order'):
+        PolynomialModel.fit(src, dst, 4)
+    with pytest.raises(ValueError, match='Unknown gcp model'):
+        fit_gcp_model(src, dst, 'spline')
+
+
+def test_tps_interpolates_gcps_exactly():
+    src, dst = _gcps(20)
+    model = ThinPlateSplineModel.fit(src, dst)
+    assert model.residuals(src, dst).max() < 1e-6
+    # between gcps spline follows smooth mapping it interpolates better than affine fit
+    x, y = _random_pixels(1000)
+    expected_x, expected_y = _warp(x, y)
+    errors = []
+    for fitted in (model, PolynomialModel.fit(src, dst, 1)):
+        result_x, result_y = fitted.transform(x, y)
+        errors.append(np.hypot(result_x - expected_x, result_y - expected_y).mean())
+    assert errors[0] < errors[1] / 2
+
+
+def test_tps_smoothing_trades_residuals_for_smoothness():
+    src, dst = _gcps(20)
+    noisy = dst + np.random.RandomState(2).normal(0, 3, dst.shape)
+    exact = ThinPlateSplineModel.fit(src, noisy)
+    smooth = ThinPlateSplineModel.fit(src, noisy, smoothing=1.0)
+    assert exact.residuals(src, noisy).max() < 1e-6
+    assert smooth.residuals(src, noisy).max() > 1e-3
+
+
+def test_models_compare_by_coefficients():
+    src, dst = _gcps(12)
+    assert fit_gcp_model(src, dst, 'tps') == fit_gcp_model(src, dst, 'tps')
+    assert hash(fit_gcp_model(src, dst, 'polynomial2')) == hash(fit_gcp_model(src, dst, 'polynomial2'))
+    assert fit_gcp_model(src, dst, 'polynomial2') != fit_gcp_model(src, dst, 'polynomial3')
+    assert fit_gcp_model(src, dst, 'polynomial2') != fit_gcp_model(src[1:], dst[1:], 'polynomial2')
+
+
+@pytest.mark.parametrize('tolerance', [1.0, 0.01])
+def test_grid_accuracy(tolerance):
+    src, dst = _gcps(30)
+    model = ThinPlateSplineModel.fit(src, dst)
+    grid = InterpolationGrid(model, 0, 0, WIDTH, HEIGHT, tolerance)
+    assert grid.max_error <= tolerance
+    x, y = _random_pixels(20000)
+    result_x, result_y = grid.transform(x, y)
+    expected_x, expected_y = model.transform(x, y)
+    assert np.hypot(result_x - expected_x, result_y - expected_y).max() <= tolerance
+
+
+def test_grid_evaluates_model_outside_extent():
+    src, dst = _gcps(30)
+    model = PolynomialModel.fit(src, dst, 3)
+    grid = InterpolationGrid(model, 0, 0, WIDTH / 2, HEIGHT / 2, 0.1)
+    x = np.array([-100.0, WIDTH, WIDTH / 2 + 1])
+    y = np.array([10.0, 10.0, HEIGHT])
+    np.testing.assert_array_equal(np.column_stack(grid.transform(x, y)), np.column_stack(model.transform(x, y)))
+    result_x, result_y = grid.transform(10.0, 20.0)
+    assert result_x.shape == () and result_y.shape == ()
+
+
+def test_grids_are_cached_by_model():
+    src, dst = _gcps(30)
+    grid = get_interpolation_grid(fit_gcp_model(src, dst, 'tps'), 0.0, 0.0, 100.0, 100.0, 0.5)
+    assert get_interpolation_grid(fit_gcp_model(src, dst, 'tps'), 0.0, 0.0, 100.0, 100.0, 0.5) is grid
+
+
+def test_map_transform_models(map_paths):
+    # 30 latlon gcps of a Lambert Conformal Conic map, which are not affine in projected coordinates
+    path = map_paths[2]
+    affine = MapTransform.from_ozi_file(path)
+    polynomial = MapTransform.from_ozi_file(path, method='polynomial2')
+    assert polynomial.residuals.max() < affine.residuals.max()
+    gridded = MapTransform.from_ozi_file(path, method='polynomial2', image_size=(WIDTH, HEIGHT), grid_tolerance=0.1)
+    x, y = _random_pixels(1000)
+    lon, lat = polynomial.pixel_to_latlon(x, y)
+    back_x, back_y = gridded.latlon_to_pixel(lon, lat)
+    direct_x, direct_y = polynomial.latlon_to_pixel(lon, lat)
+    assert np.hypot(back_x - direct_x, back_y - direct_y).max() <= 0.1
+    with pytest.raises(ValueError, match='image_size'):
+        MapTransform.from_ozi_file(path, method='tps', grid_tolerance=0.1)
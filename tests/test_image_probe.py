@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import io
+import struct
+
+import pytest
+
+from generate_maps import png_header
+from ozi_map.image_probe import ImageInfo, ImageProbeError, probe_image, probe_image_file
+
+
+def _jpeg(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    # fill bytes before marker are allowed
+    sof = b'\xff\xff\xc2' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + app0 + sof + b'\xff\xda\x00\x02'
+
+
+def _tiff(width, height, byte_order='<', field_type=3):
+    value_format = {3: 'H', 4: 'I'}[field_type]
+    magic = b'II' if byte_order == '<' else b'MM'
+    entries = [(254, 4, 1, struct.pack(byte_order + 'I', 0)),
+               (256, field_type, 1, struct.pack(byte_order + value_format, width).ljust(4, b'\0')),
+               (257, field_type, 1, struct.pack(byte_order + value_format, height).ljust(4, b'\0'))]
+    # IFD is placed after some image data
+    data = magic + struct.pack(byte_order + 'HI', 42, 108) + b'\0' * 100
+    data += struct.pack(byte_order + 'H', len(entries))
+    for tag, entry_type, count, value in entries:
+        data += struct.pack(byte_order + 'HHI', tag, entry_type, count) + value
+    return data + b'\0' * 4
+
+
+def _bigtiff(width, height):
+    data = b'II' + struct.pack('<HHHQ', 43, 8, 0, 16)
+    data += struct.pack('<Q', 2)
+    data += struct.pack('<HHQQ', 256, 16, 1, width)
+    data += struct.pack('<HHQQ', 257, 3, 1, height)
+    return data
+
+
+def _bmp(width, height, dib_header_size=40):
+    if dib_header_size == 12:
+        dib = struct.pack('<IHHHH', 12, width, height, 1, 24)
+    else:
+        dib = struct.pack('<IiiHH', dib_header_size, width, height, 1, 24).ljust(dib_header_size, b'\0')
+    return b'BM' + struct.pack('<IHHI', 14 + len(dib), 0, 0, 14 + len(dib)) + dib
+
+
+@pytest.mark.parametrize('data, expected', [
+    (png_header(8000, 6000), ImageInfo('PNG', 8000, 6000)),
+    (_jpeg(4321, 1234), ImageInfo('JPEG', 4321, 1234)),
+    (_tiff(70000, 300, '<', 4), ImageInfo('TIFF', 70000, 300)),
+    (_tiff(640, 480, '>', 3), ImageInfo('TIFF', 640, 480)),
+    (_bigtiff(100000, 200), ImageInfo('TIFF', 100000, 200)),
+    (_bmp(300, -200), ImageInfo('BMP', 300, 200)),
+    (_bmp(30, 20, 12), ImageInfo('BMP', 30, 20)),
+    (b'GIF89a' + struct.pack('<HH', 320, 240) + b'\0' * 10, ImageInfo('GIF', 320, 240)),
+], ids=['png', 'jpeg', 'tiff-le-long', 'tiff-be-short', 'bigtiff', 'bmp-top-down', 'bmp-os2', 'gif'])
+def test_probe_image_file(data, expected):
+    assert probe_image_file(io.BytesIO(data)) == expected
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'', 'Unknown image format'),
+    (b'not an image at all', 'Unknown image format'),
+    (b'II*\x00', 'Truncated image header'),
+    (_tiff(640, 480)[:120], 'Truncated image header'),
+    (_jpeg(10, 10)[:24], 'Truncated image header'),
+    (b'\xff\xd8\xff\xda\x00\x02', 'JPEG file has no frame header'),
+    (png_header(10, 10)[:8] + b'\0' * 20, 'PNG file has no IHDR chunk'),
+])
+def test_probe_image_file_errors(data, message):
+    with pytest.raises(ImageProbeError, match=message):
+        probe_image_file(io.BytesIO(data))
+
+
+def test_probe_image_reads_header_only(tmp_path):
+    path = tmp_path / 'image.png'
+    # image data is never decoded, so anything may follow the header
+    path.write_bytes(png_header(123, 45) + b'garbage' * 1000)
+    assert probe_image(str(path)) == ImageInfo('PNG', 123, 45)
+    path.write_bytes(b'garbage')
+    with pytest.raises(ImageProbeError, match='image.png'):
+        probe_image(str(path))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from ozi_map.sync import MANIFEST_NAME, load_manifest, sync_once
+
+
+# outputs are written with maprec
+pytest.importorskip('maprec')
+
+
+def _output_path(out_dir, map_path):
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(map_path))[0] + '.maprec')
+
+
+def test_converts_only_changed_maps(tmp_path, map_paths):
+    src_dir = os.path.dirname(map_paths[0])
+    out_dir = str(tmp_path / 'out')
+    summary = sync_once(src_dir, out_dir, workers=1)
+    assert sorted(summary['converted']) == sorted(map_paths)
+    assert all(os.path.exists(_output_path(out_dir, path)) for path in map_paths)
+    manifest = load_manifest(os.path.join(out_dir, MANIFEST_NAME))
+    assert sorted(manifest['maps']) == sorted(os.path.abspath(path) for path in map_paths)
+
+    summary = sync_once(src_dir, out_dir, workers=1)
+    assert summary['converted'] == [] and sorted(summary['unchanged']) == sorted(map_paths)
+
+    with open(map_paths[1], 'ab') as f:
+        f.write(b'\r\n')
+    summary = sync_once(src_dir, out_dir, workers=1)
+    assert summary['converted'] == [map_paths[1]]
+
+
+def test_deletes_outputs_of_removed_maps(tmp_path, map_paths):
+    src_dir = os.path.dirname(map_paths[0])
+    out_dir = str(tmp_path / 'out')
+    sync_once(src_dir, out_dir, workers=1)
+    os.remove(map_paths[0])
+    summary = sync_once(src_dir, out_dir, workers=1)
+    assert summary['deleted'] == [os.path.abspath(map_paths[0])]
+    assert not os.path.exists(_output_path(out_dir, map_paths[0]))
+    assert all(os.path.exists(_output_path(out_dir, path)) for path in map_paths[1:])
+    manifest = load_manifest(os.path.join(out_dir, MANIFEST_NAME))
+    assert os.path.abspath(map_paths[0]) not in manifest['maps']
+
+
+def test_removes_output_of_map_failing_to_convert(tmp_path, map_paths):
+    src_dir = os.path.dirname(map_paths[0])
+    out_dir = str(tmp_path / 'out')
+    sync_once(src_dir, out_dir, workers=1)
+    with open(map_paths[0], 'w') as f:
+        f.write('not a map\n')
+    summary = sync_once(src_dir, out_dir, workers=1)
+    assert summary['failed'] == [map_paths[0]]
+    assert not os.path.exists(_output_path(out_dir, map_paths[0]))